@@ -0,0 +1,131 @@
+# Caché semántica de respuestas: preguntas iguales o casi iguales (por
+# similitud coseno del embedding de la consulta) reutilizan la respuesta ya
+# generada mientras no cambie el corpus indexado
+
+import os
+import time
+import threading
+import numpy as np
+from cache import register
+from metrics import CACHE_REQUESTS
+
+# ===============================
+# Configuración
+# ===============================
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2048"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+_version_lock = threading.Lock()
+_corpus_version = 0
+
+
+def corpus_version() -> int:
+    return _corpus_version
+
+
+def bump_corpus_version():
+    """Se llama al indexar o eliminar PDFs; invalida las respuestas cacheadas."""
+    global _corpus_version
+    with _version_lock:
+        _corpus_version += 1
+    answer_cache.clear()
+
+
+class SemanticAnswerCache:
+    """
+    Entradas en un buffer circular de tamaño fijo: una matriz float32
+    (max_size x dim) con los embeddings normalizados y arreglos paralelos de
+    expiración y versión del corpus. La búsqueda es un único producto
+    matriz-vector.
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._expires = np.zeros(self.max_size, dtype=np.float64)
+        self._versions = np.full(self.max_size, -1, dtype=np.int64)
+        self._scopes = np.zeros(self.max_size, dtype=np.int16)
+        self._scope_ids = {}
+        self._answers = [None] * self.max_size
+        self._next = 0
+        register("answers", self)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _scope_id(self, scope: str) -> int:
+        return self._scope_ids.setdefault(scope, len(self._scope_ids))
+
+    def get(self, vector, version: int, scope: str = ""):
+        """
+        Respuesta cacheada más similar por encima del umbral, o None. `scope`
+        separa respuestas generadas con distintas fuentes (PDFs, web, ambas).
+        """
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="answers", result="miss")
+                return None
+            valid = (
+                (self._versions == version)
+                & (self._scopes == self._scope_id(scope))
+                & (self._expires > time.time())
+            )
+            if not valid.any():
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="answers", result="miss")
+                return None
+            scores = np.where(valid, self._matrix @ vector, -1.0)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="answers", result="miss")
+                return None
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="answers", result="hit")
+            return self._answers[best]
+
+    def set(self, vector, answer, version: int, scope: str = ""):
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                self._matrix = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self._versions.fill(-1)
+            slot = self._next
+            self._next = (self._next + 1) % self.max_size
+            self._matrix[slot] = vector
+            self._expires[slot] = time.time() + self.ttl if self.ttl > 0 else np.inf
+            self._versions[slot] = version
+            self._scopes[slot] = self._scope_id(scope)
+            self._answers[slot] = answer
+
+    def clear(self):
+        with self._lock:
+            self._versions.fill(-1)
+            self._answers = [None] * self.max_size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": int((self._versions == _corpus_version).sum()),
+            "max_size": self.max_size,
+            "corpus_version": _corpus_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+answer_cache = SemanticAnswerCache()
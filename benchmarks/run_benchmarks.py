@@ -0,0 +1,499 @@
+# Benchmark de extremo a extremo sin servicios externos: levanta main.app
+# sobre la interfaz ASGI con sustitutos locales (ver standins.py), mide la
+# ingesta y /ask bajo concurrencia y compara contra una línea base guardada
+#
+# Uso:
+#   python benchmarks/run_benchmarks.py                   # todos los escenarios
+#   python benchmarks/run_benchmarks.py --save-baseline   # guarda la línea base
+#   python benchmarks/run_benchmarks.py --check           # sale con error si hay regresiones
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+from standins import (  # noqa: E402
+    LocalContainerClient,
+    AsyncLocalQdrant,
+    RemoteLikeQdrant,
+    FixtureScholarDriver,
+    FakeLLMServer,
+    HashingEmbeddingBackend,
+    make_pdf,
+)
+
+# ===============================
+# Configuración
+# ===============================
+BASELINE_PATH = BENCH_DIR / "baselines.json"
+SCHOLAR_FIXTURE = BENCH_DIR / "fixtures" / "scholar_results.html"
+SCENARIOS = ["ingest", "ask_local", "ask_web", "ask_both", "ask_stream", "ask_cached", "bulk_write"]
+# Métricas que se comparan con la línea base y si más es mejor
+COMPARED = {"p95_ms": False, "p99_ms": False, "rps": True, "pages_per_s": True, "points_per_s": True,
+            "peak_rss_mb": False, "ready_s": False}
+
+TOPICS = [
+    "dense retrieval", "sparse retrieval", "cross encoder reranking", "vector quantization",
+    "approximate nearest neighbours", "query expansion", "document chunking", "hybrid search",
+    "answer synthesis", "semantic caching", "embedding models", "knowledge graphs",
+    "prompt compression", "evaluation metrics", "hallucination detection", "tail latency",
+]
+FILLER = (
+    "The experiments measure recall precision and latency on several collections while the "
+    "ablation varies batch size index parameters and the number of candidates passed to the "
+    "reranker. Results show consistent gains over strong baselines with modest memory overhead."
+).split()
+
+# ===============================
+# Corpus y entorno
+# ===============================
+def build_corpus(root: Path, n_pdfs: int, pages_per_pdf: int) -> int:
+    """Genera PDFs sintéticos bajo BD_Knowledge/; retorna el total de páginas."""
+    folder = root / "BD_Knowledge"
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(n_pdfs):
+        topic = TOPICS[i % len(TOPICS)]
+        pages = []
+        for p in range(pages_per_pdf):
+            words = [f"{topic} section {p + 1} of document {i}."]
+            for k in range(220):
+                words.append(FILLER[(i + p + k) % len(FILLER)])
+                if k % 25 == 0:
+                    words.append(TOPICS[(i + k) % len(TOPICS)])
+            pages.append(" ".join(words))
+        (folder / f"paper_{i:04d}.pdf").write_bytes(make_pdf(pages))
+    return n_pdfs * pages_per_pdf
+
+
+def configure_environment(args, workdir: Path, llm_endpoint: str):
+    """Variables que la app lee al importarse: todo apunta a los sustitutos y a `workdir`."""
+    os.environ.update({
+        "QDRANT_URL": "http://qdrant.local:6333",
+        "QDRANT_API_KEY1": "bench",
+        "AZURE_STORAGE_SAS_TOKEN": "https://bench.blob.core.windows.net/pdfs?sv=bench",
+        "OPEN_AI_API_KEY_1": "bench",
+        "OPEN_AI_ENDPOINT": llm_endpoint,
+        "OPEN_AI_DEPLOYMENT": "bench-deployment",
+        "EMBEDDING_BACKEND": args.embedding_backend,
+        "EMBEDDING_STORE_DIR": str(workdir / "embedding_store"),
+        "CHUNK_STORE_DIR": str(workdir / "chunk_store"),
+        "QDRANT_STORAGE_MODE": args.storage_mode,
+        "BM25_INDEX_PATH": str(workdir / "bm25_index.npz"),
+        "INGESTION_QUEUE_PATH": str(workdir / "ingestion_queue.db"),
+        "BLOB_SYNC_MANIFEST": str(workdir / "blob_manifest.json"),
+        "BLOB_SYNC_INTERVAL": "0",
+        "MEMORY_BACKEND": "memory",
+        "RERANK_ENABLED": "true" if args.rerank else "false",
+        "SCHOLAR_POOL_SIZE": str(args.scholar_pool),
+    })
+    os.environ.pop("SEARCH_CACHE_PATH", None)
+    os.environ.pop("QUERY_EMBEDDING_CACHE_PATH", None)
+
+
+def install_standins(args, blob_root: Path):
+    """Reemplaza los clientes externos antes de que la app los construya."""
+    import qdrant_client
+    from azure.storage.blob import ContainerClient
+    from selenium import webdriver
+
+    local = qdrant_client.QdrantClient(path=args.qdrant_path) if args.qdrant_path \
+        else qdrant_client.QdrantClient(location=":memory:")
+    local = RemoteLikeQdrant(local, latency_s=args.qdrant_latency_ms / 1000)
+    qdrant_client.QdrantClient = lambda *a, **k: local
+    qdrant_client.AsyncQdrantClient = lambda *a, **k: AsyncLocalQdrant(local)
+
+    container = LocalContainerClient(blob_root, latency_s=args.blob_latency_ms / 1000)
+    ContainerClient.from_container_url = classmethod(lambda cls, url, **k: container)
+
+    template = SCHOLAR_FIXTURE.read_text(encoding="utf-8")
+    webdriver.Chrome = lambda *a, **k: FixtureScholarDriver(template, args.scholar_latency_ms / 1000)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Ejecuta el arranque y el apagado de la app por el protocolo lifespan de ASGI."""
+    sent = asyncio.Queue()
+    received = asyncio.Queue()
+    await sent.put({"type": "lifespan.startup"})
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}},
+                                   sent.get, received.put))
+    message = await received.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(f"❌ Falló el arranque de la app: {message}")
+    try:
+        yield
+    finally:
+        await sent.put({"type": "lifespan.shutdown"})
+        await received.get()
+        await task
+
+# ===============================
+# Medición
+# ===============================
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso (ru_maxrss está en KB en Linux y en bytes en macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def children_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def run_load(send, n_requests: int, concurrency: int) -> dict:
+    """
+    Lanza `n_requests` con `concurrency` clientes simultáneos. `send(i)`
+    retorna (ok, cached, stages) con el resultado de cada etapa del plan, para
+    que un timeout que acorta la latencia no pase desapercibido.
+    """
+    latencies = []
+    errors = 0
+    cached = 0
+    outcomes = {}
+    next_index = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors, cached
+        for i in next_index:
+            t0 = time.perf_counter()
+            try:
+                ok, hit, stages = await send(i)
+            except Exception as e:
+                print(f"⚠️ Request {i} falló: {e!r}")
+                ok, hit, stages = False, False, {}
+            latencies.append(time.perf_counter() - t0)
+            errors += not ok
+            cached += bool(hit)
+            for stage, outcome in stages.items():
+                key = f"{stage}:{outcome}"
+                outcomes[key] = outcomes.get(key, 0) + 1
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - t_start
+    ms = [l * 1000 for l in latencies]
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "cache_hits": cached,
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "p99_ms": round(percentile(ms, 99), 1),
+        "max_ms": round(max(ms, default=0.0), 1),
+        "rps": round(n_requests / elapsed, 2) if elapsed else 0.0,
+        "seconds": round(elapsed, 3),
+        "stages": dict(sorted(outcomes.items())),
+    }
+
+
+def question(i: int, salt: str) -> str:
+    a = TOPICS[i % len(TOPICS)]
+    b = TOPICS[(i * 5 + 3) % len(TOPICS)]
+    return f"How does {a} interact with {b} ({salt} {i})?"
+
+# ===============================
+# Escenarios
+# ===============================
+async def bench_ingest(client, expected_docs: int, timeout: float) -> dict:
+    """Sincroniza el contenedor y espera a que el worker indexe todos los PDFs."""
+    t0 = time.perf_counter()
+    response = await client.post("/ingest")
+    response.raise_for_status()
+    deadline = time.monotonic() + timeout
+    while True:
+        jobs = (await client.get("/ingest/jobs", params={"limit": expected_docs})).json()["jobs"]
+        finished = [j for j in jobs if j["status"] in ("done", "failed")]
+        if len(finished) >= expected_docs:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"❌ Ingesta incompleta tras {timeout}s ({len(finished)}/{expected_docs})")
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    pages = sum(j["stats"].get("pages", 0) for j in jobs if j["status"] == "done")
+    return {
+        "documents": expected_docs,
+        "failed": sum(j["status"] == "failed" for j in jobs),
+        "pages": pages,
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 2) if elapsed else 0.0,
+        "docs_per_s": round(expected_docs / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def bench_bulk_write(n_points: int, workers: int) -> dict:
+    """Escribe `n_points` puntos aleatorios con `workers` hilos en una colección aparte."""
+    import random
+    from qdrant_client.models import PointStruct, VectorParams, Distance
+    from bulk_writer import BulkWriter
+    from clients import get_qdrant_client
+    from embeddings import embedding_service
+
+    client = get_qdrant_client()
+    name = f"bench_bulk_w{workers}"
+    dim = embedding_service.dimension()
+    client.create_collection(collection_name=name, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+    rng = random.Random(workers)
+    points = [
+        PointStruct(id=i, vector=[rng.uniform(-1, 1) for _ in range(dim)], payload={"type": "bench"})
+        for i in range(n_points)
+    ]
+    writer = BulkWriter(get_qdrant_client, name, workers=workers)
+    try:
+        t0 = time.perf_counter()
+        writer.existing_ids([p.id for p in points])
+        exists_s = time.perf_counter() - t0
+        stats = writer.write(points)
+    finally:
+        client.delete_collection(collection_name=name)
+    return {
+        "points": n_points,
+        "workers": workers,
+        "failed": stats["failed"],
+        "exists_s": round(exists_s, 3),
+        "seconds": stats["seconds"],
+        "points_per_s": stats["points_per_s"],
+        "batch_size": stats["batch_size"],
+    }
+
+
+def ask_sender(client, source: str, salt: str, repeat: bool = False):
+    async def send(i):
+        body = {"question": question(0 if repeat else i, salt), "source": source}
+        response = await client.post("/ask", json=body)
+        data = response.json()
+        return response.status_code == 200, data.get("cached"), data.get("plan", {}).get("stages", {})
+    return send
+
+
+def stream_sender(client, salt: str):
+    async def send(i):
+        body = {"question": question(i, salt), "source": "both"}
+        response = await client.post("/ask/stream", json=body)
+        events = [block.split("\ndata: ", 1) for block in response.text.split("\n\n") if block]
+        done = [json.loads(data) for event, data in events if event == "event: done"]
+        stages = done[0].get("plan", {}).get("stages", {}) if done else {}
+        return response.status_code == 200 and bool(done), bool(done and done[0].get("cached")), stages
+    return send
+
+
+async def wait_until_ready(client, timeout: float) -> float:
+    """Segundos hasta que /readyz responde 200 (calentamiento en segundo plano)."""
+    t0 = time.perf_counter()
+    while (await client.get("/readyz")).status_code != 200:
+        if time.perf_counter() - t0 > timeout:
+            raise TimeoutError(f"❌ La app no quedó lista en {timeout}s")
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - t0
+
+
+async def run_each(args, client, results: dict):
+    """Ejecuta los escenarios pedidos en orden (la ingesta primero, para tener corpus)."""
+    for name in args.scenarios:
+        print(f"⏱️ Escenario {name}...")
+        if name == "bulk_write":
+            # Un resultado por cantidad de hilos, para ver cómo escala
+            for workers in args.write_workers:
+                result = await asyncio.to_thread(bench_bulk_write, args.write_points, workers)
+                result["peak_rss_mb"] = peak_rss_mb()
+                results[f"{name}_w{workers}"] = result
+                print(f"   {json.dumps(result)}")
+            continue
+        if name == "ingest":
+            result = await bench_ingest(client, args.pdfs, args.request_timeout)
+        elif name == "ask_stream":
+            result = await run_load(stream_sender(client, name), args.requests, args.concurrency)
+        elif name == "ask_cached":
+            # Primero se llena la caché y luego se mide solo con aciertos
+            await ask_sender(client, "both", name, repeat=True)(0)
+            result = await run_load(ask_sender(client, "both", name, repeat=True),
+                                    args.requests, args.concurrency)
+        else:
+            source = {"ask_local": "pdf", "ask_web": "web", "ask_both": "both"}[name]
+            result = await run_load(ask_sender(client, source, name), args.requests, args.concurrency)
+        result["peak_rss_mb"] = peak_rss_mb()
+        results[name] = result
+        print(f"   {json.dumps(result)}")
+
+
+async def run_scenarios(args, n_pages: int) -> dict:
+    import httpx
+    t0 = time.perf_counter()
+    import embeddings
+    embeddings.register_backend("hashing", HashingEmbeddingBackend)
+    import main
+    import_s = time.perf_counter() - t0
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 timeout=args.request_timeout) as client:
+        t0 = time.perf_counter()
+        async with lifespan(main.app):
+            startup_s = time.perf_counter() - t0
+            ready_s = await wait_until_ready(client, args.request_timeout)
+            print(f"🔥 App lista: importación {import_s:.2f}s, arranque {startup_s:.2f}s, calentamiento {ready_s:.2f}s")
+            await run_each(args, client, results)
+
+        results["_process"] = {
+            "import_s": round(import_s, 3),
+            "startup_s": round(startup_s, 3),
+            "ready_s": round(ready_s, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "children_peak_rss_mb": children_peak_rss_mb(),
+            "corpus_pages": n_pages,
+        }
+    return results
+
+# ===============================
+# Línea base
+# ===============================
+def run_config(args) -> dict:
+    keys = ("pdfs", "pages", "requests", "concurrency", "llm_latency_ms", "llm_tokens_per_s",
+            "scholar_latency_ms", "blob_latency_ms", "qdrant_latency_ms", "write_points", "write_workers",
+            "embedding_backend", "rerank", "qdrant_path")
+    return {k: getattr(args, k) for k in keys}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regresiones de más de `tolerance` (fracción) respecto a la línea base."""
+    regressions = []
+    for scenario, metrics in results.items():
+        base = baseline.get(scenario, {})
+        for metric, higher_is_better in COMPARED.items():
+            if metric not in metrics or not base.get(metric):
+                continue
+            change = (metrics[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                regressions.append(
+                    f"{scenario}.{metric}: {base[metric]} -> {metrics[metric]} ({change:+.0%})"
+                )
+    return regressions
+
+
+def print_report(results: dict):
+    columns = ["p50_ms", "p95_ms", "p99_ms", "rps", "errors", "cache_hits", "pages_per_s", "points_per_s",
+               "peak_rss_mb"]
+    print("\n" + f"{'escenario':<15}" + "".join(f"{c:>13}" for c in columns))
+    for name, metrics in results.items():
+        if name.startswith("_"):
+            continue
+        print(f"{name:<15}" + "".join(f"{str(metrics.get(c, '-')):>13}" for c in columns))
+    process = results.get("_process", {})
+    print(f"\nRSS pico: {process.get('peak_rss_mb')} MB (procesos hijos: {process.get('children_peak_rss_mb')} MB)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline RAG")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--pdfs", type=int, default=40, help="PDFs sintéticos en el contenedor")
+    parser.add_argument("--pages", type=int, default=8, help="Páginas por PDF")
+    parser.add_argument("--requests", type=int, default=100, help="Requests por escenario de /ask")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Espera hasta el primer token")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=200, help="Velocidad del streaming (0 = sin espera)")
+    parser.add_argument("--llm-answer-tokens", type=int, default=60)
+    parser.add_argument("--scholar-latency-ms", type=float, default=200, help="Carga de cada página de Scholar")
+    parser.add_argument("--scholar-pool", type=int, default=2, help="Navegadores en el pool")
+    parser.add_argument("--blob-latency-ms", type=float, default=0, help="Latencia por descarga de blob")
+    parser.add_argument("--embedding-backend", default="hashing",
+                        help="hashing (sin modelo), sentence-transformers u onnx")
+    parser.add_argument("--rerank", action="store_true", help="Activa el cross-encoder (descarga el modelo)")
+    parser.add_argument("--qdrant-path", default=None, help="Qdrant local en disco en vez de :memory:")
+    parser.add_argument("--qdrant-latency-ms", type=float, default=5, help="Latencia de red de cada llamada a Qdrant")
+    parser.add_argument("--write-points", type=int, default=5000, help="Puntos por corrida de bulk_write")
+    parser.add_argument("--write-workers", type=int, nargs="+", default=[1, 4, 8],
+                        help="Hilos de escritura a comparar en bulk_write")
+    parser.add_argument("--storage-mode", choices=["full", "compact"], default="full",
+                        help="QDRANT_STORAGE_MODE: texto en el payload o en el almacén local de fragmentos")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--workdir", default=None, help="Directorio para corpus y estado (por defecto temporal)")
+    parser.add_argument("--output", default=None, help="Guarda los resultados en JSON")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Código de salida 1 si hay regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Regresión tolerada (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        workdir = Path(args.workdir or tmp)
+        blob_root = workdir / "blobs"
+        n_pages = build_corpus(blob_root, args.pdfs, args.pages)
+        print(f"📚 Corpus sintético: {args.pdfs} PDFs, {n_pages} páginas en {blob_root}")
+
+        llm = FakeLLMServer(
+            latency_s=args.llm_latency_ms / 1000,
+            tokens_per_s=args.llm_tokens_per_s,
+            answer_tokens=args.llm_answer_tokens,
+        ).start()
+        print(f"🤖 Servidor LLM falso en {llm.endpoint}")
+        try:
+            configure_environment(args, workdir, llm.endpoint)
+            install_standins(args, blob_root)
+            results = asyncio.run(run_scenarios(args, n_pages))
+            results["_process"]["llm_requests"] = dict(llm.stats)
+        finally:
+            llm.stop()
+
+    print_report(results)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "config": run_config(args),
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if baseline.get("config") != report["config"]:
+            print("⚠️ La línea base se midió con otra configuración; la comparación es orientativa")
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            print(f"\n❌ Regresiones respecto a {baseline_path.name} (tolerancia {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"   {line}")
+        else:
+            print(f"\n✅ Sin regresiones respecto a {baseline_path.name}")
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"💾 Línea base guardada en {baseline_path}")
+
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
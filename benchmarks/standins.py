@@ -0,0 +1,412 @@
+# Sustitutos locales de los servicios externos para los benchmarks: un
+# directorio como contenedor de Azure Blob, Qdrant en modo local, un Chrome
+# falso que sirve un HTML fijo de Scholar y un servidor de chat completions
+# con latencia configurable. Se instalan en el límite de cada librería
+# (antes de importar la aplicación) para que el código de la app corra sin
+# cambios
+
+import time
+import json
+import socket
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timezone
+from html import escape
+from html.parser import HTMLParser
+from pathlib import Path
+
+import numpy as np
+
+# ===============================
+# Contenedor de blobs en un directorio local
+# ===============================
+class LocalBlob:
+    """Propiedades de un blob que usan la sincronización y la ingesta."""
+
+    def __init__(self, name: str, path: Path):
+        stat = path.stat()
+        self.name = name
+        self.size = stat.st_size
+        self.etag = hashlib.md5(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        self.last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+
+
+class _LocalDownload:
+    def __init__(self, path: Path):
+        self._path = path
+
+    def readall(self) -> bytes:
+        return self._path.read_bytes()
+
+
+class LocalContainerClient:
+    """Misma interfaz que azure ContainerClient para listar y descargar blobs."""
+
+    def __init__(self, root: Path, latency_s: float = 0.0):
+        self.root = Path(root)
+        self.latency_s = latency_s
+
+    def list_blobs(self, name_starts_with: str = None, **kwargs):
+        for path in sorted(self.root.rglob("*")):
+            if not path.is_file():
+                continue
+            name = path.relative_to(self.root).as_posix()
+            if name_starts_with and not name.startswith(name_starts_with):
+                continue
+            yield LocalBlob(name, path)
+
+    def download_blob(self, blob, **kwargs):
+        name = getattr(blob, "name", blob)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        path = self.root / name
+        if not path.is_file():
+            raise FileNotFoundError(f"Blob no encontrado: {name}")
+        return _LocalDownload(path)
+
+
+def make_pdf(pages: list[str]) -> bytes:
+    """PDF mínimo con una página de texto (Helvetica) por elemento de `pages`."""
+    objects = []
+    page_ids = []
+    font_id = 3
+    for text in pages:
+        lines, line = [], ""
+        for word in text.split():
+            if len(line) + len(word) > 90:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}".strip()
+        lines.append(line)
+        safe = [l.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for l in lines]
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " T* ".join(f"({l}) Tj" for l in safe) + " ET"
+        content_id = 4 + len(objects)
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        page_ids.append(4 + len(objects))
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ] + objects
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+# ===============================
+# Qdrant local
+# ===============================
+class RemoteLikeQdrant:
+    """
+    Cliente local con la latencia de red de un servidor: cada llamada espera
+    `latency_s` fuera del lock y luego se ejecuta en serie (el modo local no
+    admite llamadas concurrentes). Así las llamadas en paralelo se solapan
+    como contra un servidor real.
+    """
+
+    def __init__(self, client, latency_s: float = 0.0):
+        self._client = client
+        self.latency_s = latency_s
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if self.latency_s:
+                time.sleep(self.latency_s)
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+class AsyncLocalQdrant:
+    """
+    Cliente asíncrono sobre el mismo cliente local que usa el camino
+    síncrono (dos clientes locales no comparten datos). Cada llamada corre
+    en un hilo, como la espera de red de un servidor real.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+# ===============================
+# Google Scholar con HTML fijo
+# ===============================
+class FixtureElement:
+    """Elemento del HTML con la parte de la API de Selenium que usa web_searcher."""
+
+    def __init__(self, tag: str, attrs: dict, parent=None):
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        self._text = []
+
+    @property
+    def classes(self) -> set:
+        return set(self.attrs.get("class", "").split())
+
+    @property
+    def text(self) -> str:
+        parts = list(self._text)
+        for child in self.children:
+            parts.append(child.text)
+        return " ".join(" ".join(parts).split())
+
+    def get_attribute(self, name: str):
+        return self.attrs.get(name)
+
+    def _descendants(self):
+        for child in self.children:
+            yield child
+            yield from child._descendants()
+
+    def _matches(self, simple: str) -> bool:
+        tag, _, rest = simple.partition(".")
+        if "#" in tag:
+            tag, element_id = tag.split("#", 1)
+            if self.attrs.get("id") != element_id:
+                return False
+        if tag and tag != self.tag:
+            return False
+        return not rest or set(rest.split(".")) <= self.classes
+
+    def select(self, selector: str) -> list:
+        """Selectores CSS simples: etiqueta, .clase, #id y descendientes."""
+        current = [self]
+        for simple in selector.split():
+            found = []
+            for element in current:
+                found.extend(d for d in element._descendants() if d._matches(simple) and d not in found)
+            current = found
+        return current
+
+    def find_elements(self, by: str, value: str) -> list:
+        if by == "id":
+            value = f"#{value}"
+        elif by == "class name":
+            value = f".{value}"
+        return self.select(value)
+
+    def find_element(self, by: str, value: str):
+        from selenium.common.exceptions import NoSuchElementException
+        found = self.find_elements(by, value)
+        if not found:
+            raise NoSuchElementException(f"{by}={value}")
+        return found[0]
+
+
+class _FixtureParser(HTMLParser):
+    VOID = {"br", "img", "input", "meta", "link", "hr"}
+
+    def __init__(self):
+        super().__init__()
+        self.root = FixtureElement("#document", {})
+        self._current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        element = FixtureElement(tag, dict(attrs), self._current)
+        self._current.children.append(element)
+        if tag not in self.VOID:
+            self._current = element
+
+    def handle_endtag(self, tag):
+        node = self._current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self._current = node.parent
+
+    def handle_data(self, data):
+        if data.strip():
+            self._current._text.append(data)
+
+
+class FixtureScholarDriver:
+    """
+    Sustituto de webdriver.Chrome: `get` espera `latency_s` y carga la
+    plantilla HTML con la consulta y la página de la URL pedida.
+    """
+
+    def __init__(self, template: str, latency_s: float = 0.0):
+        self.template = template
+        self.latency_s = latency_s
+        self._document = FixtureElement("#document", {})
+
+    def get(self, url: str):
+        from urllib.parse import urlparse, parse_qs
+        params = parse_qs(urlparse(url).query)
+        query = params.get("q", [""])[0]
+        page = int(params.get("start", ["0"])[0]) // 10 + 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        parser = _FixtureParser()
+        parser.feed(self.template.replace("{query}", escape(query)).replace("{page}", str(page)))
+        self._document = parser.root
+
+    def execute_script(self, script, *args):
+        return 1
+
+    def find_elements(self, by, value):
+        return self._document.find_elements(by, value)
+
+    def find_element(self, by, value):
+        return self._document.find_element(by, value)
+
+    def quit(self):
+        pass
+
+# ===============================
+# Servidor de chat completions
+# ===============================
+def _fake_answer(prompt: str, n_tokens: int) -> list[str]:
+    """Respuesta determinista con palabras del prompt (para que el texto varíe por consulta)."""
+    words = [w for w in prompt.split() if w.isalpha()] or ["respuesta"]
+    return [words[(i * 7) % len(words)] for i in range(n_tokens)]
+
+
+def create_llm_app(latency_s: float = 0.5, tokens_per_s: float = 0.0, answer_tokens: int = 60):
+    """
+    App con la ruta de Azure OpenAI para chat completions: espera `latency_s`
+    antes del primer token y, en streaming, emite `tokens_per_s` tokens por
+    segundo (0 = todos de una vez).
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI()
+    stats = {"requests": 0, "streamed": 0}
+    app.state.stats = stats
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        prompt = " ".join(m.get("content", "") for m in body.get("messages", []))
+        tokens = _fake_answer(prompt, min(answer_tokens, int(body.get("max_tokens") or answer_tokens)))
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(tokens),
+                 "total_tokens": len(prompt) // 4 + len(tokens)}
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": deployment}
+        stats["requests"] += 1
+        await asyncio.sleep(latency_s)
+
+        if not body.get("stream"):
+            return JSONResponse({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(tokens)}}],
+                "usage": usage,
+            })
+
+        stats["streamed"] += 1
+
+        async def chunks():
+            for i, token in enumerate(tokens):
+                delta = {"content": token if i == 0 else f" {token}"}
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if tokens_per_s > 0:
+                    await asyncio.sleep(1 / tokens_per_s)
+            done = {**base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+class FakeLLMServer:
+    """Servidor HTTP real (Uvicorn en un hilo) en un puerto libre de localhost."""
+
+    def __init__(self, **app_kwargs):
+        self.app = create_llm_app(**app_kwargs)
+        self._server = None
+        self._thread = None
+        self.port = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def stats(self) -> dict:
+        return self.app.state.stats
+
+    def start(self, timeout: float = 10):
+        import uvicorn
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        config = uvicorn.Config(self.app, log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(
+            target=self._server.run, kwargs={"sockets": [sock]}, name="fake-llm", daemon=True
+        )
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise TimeoutError("❌ El servidor LLM falso no arrancó")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+# ===============================
+# Embeddings deterministas
+# ===============================
+class HashingEmbeddingBackend:
+    """
+    Bolsa de palabras con hashing a `dim` dimensiones, normalizada: sin
+    modelo que descargar y con similitud léxica razonable entre consulta y
+    pasajes. Se registra como EMBEDDING_BACKEND=hashing.
+    """
+
+    dim = 384
+
+    def __init__(self, model_name: str):
+        self.model_id = f"hashing-{self.dim}"
+
+    def dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                out[row, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1, norms)
+
+    def token_lengths(self, texts):
+        return [len(t.split()) for t in texts]
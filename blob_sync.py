@@ -0,0 +1,240 @@
+# Sincroniza los PDFs de Azure Blob con Qdrant usando un manifiesto local,
+# fuera del camino de las consultas (programado o bajo demanda)
+
+import os
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from retriever import (
+    list_pdf_blobs,
+    fetch_indexed_blobs,
+    delete_blob_points
+)
+from ingestion_queue import enqueue, failed_etags
+from metrics import timed
+
+# ===============================
+# Configuración
+# ===============================
+MANIFEST_PATH = Path(os.getenv("BLOB_SYNC_MANIFEST", Path(__file__).parent / "blob_manifest.json"))
+SYNC_INTERVAL = int(os.getenv("BLOB_SYNC_INTERVAL", "300"))
+
+_sync_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+_stop_event = threading.Event()
+_scheduler_thread = None
+_last_sync = {"started_at": None, "finished_at": None, "stats": None, "error": None}
+
+# ===============================
+# Manifiesto local
+# ===============================
+def load_manifest() -> dict:
+    """Lee el manifiesto {blob_name: {filename, etag, last_modified, indexed}}."""
+    if not MANIFEST_PATH.exists():
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Manifiesto ilegible, se reconstruirá: {e}")
+        return {}
+
+
+def save_manifest(manifest: dict):
+    """Escribe el manifiesto de forma atómica."""
+    tmp_path = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+# ===============================
+# Sincronización
+# ===============================
+def plan_sync(blobs, manifest: dict, failed: dict = None) -> dict:
+    """
+    Compara el listado de blobs con el manifiesto. Retorna los blobs nuevos,
+    modificados (etag distinto), a reintentar (sin indexar, mismo etag),
+    fallidos, sin cambios y eliminados. `failed` ({blob: etag} de trabajos que
+    agotaron sus intentos) evita reencolar un blob roto hasta que cambie su etag.
+    """
+    failed = failed or {}
+    plan = {"new": [], "changed": [], "retry": [], "failed": [], "unchanged": [], "deleted": []}
+    current = set()
+
+    for blob in blobs:
+        current.add(blob.name)
+        entry = manifest.get(blob.name)
+        if entry is None:
+            plan["new"].append(blob)
+        elif entry.get("etag") != blob.etag:
+            plan["changed"].append(blob)
+        elif entry.get("indexed"):
+            plan["unchanged"].append(blob)
+        elif blob.name in failed and failed[blob.name] == blob.etag:
+            plan["failed"].append(blob)
+        else:
+            plan["retry"].append(blob)
+
+    plan["deleted"] = [name for name in manifest if name not in current]
+    return plan
+
+
+def _delete_points(blob_names) -> set:
+    """Borra los puntos de cada blob; retorna los que se borraron sin error."""
+    done = set()
+    for blob_name in blob_names:
+        try:
+            delete_blob_points(blob_name)
+            done.add(blob_name)
+        except Exception as e:
+            print(f"⚠️ Error eliminando puntos de {blob_name}: {e}")
+    return done
+
+
+@timed("blob_sync")
+def sync_blobs() -> dict:
+    """
+    Sincroniza el contenedor con Qdrant:
+    - un único listado de blobs y una única verificación en bloque en Qdrant
+    - encola nuevos y modificados (etag distinto) para el worker de ingesta
+    - reintenta los que quedaron sin indexar, salvo si su trabajo ya falló con ese etag
+    - borra de Qdrant los puntos de blobs eliminados
+    El lock del manifiesto solo se toma para leerlo y para aplicar los
+    cambios; las consultas y borrados en Qdrant van fuera, para no frenar
+    a mark_indexed. Retorna estadísticas de la ejecución.
+    """
+    if not _sync_lock.acquire(blocking=False):
+        print("ℹ️ Sincronización ya en curso, se omite")
+        return {"skipped": True}
+
+    _last_sync["started_at"] = _now()
+    _last_sync["error"] = None
+    try:
+        blobs = list_pdf_blobs()
+
+        with _manifest_lock:
+            manifest = load_manifest()
+        pending = [name for name, entry in manifest.items() if not entry.get("indexed")]
+        plan = plan_sync(blobs, manifest, failed_etags(pending))
+
+        # Blobs sin manifiesto que ya están en Qdrant se adoptan sin descargar
+        indexed = fetch_indexed_blobs(b.name for b in plan["new"])
+        # Modificados: se eliminan los puntos antiguos antes de reindexar
+        cleared = _delete_points(b.name for b in plan["changed"])
+        removed = _delete_points(plan["deleted"])
+
+        to_index = []
+        adopted = 0
+        with _manifest_lock:
+            # Se relee: el worker pudo marcar blobs como indexados mientras tanto
+            manifest = load_manifest()
+            for blob in plan["new"]:
+                if blob.name in manifest:
+                    continue
+                entry = _manifest_entry(blob)
+                entry["indexed"] = blob.name in indexed
+                manifest[blob.name] = entry
+                if entry["indexed"]:
+                    adopted += 1
+                else:
+                    to_index.append(blob)
+            for blob in plan["changed"]:
+                # Si el borrado falló se conserva la entrada anterior y se reintenta en la próxima
+                if blob.name in cleared:
+                    manifest[blob.name] = _manifest_entry(blob)
+                    to_index.append(blob)
+            for blob_name in removed:
+                manifest.pop(blob_name, None)
+            save_manifest(manifest)
+
+        to_index.extend(plan["retry"])
+        for blob in to_index:
+            enqueue(blob.name, blob.etag)
+
+        stats = {
+            "total": len(blobs),
+            "new": len(plan["new"]) - adopted,
+            "adopted": adopted,
+            "changed": len(plan["changed"]),
+            "retried": len(plan["retry"]),
+            "failed": len(plan["failed"]),
+            "deleted": len(removed),
+            "unchanged": len(plan["unchanged"]),
+            "enqueued": len(to_index),
+        }
+        _last_sync["stats"] = stats
+        print(f"🔄 Sincronización completada: {stats}")
+        return stats
+    except Exception as e:
+        _last_sync["error"] = str(e)
+        print(f"❌ Error en sincronización de blobs: {e}")
+        raise
+    finally:
+        _last_sync["finished_at"] = _now()
+        _sync_lock.release()
+
+
+def _manifest_entry(blob) -> dict:
+    return {
+        "filename": os.path.basename(blob.name),
+        "etag": blob.etag,
+        "last_modified": blob.last_modified.isoformat() if blob.last_modified else None,
+        "indexed": False,
+    }
+
+
+def mark_indexed(blob_name: str, etag: str = None):
+    """Marca un blob como indexado (lo llama el worker de ingesta al terminar)."""
+    with _manifest_lock:
+        manifest = load_manifest()
+        entry = manifest.get(blob_name)
+        if entry is None:
+            entry = {"filename": os.path.basename(blob_name), "etag": etag, "last_modified": None}
+            manifest[blob_name] = entry
+        elif etag and entry.get("etag") != etag:
+            # El blob cambió mientras se indexaba; la próxima sincronización lo reencola
+            return
+        entry["indexed"] = True
+        entry["indexed_at"] = _now()
+        save_manifest(manifest)
+
+
+def get_sync_status() -> dict:
+    """Estado de la última sincronización y del programador."""
+    return {
+        "running": _sync_lock.locked(),
+        "interval_seconds": SYNC_INTERVAL,
+        "scheduler_alive": bool(_scheduler_thread and _scheduler_thread.is_alive()),
+        **_last_sync,
+    }
+
+# ===============================
+# Programador
+# ===============================
+def _scheduler_loop():
+    while not _stop_event.is_set():
+        try:
+            sync_blobs()
+        except Exception:
+            pass
+        _stop_event.wait(SYNC_INTERVAL)
+
+
+def start_sync_scheduler():
+    """Lanza la sincronización periódica en un hilo de fondo (BLOB_SYNC_INTERVAL=0 la desactiva)."""
+    global _scheduler_thread
+    if SYNC_INTERVAL <= 0 or (_scheduler_thread and _scheduler_thread.is_alive()):
+        return
+    _stop_event.clear()
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, name="blob-sync", daemon=True)
+    _scheduler_thread.start()
+    print(f"⏱️ Sincronización de blobs programada cada {SYNC_INTERVAL}s")
+
+
+def stop_sync_scheduler():
+    _stop_event.set()
@@ -0,0 +1,312 @@
+# Índice invertido BM25 en proceso sobre los mismos fragmentos que se
+# indexan en Qdrant. Postings compactos (CSR en numpy + delta incremental)
+# persistidos en un .npz que se carga rápido al iniciar
+
+import os
+import re
+import threading
+import numpy as np
+from array import array
+from pathlib import Path
+from cache import normalize_text
+
+BM25_INDEX_PATH = Path(os.getenv("BM25_INDEX_PATH", Path(__file__).parent / "bm25_index.npz"))
+BM25_SAVE_EVERY = int(os.getenv("BM25_SAVE_EVERY", "500"))
+# El delta (o los documentos eliminados) se fusionan con la base cuando superan esta fracción de ella
+BM25_MERGE_RATIO = float(os.getenv("BM25_MERGE_RATIO", "0.25"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+def _to_csr(postings: dict):
+    """(terms, offsets, docs, tfs) de un dict término -> (docs, tfs)."""
+    terms = sorted(postings)
+    lengths = [len(postings[term][0]) for term in terms]
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    docs = np.concatenate([np.frombuffer(postings[t][0], dtype=np.uint32) for t in terms]) if terms else np.zeros(0, dtype=np.uint32)
+    tfs = np.concatenate([np.frombuffer(postings[t][1], dtype=np.uint16) for t in terms]) if terms else np.zeros(0, dtype=np.uint16)
+    return terms, offsets, docs, tfs
+
+
+class BM25Index:
+    """
+    Los documentos se identifican por el ID del punto en Qdrant.
+    - base: postings en formato CSR (offsets, docs, tfs) cargados del disco
+    - delta: postings de los documentos añadidos desde la última fusión
+    - alive: marca por documento; los eliminados quedan como lápidas hasta
+      que la siguiente fusión descarta sus postings
+    """
+
+    def __init__(self, path: Path = BM25_INDEX_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._point_ids = array("Q")
+        self._doc_lens = array("I")
+        self._alive = array("B")
+        self._doc_index = {}
+        self._live_len = 0
+        self._base_terms = {}
+        self._base_offsets = np.zeros(1, dtype=np.int64)
+        self._base_docs = np.zeros(0, dtype=np.uint32)
+        self._base_tfs = np.zeros(0, dtype=np.uint16)
+        self._merging = {}
+        self._delta = {}
+        self._delta_postings = 0
+        self._dead_merged = 0
+        self._unsaved = 0
+        self._load()
+
+    def __len__(self):
+        return len(self._doc_index)
+
+    # ===============================
+    # Actualización incremental
+    # ===============================
+    def add_many(self, docs) -> int:
+        """Añade (point_id, texto) nuevos; los IDs ya indexados se ignoran."""
+        added = 0
+        with self._lock:
+            for point_id, text in docs:
+                if point_id in self._doc_index:
+                    continue
+                terms = tokenize(text)
+                if not terms:
+                    continue
+                doc = len(self._point_ids)
+                self._doc_index[point_id] = doc
+                self._point_ids.append(point_id)
+                self._doc_lens.append(len(terms))
+                self._alive.append(1)
+                self._live_len += len(terms)
+                counts = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, tf in counts.items():
+                    postings = self._delta.get(term)
+                    if postings is None:
+                        postings = self._delta[term] = (array("I"), array("H"))
+                    postings[0].append(doc)
+                    postings[1].append(min(tf, 65535))
+                self._delta_postings += len(counts)
+                added += 1
+            self._unsaved += added
+            should_save = self._unsaved >= BM25_SAVE_EVERY
+        if should_save:
+            self.save(wait=False)
+        return added
+
+    def remove_many(self, point_ids) -> int:
+        """
+        Elimina documentos por ID de punto (los que no están se ignoran).
+        Solo se marcan como lápidas: dejan de puntuar y de contar en df,
+        número de documentos y longitud media; sus postings se descartan
+        en la siguiente fusión.
+        """
+        removed = 0
+        with self._lock:
+            for point_id in set(point_ids):
+                doc = self._doc_index.pop(point_id, None)
+                if doc is None:
+                    continue
+                self._alive[doc] = 0
+                self._live_len -= self._doc_lens[doc]
+                removed += 1
+            self._unsaved += removed
+            should_save = self._unsaved >= BM25_SAVE_EVERY
+        if should_save:
+            self.save(wait=False)
+        return removed
+
+    # ===============================
+    # Búsqueda
+    # ===============================
+    def _postings(self, term, alive):
+        docs, tfs = [], []
+        idx = self._base_terms.get(term)
+        if idx is not None:
+            start, end = self._base_offsets[idx], self._base_offsets[idx + 1]
+            docs.append(self._base_docs[start:end])
+            tfs.append(self._base_tfs[start:end])
+        for source in (self._merging, self._delta):
+            postings = source.get(term)
+            if postings is not None:
+                docs.append(np.frombuffer(postings[0], dtype=np.uint32))
+                tfs.append(np.frombuffer(postings[1], dtype=np.uint16))
+        if not docs:
+            return None, None
+        docs, tfs = np.concatenate(docs), np.concatenate(tfs)
+        keep = alive[docs]
+        return docs[keep], tfs[keep].astype(np.float32)
+
+    def search(self, query: str, top_k: int = 10) -> list[tuple[int, float]]:
+        """Retorna [(point_id, score)] ordenado por score BM25."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_index)
+            if not terms or not n_docs:
+                return []
+            alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            doc_lens = np.frombuffer(self._doc_lens, dtype=np.uint32).astype(np.float32)
+            avg_len = self._live_len / n_docs
+            scores = np.zeros(len(doc_lens), dtype=np.float32)
+            for term in terms:
+                docs, tfs = self._postings(term, alive)
+                if docs is None or not len(docs):
+                    continue
+                df = len(docs)
+                idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens[docs] / avg_len)
+                scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+
+            candidates = np.flatnonzero(scores)
+            if not len(candidates):
+                return []
+            k = min(top_k, len(candidates))
+            best = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            best = best[np.argsort(-scores[best])]
+            return [(int(self._point_ids[d]), float(scores[d])) for d in best]
+
+    # ===============================
+    # Fusión y persistencia
+    # ===============================
+    @staticmethod
+    def _merge(base_terms, base_offsets, base_docs, base_tfs, merging, alive):
+        """
+        Fusiona la base con un delta congelado descartando los postings de
+        documentos eliminados. Sin lock: solo lee copias que nadie modifica.
+        """
+        terms = sorted(set(base_terms) | set(merging))
+        term_ids = {term: i for i, term in enumerate(terms)}
+        base_order = sorted(base_terms, key=base_terms.get)
+        base_map = np.array([term_ids[t] for t in base_order], dtype=np.int64)
+        parts_ids = [np.repeat(base_map, np.diff(base_offsets))] if len(base_map) else []
+        parts_docs, parts_tfs = [base_docs], [base_tfs]
+        for term, (docs, tfs) in merging.items():
+            parts_ids.append(np.full(len(docs), term_ids[term], dtype=np.int64))
+            parts_docs.append(np.frombuffer(docs, dtype=np.uint32))
+            parts_tfs.append(np.frombuffer(tfs, dtype=np.uint16))
+        ids = np.concatenate(parts_ids) if parts_ids else np.zeros(0, dtype=np.int64)
+        docs, tfs = np.concatenate(parts_docs), np.concatenate(parts_tfs)
+
+        keep = alive[docs]
+        ids, docs, tfs = ids[keep], docs[keep], tfs[keep]
+        order = np.lexsort((docs, ids))
+        ids, docs, tfs = ids[order], docs[order], tfs[order]
+        counts = np.bincount(ids, minlength=len(terms))
+        used = counts > 0
+        offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[used], out=offsets[1:])
+        kept_terms = [term for term, u in zip(terms, used) if u]
+        return {term: i for i, term in enumerate(kept_terms)}, offsets, docs, tfs
+
+    def _needs_merge(self) -> bool:
+        dead = len(self._point_ids) - len(self._doc_index)
+        return (self._delta_postings > BM25_MERGE_RATIO * len(self._base_docs)
+                or dead - self._dead_merged > BM25_MERGE_RATIO * max(1, len(self._point_ids)))
+
+    def save(self, wait: bool = True):
+        """
+        Guarda el índice en disco. Si el delta o las lápidas superan
+        BM25_MERGE_RATIO de la base, antes se fusionan con ella. Bajo el lock
+        solo se toman copias o referencias; la fusión y la escritura del .npz
+        se hacen fuera para no frenar búsquedas ni inserciones. Con
+        wait=False no espera si ya hay un guardado en curso.
+        """
+        if not self._save_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                merge = self._needs_merge()
+                if merge:
+                    # El delta congelado se sigue consultando hasta que la base fusionada lo reemplaza
+                    self._merging, self._delta = self._delta, {}
+                    self._delta_postings = 0
+                    snapshot = (self._base_terms, self._base_offsets, self._base_docs, self._base_tfs,
+                                self._merging, np.array(self._alive, dtype=bool))
+                    dead = len(self._point_ids) - len(self._doc_index)
+
+            if merge:
+                base = self._merge(*snapshot)
+                with self._lock:
+                    self._base_terms, self._base_offsets, self._base_docs, self._base_tfs = base
+                    self._merging = {}
+                    self._dead_merged = dead
+
+            with self._lock:
+                delta_terms, delta_offsets, delta_docs, delta_tfs = _to_csr(self._delta)
+                files = {
+                    "terms": np.array(sorted(self._base_terms, key=self._base_terms.get), dtype=str),
+                    "offsets": self._base_offsets,
+                    "docs": self._base_docs,
+                    "tfs": self._base_tfs,
+                    "delta_terms": np.array(delta_terms, dtype=str),
+                    "delta_offsets": delta_offsets,
+                    "delta_docs": delta_docs,
+                    "delta_tfs": delta_tfs,
+                    "point_ids": np.array(self._point_ids, dtype=np.uint64),
+                    "doc_lens": np.array(self._doc_lens, dtype=np.uint32),
+                    "alive": np.array(self._alive, dtype=np.uint8),
+                }
+                self._unsaved = 0
+
+            tmp_path = self.path.with_suffix(".tmp.npz")
+            try:
+                np.savez(tmp_path, **files)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar el índice BM25: {e}")
+        finally:
+            self._save_lock.release()
+
+    def flush(self):
+        if self._unsaved:
+            self.save()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path) as data:
+                terms = data["terms"].tolist()
+                self._base_offsets = data["offsets"]
+                self._base_docs = data["docs"]
+                self._base_tfs = data["tfs"]
+                self._point_ids = array("Q", data["point_ids"].tobytes())
+                self._doc_lens = array("I", data["doc_lens"].tobytes())
+                # Índices guardados antes de las lápidas y del delta persistido
+                if "alive" in data:
+                    self._alive = array("B", data["alive"].tobytes())
+                    delta_terms = data["delta_terms"].tolist()
+                    delta_offsets, delta_docs, delta_tfs = data["delta_offsets"], data["delta_docs"], data["delta_tfs"]
+                else:
+                    self._alive = array("B", bytes([1]) * len(self._point_ids))
+                    delta_terms = []
+            for i, term in enumerate(delta_terms):
+                start, end = delta_offsets[i], delta_offsets[i + 1]
+                self._delta[term] = (array("I", delta_docs[start:end].tobytes()), array("H", delta_tfs[start:end].tobytes()))
+            self._delta_postings = int(delta_offsets[-1]) if delta_terms else 0
+            self._base_terms = {term: i for i, term in enumerate(terms)}
+            self._doc_index = {pid: i for i, pid in enumerate(self._point_ids) if self._alive[i]}
+            self._live_len = sum(n for n, a in zip(self._doc_lens, self._alive) if a)
+            print(f"✅ Índice BM25 cargado: {len(self)} fragmentos, {len(terms)} términos")
+        except Exception as e:
+            print(f"⚠️ Índice BM25 ilegible, se reconstruirá: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self._doc_index),
+            "deleted": len(self._point_ids) - len(self._doc_index),
+            "terms": len(set(self._base_terms) | set(self._delta)),
+            "unsaved": self._unsaved,
+        }
+
+
+bm25_index = BM25Index()
@@ -0,0 +1,222 @@
+# Escritura masiva en Qdrant: comprobación de existencia y upserts por lotes
+# en varios hilos, con tamaño de lote adaptativo, reintentos con backoff y
+# escrituras sin esperar (wait=False) cerradas por una barrera de consistencia
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span, POINTS_UPSERTED, QDRANT_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# ===============================
+# Configuración
+# ===============================
+WRITE_WORKERS = int(os.getenv("QDRANT_WRITE_WORKERS", "4"))
+WRITE_BATCH_SIZE = int(os.getenv("QDRANT_WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_MIN = int(os.getenv("QDRANT_WRITE_BATCH_MIN", "16"))
+WRITE_BATCH_MAX = int(os.getenv("QDRANT_WRITE_BATCH_MAX", "512"))
+# Duración buscada por upsert: si tarda menos se agranda el lote, si tarda más se achica
+WRITE_TARGET_S = float(os.getenv("QDRANT_WRITE_TARGET_S", "1.0"))
+WRITE_RETRIES = int(os.getenv("QDRANT_WRITE_RETRIES", "4"))
+WRITE_BACKOFF_S = float(os.getenv("QDRANT_WRITE_BACKOFF_S", "0.5"))
+# false: Qdrant confirma al recibir el lote y la barrera final espera a que sea visible
+WRITE_WAIT = os.getenv("QDRANT_WRITE_WAIT", "false").lower() == "true"
+BARRIER_TIMEOUT_S = float(os.getenv("QDRANT_BARRIER_TIMEOUT_S", "60"))
+EXISTS_BATCH_SIZE = int(os.getenv("QDRANT_EXISTS_BATCH_SIZE", "256"))
+
+
+class BulkWriteError(RuntimeError):
+    """Lotes que fallaron tras los reintentos o barrera de consistencia incompleta; `stats` trae el detalle."""
+
+    def __init__(self, message: str, stats: dict):
+        super().__init__(message)
+        self.stats = stats
+
+
+def _retryable(error: Exception) -> bool:
+    # Los 4xx (salvo 429) son errores del request: reintentarlos no sirve
+    status = getattr(error, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+class BatchSizer:
+    """Tamaño de lote compartido por los hilos: se duplica con upserts rápidos y se reduce a la mitad con lentos o fallidos."""
+
+    def __init__(self, size: int = WRITE_BATCH_SIZE, minimum: int = WRITE_BATCH_MIN,
+                 maximum: int = WRITE_BATCH_MAX, target_s: float = WRITE_TARGET_S):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.size = min(max(size, self.minimum), self.maximum)
+        self.target_s = target_s
+        self._lock = threading.Lock()
+
+    def record(self, n_points: int, seconds: float, ok: bool = True):
+        with self._lock:
+            if not ok or seconds > self.target_s:
+                self.size = max(self.minimum, self.size // 2)
+            elif seconds < self.target_s / 2 and n_points >= self.size:
+                self.size = min(self.maximum, self.size * 2)
+
+
+class BulkWriter:
+    """
+    Escritor de puntos de una colección. Cada llamada a `write` reparte los
+    puntos entre WRITE_WORKERS hilos que toman lotes de una cola común; el
+    tamaño de lote aprendido se conserva entre llamadas.
+    """
+
+    def __init__(self, get_client, collection_name: str, workers: int = WRITE_WORKERS,
+                 wait: bool = WRITE_WAIT, sizer: BatchSizer = None):
+        self.get_client = get_client
+        self.collection_name = collection_name
+        self.workers = max(1, workers)
+        self.wait = wait
+        self.sizer = sizer or BatchSizer()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self.get_client()
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="qdrant-write")
+        return self._pool
+
+    def _map(self, fn, items: list) -> list:
+        if self.workers == 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        return list(self._get_pool().map(fn, items))
+
+    def _call(self, operation: str, fn):
+        """Ejecuta fn reintentando los errores transitorios con backoff exponencial y jitter."""
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= WRITE_RETRIES or not _retryable(e):
+                    raise
+                delay = WRITE_BACKOFF_S * 2 ** attempt * random.uniform(0.5, 1.5)
+                attempt += 1
+                QDRANT_RETRIES.inc(operation=operation)
+                logger.warning(f"⚠️ Qdrant {operation} falló ({e}); reintento {attempt}/{WRITE_RETRIES} en {delay:.1f}s")
+                time.sleep(delay)
+
+    # ===============================
+    # Existencia
+    # ===============================
+    def existing_ids(self, ids: list) -> set:
+        """IDs que ya están en la colección. Solo se piden los IDs, sin payload ni vector."""
+        batches = [ids[i:i + EXISTS_BATCH_SIZE] for i in range(0, len(ids), EXISTS_BATCH_SIZE)]
+
+        def check(batch):
+            with span("qdrant_exists"):
+                points = self._call("retrieve", lambda: self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=batch,
+                    with_payload=False,
+                    with_vectors=False
+                ))
+            return [p.id for p in points]
+
+        found = set()
+        for batch_found in self._map(check, batches):
+            found.update(batch_found)
+        return found
+
+    def barrier(self, ids: list, timeout: float = BARRIER_TIMEOUT_S):
+        """Espera a que los puntos escritos con wait=False se puedan leer."""
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        missing = list(ids)
+        while True:
+            found = self.existing_ids(missing)
+            missing = [point_id for point_id in missing if point_id not in found]
+            if not missing:
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{len(missing)} puntos siguen sin ser visibles tras {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    # ===============================
+    # Escritura
+    # ===============================
+    def _upsert(self, batch: list):
+        def upsert():
+            t0 = time.perf_counter()
+            try:
+                with span("qdrant_upsert"):
+                    self.client.upsert(collection_name=self.collection_name, points=batch, wait=self.wait)
+            except Exception:
+                self.sizer.record(len(batch), time.perf_counter() - t0, ok=False)
+                raise
+            self.sizer.record(len(batch), time.perf_counter() - t0)
+
+        self._call("upsert", upsert)
+        POINTS_UPSERTED.inc(len(batch), type=(batch[0].payload or {}).get("type"))
+
+    def write(self, points: list) -> dict:
+        """
+        Inserta los puntos y, si se escribió con wait=False, espera a que
+        sean visibles antes de retornar. Los lotes que fallan tras los
+        reintentos no detienen al resto, pero al final se lanza
+        BulkWriteError, igual que si la barrera no se completa. Retorna
+        estadísticas de la escritura.
+        """
+        stats = {"points": len(points), "written": 0, "failed": 0, "batches": 0, "error": None,
+                 "workers": 0, "seconds": 0.0, "points_per_s": 0.0}
+        if not points:
+            return stats
+
+        t0 = time.perf_counter()
+        pending = deque(points)
+        written_ids = []
+        lock = threading.Lock()
+
+        def worker(_):
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    batch = [pending.popleft() for _ in range(min(self.sizer.size, len(pending)))]
+                try:
+                    self._upsert(batch)
+                except Exception as e:
+                    with lock:
+                        stats["failed"] += len(batch)
+                        stats["error"] = stats["error"] or str(e)
+                    continue
+                with lock:
+                    stats["written"] += len(batch)
+                    stats["batches"] += 1
+                    written_ids.extend(p.id for p in batch)
+
+        stats["workers"] = min(self.workers, -(-len(points) // self.sizer.minimum))
+        self._map(worker, range(stats["workers"]))
+
+        barrier_error = None
+        if not self.wait and written_ids:
+            try:
+                with span("qdrant_barrier"):
+                    self.barrier(written_ids)
+            except Exception as e:
+                barrier_error = e
+
+        stats["seconds"] = round(time.perf_counter() - t0, 3)
+        stats["points_per_s"] = round(stats["written"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+        stats["batch_size"] = self.sizer.size
+        if stats["failed"]:
+            raise BulkWriteError(f"{stats['failed']} de {stats['points']} puntos sin escribir: {stats['error']}", stats)
+        if barrier_error is not None:
+            raise BulkWriteError(f"Barrera de consistencia incompleta: {barrier_error}", stats)
+        return stats
@@ -0,0 +1,150 @@
+# Caché en memoria con TTL y desalojo LRU, persistencia opcional en disco
+# y contadores de aciertos/fallos
+
+import os
+import json
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from metrics import CACHE_REQUESTS
+
+_registry = {}
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza una consulta: minúsculas, sin acentos y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+class TTLCache:
+    """
+    Caché LRU acotada por `max_size` entradas, cada una válida `ttl` segundos
+    (ttl <= 0 desactiva la expiración). Si se indica `persist_path`, las
+    entradas (claves str y valores JSON serializables) se guardan en disco y
+    se recargan al iniciar.
+    """
+
+    def __init__(self, name: str, max_size: int = 256, ttl: float = 3600, persist_path: str = None,
+                 save_every: int = 1):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.persist_path = persist_path
+        # Cada cuántas escrituras se vuelca a disco (flush() fuerza el volcado)
+        self.save_every = max(1, save_every)
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializa los volcados: comparten el archivo temporal y cada uno toma su copia al empezar
+        self._save_lock = threading.Lock()
+        if persist_path:
+            self._load()
+        register(name, self)
+
+    def _expired(self, expires_at) -> bool:
+        return expires_at is not None and expires_at < time.time()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0]):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache=self.name, result="miss")
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+            return item[1]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self._unsaved += 1
+            should_save = self._unsaved >= self.save_every
+        if self.persist_path and should_save:
+            self.flush()
+
+    def flush(self):
+        """Vuelca la caché a disco si tiene persistencia configurada."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            self._unsaved = 0
+        with self._save_lock:
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.persist_path:
+            with self._save_lock:
+                self._save()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    # ===============================
+    # Persistencia
+    # ===============================
+    def _save(self):
+        with self._lock:
+            entries = [[key, exp, value] for key, (exp, value) in self._data.items()]
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar la caché '{self.name}': {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for key, exp, value in entries[-self.max_size:]:
+                if not self._expired(exp):
+                    self._data[key] = (exp, value)
+            print(f"✅ Caché '{self.name}' cargada con {len(self._data)} entradas")
+        except Exception as e:
+            print(f"⚠️ Caché '{self.name}' ilegible, se descarta: {e}")
+
+
+def register(name: str, cache):
+    """Registra una caché (cualquier objeto con stats(); flush() es opcional) para /cache y el apagado."""
+    _registry[name] = cache
+
+
+def cache_stats() -> dict:
+    """Estadísticas de todas las cachés registradas."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def flush_caches():
+    """Vuelca a disco todas las cachés persistentes (al apagar la app)."""
+    for cache in _registry.values():
+        flush = getattr(cache, "flush", None)
+        if flush is not None:
+            flush()
@@ -0,0 +1,203 @@
+# Almacén local del texto de los fragmentos indexados, direccionado por el ID
+# del punto en Qdrant. En modo de almacenamiento compacto el payload de
+# Qdrant no lleva el texto: se guarda aquí comprimido y se lee con memmap.
+# El texto queda solo en el disco de esta instancia: otras réplicas o un
+# servidor nuevo no lo ven, así que CHUNK_STORE_DIR debe copiarse junto con
+# la colección (o estar en un volumen compartido)
+
+import os
+import zlib
+import threading
+import numpy as np
+from pathlib import Path
+from cache import register
+from metrics import CACHE_REQUESTS
+
+# ===============================
+# Configuración
+# ===============================
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", str(Path(__file__).parent / "chunk_store"))
+CHUNK_COMPRESSION_LEVEL = int(os.getenv("CHUNK_COMPRESSION_LEVEL", "6"))
+# Fracción de chunks.bin ocupada por fragmentos eliminados a partir de la cual se reescribe
+CHUNK_COMPACT_RATIO = float(os.getenv("CHUNK_COMPACT_RATIO", "0.5"))
+
+# Una entrada del índice por fragmento: ID del punto, posición y largo comprimido
+INDEX_DTYPE = np.dtype([("id", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+
+
+class ChunkStore:
+    """
+    Dos archivos de solo anexado en `directory`:
+    - chunks.bin: el texto de cada fragmento comprimido con zlib, leído con memmap
+    - index.bin: (id, offset, length) por fragmento, cargado en un dict al abrir
+    Al eliminar fragmentos se reescribe el índice; sus bytes quedan en
+    chunks.bin hasta que superan CHUNK_COMPACT_RATIO y el archivo se compacta.
+    """
+
+    def __init__(self, directory, level: int = CHUNK_COMPRESSION_LEVEL):
+        self.directory = Path(directory)
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._data = None
+        self._size = 0
+        self._dead = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._chunks_path = self.directory / "chunks.bin"
+        self._index_path = self.directory / "index.bin"
+        self._compact_chunks_path = self.directory / "chunks.compact"
+        self._compact_index_path = self.directory / "index.compact"
+        self._open()
+
+    def _recover_compaction(self):
+        # Se escribe chunks.compact, luego index.compact, y se reemplazan en ese
+        # orden: si solo queda index.compact, los datos ya se reemplazaron
+        if self._compact_index_path.exists() and not self._compact_chunks_path.exists():
+            os.replace(self._compact_index_path, self._index_path)
+        for path in (self._compact_chunks_path, self._compact_index_path):
+            if path.exists():
+                path.unlink()
+
+    def _open(self):
+        self._recover_compaction()
+        raw = self._index_path.read_bytes() if self._index_path.exists() else b""
+        index = np.frombuffer(raw[:len(raw) - len(raw) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+        size = self._chunks_path.stat().st_size if self._chunks_path.exists() else 0
+        # Una escritura interrumpida puede dejar entradas sin datos o datos sin entrada: se recorta
+        ends = index["offset"] + index["length"]
+        valid = int(np.searchsorted(ends, size, side="right"))
+        index = index[:valid]
+        if len(raw) != index.nbytes:
+            self._index_path.write_bytes(index.tobytes())
+        self._size = int(ends[valid - 1]) if valid else 0
+        if size != self._size:
+            os.truncate(self._chunks_path, self._size)
+        self._entries = {point_id: (offset, length) for point_id, offset, length in index.tolist()}
+        self._dead = self._size - int(index["length"].sum())
+
+    def _get_data(self):
+        if self._data is None and self._size:
+            self._data = np.memmap(self._chunks_path, dtype=np.uint8, mode="r", shape=(self._size,))
+        return self._data
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, point_id) -> bool:
+        return int(point_id) in self._entries
+
+    def get_many(self, point_ids) -> dict:
+        """{id: texto} de los IDs almacenados; los ausentes no aparecen."""
+        found = {}
+        with self._lock:
+            data = self._get_data()
+            for point_id in point_ids:
+                entry = self._entries.get(int(point_id))
+                if entry is None:
+                    continue
+                offset, length = entry
+                found[point_id] = zlib.decompress(data[offset:offset + length].tobytes()).decode("utf-8")
+            hits = len(found)
+            self.hits += hits
+            self.misses += len(point_ids) - hits
+        CACHE_REQUESTS.inc(hits, cache="chunk_store", result="hit")
+        CACHE_REQUESTS.inc(len(point_ids) - hits, cache="chunk_store", result="miss")
+        return found
+
+    def put_many(self, items) -> int:
+        """Guarda (id, texto) nuevos; los IDs ya presentes se ignoran. Retorna cuántos se añadieron."""
+        blobs = {}
+        for point_id, text in items:
+            point_id = int(point_id)
+            if point_id not in self._entries and point_id not in blobs:
+                blobs[point_id] = zlib.compress((text or "").encode("utf-8"), self.level)
+        if not blobs:
+            return 0
+        with self._lock:
+            blobs = {k: v for k, v in blobs.items() if k not in self._entries}
+            if not blobs:
+                return 0
+            index = np.zeros(len(blobs), dtype=INDEX_DTYPE)
+            offset = self._size
+            for i, (point_id, blob) in enumerate(blobs.items()):
+                index[i] = (point_id, offset, len(blob))
+                offset += len(blob)
+            # Primero los datos y luego el índice: si se corta en medio, _open recorta
+            with open(self._chunks_path, "ab") as f:
+                f.write(b"".join(blobs.values()))
+            with open(self._index_path, "ab") as f:
+                index.tofile(f)
+            for point_id, start, length in index.tolist():
+                self._entries[point_id] = (start, length)
+            self._size = offset
+            self._data = None
+        return len(blobs)
+
+    def delete_many(self, point_ids) -> int:
+        """Elimina los fragmentos de esos IDs (los ausentes se ignoran). Retorna cuántos se eliminaron."""
+        with self._lock:
+            removed = [pid for pid in {int(p) for p in point_ids} if pid in self._entries]
+            if not removed:
+                return 0
+            for point_id in removed:
+                self._dead += self._entries.pop(point_id)[1]
+            if self._dead > self._size * CHUNK_COMPACT_RATIO:
+                self._compact()
+            else:
+                tmp_path = self._index_path.with_suffix(".tmp")
+                self._index_array().tofile(tmp_path)
+                os.replace(tmp_path, self._index_path)
+        return len(removed)
+
+    def _index_array(self, entries=None) -> np.ndarray:
+        # Ordenado por posición, como lo espera _open para recortar escrituras interrumpidas
+        entries = self._entries if entries is None else entries
+        index = np.array([(pid, off, length) for pid, (off, length) in entries.items()], dtype=INDEX_DTYPE)
+        return index[np.argsort(index["offset"], kind="stable")]
+
+    def _compact(self):
+        """Reescribe chunks.bin solo con los fragmentos vigentes. Se llama con el lock tomado."""
+        data = self._get_data()
+        entries = {}
+        offset = 0
+        with open(self._compact_chunks_path, "wb") as f:
+            for point_id, (start, length) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+                f.write(data[start:start + length].tobytes())
+                entries[point_id] = (offset, length)
+                offset += length
+        self._index_array(entries).tofile(self._compact_index_path)
+        self._data = None
+        os.replace(self._compact_chunks_path, self._chunks_path)
+        os.replace(self._compact_index_path, self._index_path)
+        print(f"🧹 Almacén de fragmentos compactado: {self._size} -> {offset} bytes")
+        self._entries = entries
+        self._size = offset
+        self._dead = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "bytes": self._size,
+            "dead_bytes": self._dead,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chunk_store() -> ChunkStore:
+    """Almacén compartido del proceso; se abre en el primer uso."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChunkStore(CHUNK_STORE_DIR)
+                register("chunk_store", _store)
+    return _store
@@ -0,0 +1,100 @@
+# División de páginas en fragmentos por oraciones/párrafos con ventana de
+# tokens y solapamiento, conservando página y offsets para las citas
+
+import os
+import re
+import numpy as np
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+_PARAGRAPH_RE = re.compile(r"\S(?:.*?)(?=\n\s*\n|\Z)", re.S)
+_SENTENCE_RE = re.compile(r"\S.*?(?:[.!?;:](?=\s)|\Z)", re.S)
+_WORD_RE = re.compile(r"\S+")
+
+
+def split_units(text: str) -> list[tuple[int, int]]:
+    """Offsets (inicio, fin) de cada oración, sin cruzar límites de párrafo."""
+    units = []
+    for paragraph in _PARAGRAPH_RE.finditer(text):
+        base = paragraph.start()
+        for sentence in _SENTENCE_RE.finditer(paragraph.group()):
+            units.append((base + sentence.start(), base + sentence.end()))
+    return units
+
+
+def _split_long_unit(text: str, start: int, end: int, max_tokens: int, token_lengths) -> list[tuple[int, int]]:
+    """Parte por palabras una oración que por sí sola excede la ventana."""
+    words = [(start + m.start(), start + m.end()) for m in _WORD_RE.finditer(text[start:end])]
+    lengths = np.asarray(token_lengths([text[s:e] for s, e in words]), dtype=np.int64)
+    pieces = []
+    i = 0
+    while i < len(words):
+        cum = np.cumsum(lengths[i:])
+        j = i + max(1, int(np.searchsorted(cum, max_tokens, side="right")))
+        pieces.append((words[i][0], words[j - 1][1]))
+        i = j
+    return pieces
+
+
+def chunk_page(text: str, token_lengths, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Genera (inicio, fin) de cada fragmento de la página. Las ventanas se
+    arman con sumas acumuladas de tokens por oración y cada una repite las
+    últimas oraciones de la anterior hasta `overlap_tokens`.
+    """
+    units = split_units(text)
+    if not units:
+        return
+    lengths = np.asarray(token_lengths([text[s:e] for s, e in units]), dtype=np.int64)
+
+    # Oraciones más largas que la ventana se parten por palabras
+    if (lengths > max_tokens).any():
+        expanded = []
+        for (s, e), n in zip(units, lengths):
+            if n > max_tokens:
+                expanded.extend(_split_long_unit(text, s, e, max_tokens, token_lengths))
+            else:
+                expanded.append((s, e))
+        units = expanded
+        lengths = np.asarray(token_lengths([text[s:e] for s, e in units]), dtype=np.int64)
+        lengths = np.minimum(lengths, max_tokens)
+
+    cum = np.concatenate(([0], np.cumsum(lengths)))
+    i = 0
+    n = len(units)
+    while i < n:
+        # Última oración j tal que tokens(i..j) <= max_tokens
+        j = int(np.searchsorted(cum, cum[i] + max_tokens, side="right")) - 1
+        j = max(j, i + 1)
+        yield units[i][0], units[j - 1][1]
+        if j >= n:
+            break
+        # Siguiente inicio: primera oración k cuyo tramo k..j quepa en el solapamiento
+        # y que deje sitio para al menos una oración nueva
+        k = int(np.searchsorted(cum, cum[j] - overlap_tokens, side="left"))
+        k = max(k, int(np.searchsorted(cum, cum[j + 1] - max_tokens, side="left")))
+        i = min(max(k, i + 1), j)
+
+
+def iter_pdf_chunks(pdf_data: list[dict], token_lengths, max_tokens: int = CHUNK_MAX_TOKENS,
+                    overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """Recorre los PDFs página a página y produce un dict por fragmento, sin materializarlos todos."""
+    for doc in pdf_data:
+        for page in doc["pages_texts"]:
+            text = page["text"]
+            for chunk_index, (start, end) in enumerate(chunk_page(text, token_lengths, max_tokens, overlap_tokens)):
+                content = text[start:end].strip()
+                if not content:
+                    continue
+                yield {
+                    "filename": doc["filename"],
+                    "blob": doc.get("blob"),
+                    "title": doc.get("title", ""),
+                    "page": page["page"],
+                    "chunk": chunk_index,
+                    "start": start,
+                    "end": end,
+                    "content": content,
+                }
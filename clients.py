@@ -0,0 +1,128 @@
+# Clientes compartidos de los servicios externos (Qdrant, Azure Blob y Azure
+# OpenAI). Se crean en el primer uso y no al importar: importar la app no
+# hace llamadas de red ni falla por variables de entorno ausentes; el error
+# de configuración aparece al usar el servicio (o en el calentamiento)
+
+import os
+import inspect
+import logging
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_VERSION = "2024-12-01-preview"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _env(name: str) -> str:
+    return os.getenv(name, "").strip().strip('"')
+
+
+def _shared(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+# ===============================
+# Configuración
+# ===============================
+def qdrant_config() -> tuple[str, str]:
+    """(url, api_key) de Qdrant validados."""
+    url = urllib.parse.unquote(_env("QDRANT_URL")).replace('"', '').strip()
+    api_key = _env("QDRANT_API_KEY1")
+    if not api_key or not url:
+        raise ValueError("❌ Faltan variables de entorno QDRANT_API_KEY1 o QDRANT_URL")
+    parsed_url = urllib.parse.urlparse(url)
+    if not parsed_url.scheme or not parsed_url.netloc:
+        raise ValueError("❌ QDRANT_URL no tiene estructura válida")
+    return url, api_key
+
+
+def openai_config() -> tuple[str, str, str]:
+    """(api_key, endpoint, deployment) de Azure OpenAI validados."""
+    api_key = os.getenv("OPEN_AI_API_KEY_1")
+    endpoint = os.getenv("OPEN_AI_ENDPOINT")
+    deployment = os.getenv("OPEN_AI_DEPLOYMENT")
+    if not api_key or not endpoint or not deployment:
+        raise ValueError("Faltan variables de entorno OPEN_AI_API_KEY_1, OPEN_AI_ENDPOINT o OPEN_AI_DEPLOYMENT")
+    return api_key, endpoint, deployment.strip()
+
+
+def openai_deployment() -> str:
+    return openai_config()[2]
+
+# ===============================
+# Clientes
+# ===============================
+def get_qdrant_client():
+    def create():
+        from qdrant_client import QdrantClient
+        url, api_key = qdrant_config()
+        logger.info(f"✅ Cliente Qdrant creado: {url}")
+        return QdrantClient(url=url, api_key=api_key)
+    return _shared("qdrant", create)
+
+
+def get_async_qdrant_client():
+    """Cliente asíncrono para el camino de las consultas (/ask)."""
+    def create():
+        from qdrant_client import AsyncQdrantClient
+        url, api_key = qdrant_config()
+        return AsyncQdrantClient(url=url, api_key=api_key)
+    return _shared("qdrant_async", create)
+
+
+def get_container_client():
+    def create():
+        from azure.storage.blob import ContainerClient
+        container_url = os.getenv("AZURE_STORAGE_SAS_TOKEN")
+        if not container_url:
+            raise ValueError("❌ Falta AZURE_STORAGE_SAS_TOKEN")
+        return ContainerClient.from_container_url(container_url)
+    return _shared("blob_container", create)
+
+
+def get_openai_client():
+    def create():
+        from openai import AzureOpenAI
+        api_key, endpoint, _ = openai_config()
+        return AzureOpenAI(api_key=api_key, api_version=OPENAI_API_VERSION, azure_endpoint=endpoint)
+    return _shared("openai", create)
+
+
+def get_async_openai_client():
+    """Los reintentos ante 429 los gestiona el sintetizador (max_retries=0)."""
+    def create():
+        from openai import AsyncAzureOpenAI
+        api_key, endpoint, _ = openai_config()
+        return AsyncAzureOpenAI(
+            api_key=api_key,
+            api_version=OPENAI_API_VERSION,
+            azure_endpoint=endpoint,
+            max_retries=0
+        )
+    return _shared("openai_async", create)
+
+
+async def close_clients():
+    """Cierra los clientes creados (al apagar la app)."""
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for name, client in clients:
+        close = getattr(client, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"⚠️ Error cerrando cliente {name}: {e}")
@@ -0,0 +1,105 @@
+# Almacén local de embeddings direccionado por contenido: SHA-256 del modelo
+# y el texto -> vector. Evita volver a codificar texto ya visto al reconstruir
+# o migrar la colección de Qdrant
+
+import os
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from metrics import CACHE_REQUESTS
+
+DIGEST_SIZE = 32
+
+
+def content_digest(model_id: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_id}\x00{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Dos archivos de solo anexado en `directory`:
+    - vectors.f32: matriz float32 (filas x dim) leída con memmap
+    - keys.bin: un digest de 32 bytes por fila, cargado en un dict al abrir
+    """
+
+    def __init__(self, directory, model_id: str, dim: int):
+        self.directory = Path(directory)
+        self.model_id = model_id
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._matrix = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.directory / "vectors.f32"
+        self._keys_path = self.directory / "keys.bin"
+        self._open()
+
+    def _open(self):
+        keys = self._keys_path.read_bytes() if self._keys_path.exists() else b""
+        rows = len(keys) // DIGEST_SIZE
+        row_bytes = self.dim * 4
+        # Una escritura interrumpida puede dejar vectores o claves de más: se recorta
+        vector_rows = self._vectors_path.stat().st_size // row_bytes if self._vectors_path.exists() else 0
+        rows = min(rows, vector_rows)
+        if self._vectors_path.exists():
+            os.truncate(self._vectors_path, rows * row_bytes)
+        if len(keys) != rows * DIGEST_SIZE:
+            self._keys_path.write_bytes(keys[:rows * DIGEST_SIZE])
+        self._rows = {keys[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i for i in range(rows)}
+
+    def _get_matrix(self):
+        if self._matrix is None and self._rows:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                     shape=(len(self._rows), self.dim))
+        return self._matrix
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_many(self, texts: list[str]) -> list:
+        """Vector de cada texto, o None si no está almacenado."""
+        digests = [content_digest(self.model_id, t) for t in texts]
+        with self._lock:
+            matrix = self._get_matrix()
+            found = []
+            for digest in digests:
+                row = self._rows.get(digest)
+                found.append(np.array(matrix[row]) if row is not None else None)
+            hits = sum(v is not None for v in found)
+            self.hits += hits
+            self.misses += len(found) - hits
+        CACHE_REQUESTS.inc(hits, cache="embedding_store", result="hit")
+        CACHE_REQUESTS.inc(len(found) - hits, cache="embedding_store", result="miss")
+        return found
+
+    def put_many(self, texts: list[str], vectors):
+        """Guarda los vectores de textos nuevos (los ya presentes se ignoran)."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            new_keys = {}
+            for text, vector in zip(texts, vectors):
+                digest = content_digest(self.model_id, text)
+                if digest not in self._rows and digest not in new_keys:
+                    new_keys[digest] = vector
+            if not new_keys:
+                return
+            with open(self._vectors_path, "ab") as f:
+                np.stack(list(new_keys.values())).tofile(f)
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            start = len(self._rows)
+            for i, digest in enumerate(new_keys):
+                self._rows[digest] = start + i
+            self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
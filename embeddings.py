@@ -0,0 +1,278 @@
+# Servicio único de embeddings: un solo modelo cargado de forma perezosa,
+# compartido por indexación y consultas, con micro-batching entre peticiones
+# concurrentes y backends intercambiables
+
+import os
+import re
+import time
+import queue
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from pathlib import Path
+from concurrent.futures import Future
+from cache import TTLCache, normalize_text, register
+from embedding_store import EmbeddingStore
+from tokens import count_tokens
+
+# ===============================
+# Configuración
+# ===============================
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+# Archivo ONNX dentro del repositorio del modelo (p. ej. la variante int8 cuantizada)
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx2.onnx")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+MICROBATCH_WAIT_MS = float(os.getenv("EMBEDDING_MICROBATCH_WAIT_MS", "5"))
+MICROBATCH_MAX = int(os.getenv("EMBEDDING_MICROBATCH_MAX", "64"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+# Ruta .npz opcional para conservar los embeddings de consultas entre reinicios
+QUERY_CACHE_PATH = os.getenv("QUERY_EMBEDDING_CACHE_PATH") or None
+# Directorio del almacén de embeddings por contenido ("" lo desactiva)
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", str(Path(__file__).parent / "embedding_store"))
+
+# ===============================
+# Backends
+# ===============================
+class EmbeddingBackend(ABC):
+    """Interfaz de un backend de embeddings."""
+
+    model_id = ""
+
+    @abstractmethod
+    def dimension(self) -> int:
+        ...
+
+    @abstractmethod
+    def encode(self, texts: list[str], batch_size: int) -> np.ndarray:
+        """Retorna una matriz float32 de forma (len(texts), dimension)."""
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        """Tokens de cada texto; por defecto con el tokenizador del modelo de chat."""
+        return [count_tokens(t) for t in texts]
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Modelo PyTorch de sentence-transformers."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.model_id = model_name
+
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size):
+        return np.asarray(
+            self.model.encode(texts, batch_size=batch_size, show_progress_bar=False),
+            dtype=np.float32
+        )
+
+    def token_lengths(self, texts):
+        # Una sola llamada en lote al tokenizador rápido del modelo
+        encoded = self.model.tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+
+class OnnxBackend(SentenceTransformerBackend):
+    """Mismo modelo exportado a ONNX (CPU, p. ej. cuantizado a int8) vía onnxruntime."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(
+            model_name,
+            backend="onnx",
+            model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+        )
+        self.model_id = f"{model_name}:{EMBEDDING_ONNX_FILE}"
+
+
+_BACKENDS = {
+    "sentence-transformers": SentenceTransformerBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def register_backend(name: str, backend_cls):
+    """Registra un backend adicional seleccionable con EMBEDDING_BACKEND."""
+    _BACKENDS[name] = backend_cls
+
+# ===============================
+# Caché de embeddings de consultas
+# ===============================
+class EmbeddingCache(TTLCache):
+    """
+    TTLCache de vectores que persiste en un .npz: claves como arreglo de
+    texto y vectores como una sola matriz float32.
+    """
+
+    def _save(self):
+        with self._lock:
+            keys = list(self._data.keys())
+            vectors = [value for _, value in self._data.values()]
+        # Una caché vacía también se guarda, para que clear() quede persistido
+        matrix = np.stack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), np.float32)
+        tmp_path = f"{self.persist_path}.tmp.npz"
+        try:
+            np.savez(tmp_path, keys=np.array(keys, dtype=str), vectors=matrix)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar la caché '{self.name}': {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with np.load(self.persist_path) as data:
+                keys, vectors = data["keys"], data["vectors"]
+            for key, vector in zip(keys[-self.max_size:], vectors[-self.max_size:]):
+                self._data[str(key)] = (None, vector)
+            print(f"✅ Caché '{self.name}' cargada con {len(self._data)} entradas")
+        except Exception as e:
+            print(f"⚠️ Caché '{self.name}' ilegible, se descarta: {e}")
+
+# ===============================
+# Servicio
+# ===============================
+class EmbeddingService:
+    """
+    Dueño del único modelo de embeddings del proceso. `encode` procesa lotes
+    directamente (indexación); `encode_query` agrupa peticiones concurrentes
+    en micro-lotes para aprovechar una sola pasada del modelo.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend_name = backend
+        self._backend = None
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._batcher = None
+        self._store = None
+        self.query_cache = EmbeddingCache(
+            "query_embeddings",
+            max_size=QUERY_CACHE_SIZE,
+            ttl=0,
+            persist_path=QUERY_CACHE_PATH,
+            save_every=100
+        )
+
+    @property
+    def backend(self) -> EmbeddingBackend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    if self.backend_name not in _BACKENDS:
+                        raise ValueError(f"❌ Backend de embeddings desconocido: {self.backend_name}")
+                    self._backend = _BACKENDS[self.backend_name](self.model_name)
+                    print(f"✅ Modelo de embeddings cargado: {self._backend.model_id} ({self.backend_name})")
+        return self._backend
+
+    @property
+    def model_id(self) -> str:
+        return self.backend.model_id
+
+    def dimension(self) -> int:
+        return self.backend.dimension()
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        """Longitud en tokens del modelo de embeddings (para trocear sin truncar)."""
+        return self.backend.token_lengths(texts) if texts else []
+
+    def encode(self, texts: list[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension()), dtype=np.float32)
+        return self.backend.encode(list(texts), batch_size)
+
+    @property
+    def store(self):
+        """Almacén por contenido del modelo activo (None si está desactivado)."""
+        if self._store is None and EMBEDDING_STORE_DIR:
+            # model_id y dimension() toman el mismo lock al cargar el modelo
+            model_id, dim = self.model_id, self.dimension()
+            with self._lock:
+                if self._store is None:
+                    directory = Path(EMBEDDING_STORE_DIR) / re.sub(r"[^\w.-]+", "_", model_id)
+                    self._store = EmbeddingStore(directory, model_id, dim)
+                    register("embedding_store", self._store)
+        return self._store
+
+    def warm_up(self):
+        """Carga el modelo y hace una pasada para que la primera consulta no pague el arranque."""
+        self.encode(["warm up"])
+
+    def encode_documents(self, texts: list[str]) -> np.ndarray:
+        """
+        Embeddings para indexar. El texto ya codificado alguna vez con este
+        modelo se lee del almacén local; solo lo nuevo pasa por el modelo.
+        """
+        texts = list(texts)
+        store = self.store
+        if store is None or not texts:
+            return self.encode(texts)
+
+        vectors = store.get_many(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            encoded = self.encode(missing_texts)
+            store.put_many(missing_texts, encoded)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        return np.stack(vectors)
+
+    def encode_query(self, text: str) -> np.ndarray:
+        """
+        Embedding de una consulta. Se busca primero en la caché (texto
+        normalizado + model_id del backend); si no está, se agrupa con otras peticiones simultáneas.
+        """
+        key = f"{self.model_id}|{normalize_text(text)}"
+        vector = self.query_cache.get(key)
+        if vector is not None:
+            return vector
+
+        self._ensure_batcher()
+        future = Future()
+        self._requests.put((text, future))
+        vector = future.result()
+        self.query_cache.set(key, vector)
+        return vector
+
+    # ===============================
+    # Micro-batching
+    # ===============================
+    def _ensure_batcher(self):
+        if self._batcher is None or not self._batcher.is_alive():
+            with self._lock:
+                if self._batcher is None or not self._batcher.is_alive():
+                    self._batcher = threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True)
+                    self._batcher.start()
+
+    def _batch_loop(self):
+        wait_s = MICROBATCH_WAIT_MS / 1000
+        while True:
+            pending = [self._requests.get()]
+            # Se espera como mucho wait_s por lote (no por petición) para juntar
+            # las que lleguen a la vez; vencido el plazo solo se toman las ya encoladas
+            deadline = time.monotonic() + wait_s
+            try:
+                while len(pending) < MICROBATCH_MAX:
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        pending.append(self._requests.get(timeout=remaining))
+                    else:
+                        pending.append(self._requests.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                vectors = self.encode([text for text, _ in pending])
+                for (_, future), vector in zip(pending, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+
+
+embedding_service = EmbeddingService()
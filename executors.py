@@ -0,0 +1,35 @@
+# Ejecutores acotados para sacar del event loop el trabajo bloqueante:
+# uno para E/S síncrona (Selenium, clientes sin versión async) y otro para
+# CPU (embeddings, reranking, BM25), cuyos modelos liberan el GIL
+
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 2)))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+
+async def run_io(fn, *args, **kwargs):
+    """Ejecuta una llamada de E/S bloqueante sin frenar el event loop."""
+    loop = asyncio.get_running_loop()
+    # Se copia el contexto para que las métricas del request sigan al hilo
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(io_executor, context.run, functools.partial(fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Ejecuta trabajo de CPU en el pool acotado."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor, context.run, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,217 @@
+# Cola persistente (SQLite local) de trabajos de ingesta de PDFs
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+# ===============================
+# Configuración
+# ===============================
+QUEUE_PATH = Path(os.getenv("INGESTION_QUEUE_PATH", Path(__file__).parent / "ingestion_queue.db"))
+MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_lock = threading.Lock()
+_new_jobs = threading.Event()
+_conn = None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(QUEUE_PATH, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                blob_name TEXT NOT NULL,
+                etag TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                stats TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        # Trabajos que quedaron a medias por un reinicio vuelven a la cola
+        _conn.execute("UPDATE jobs SET status = ?, stage = NULL WHERE status = ?", (PENDING, RUNNING))
+        _conn.commit()
+    return _conn
+
+
+def _row_to_job(row) -> dict:
+    job = dict(row)
+    job["stats"] = json.loads(job["stats"]) if job["stats"] else {}
+    return job
+
+# ===============================
+# Operaciones de la cola
+# ===============================
+def enqueue(blob_name: str, etag: str = None) -> int:
+    """
+    Encola un blob para ingesta. Si ya hay un trabajo pendiente o en curso
+    para el mismo blob y etag, retorna su id en lugar de duplicarlo.
+    """
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE blob_name = ? AND IFNULL(etag, '') = IFNULL(?, '') AND status IN (?, ?)",
+            (blob_name, etag, PENDING, RUNNING)
+        ).fetchone()
+        if row:
+            return row["id"]
+        cur = conn.execute(
+            "INSERT INTO jobs (blob_name, etag, status, created_at) VALUES (?, ?, ?, ?)",
+            (blob_name, etag, PENDING, _now())
+        )
+        conn.commit()
+    _new_jobs.set()
+    return cur.lastrowid
+
+
+def wait_for_jobs(timeout: float) -> bool:
+    """Bloquea hasta que se encole un trabajo o venza el timeout."""
+    signaled = _new_jobs.wait(timeout)
+    _new_jobs.clear()
+    return signaled
+
+
+def claim_batch(limit: int = 1) -> list[dict]:
+    """
+    Toma hasta `limit` trabajos pendientes (uno por blob) y los marca en curso.
+    Se omiten los blobs que ya tienen un trabajo en curso: dos workers no
+    deben parsear ni escribir el mismo blob a la vez.
+    """
+    with _lock:
+        conn = _get_conn()
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE id IN "
+            "(SELECT MIN(id) FROM jobs WHERE status = ? "
+            "AND blob_name NOT IN (SELECT blob_name FROM jobs WHERE status = ?) GROUP BY blob_name) "
+            "ORDER BY id LIMIT ?",
+            (PENDING, RUNNING, limit)
+        ).fetchall()
+        if not rows:
+            return []
+        started_at = _now()
+        conn.executemany(
+            "UPDATE jobs SET status = ?, stage = ?, attempts = attempts + 1, started_at = ?, error = NULL WHERE id = ?",
+            [(RUNNING, "queued", started_at, row["id"]) for row in rows]
+        )
+        conn.commit()
+
+    jobs = []
+    for row in rows:
+        job = _row_to_job(row)
+        job["status"] = RUNNING
+        job["attempts"] += 1
+        jobs.append(job)
+    return jobs
+
+
+def claim_next():
+    """Toma el siguiente trabajo pendiente y lo marca en curso."""
+    jobs = claim_batch(1)
+    return jobs[0] if jobs else None
+
+
+def update_stage(job_id: int, stage: str, stats: dict = None):
+    """Registra el progreso de un trabajo en curso."""
+    with _lock:
+        conn = _get_conn()
+        if stats is None:
+            conn.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+        else:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, stats = ? WHERE id = ?",
+                (stage, json.dumps(stats), job_id)
+            )
+        conn.commit()
+
+
+def complete(job_id: int, stats: dict):
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = NULL, stats = ?, finished_at = ? WHERE id = ?",
+            (DONE, json.dumps(stats), _now(), job_id)
+        )
+        conn.commit()
+
+
+def fail(job_id: int, error: str, stats: dict = None):
+    """Marca el trabajo como fallido o lo devuelve a la cola si quedan intentos."""
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = PENDING if row and row["attempts"] < MAX_ATTEMPTS else FAILED
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = NULL, error = ?, stats = ?, finished_at = ? WHERE id = ?",
+            (status, error, json.dumps(stats or {}), _now(), job_id)
+        )
+        conn.commit()
+    if status == PENDING:
+        _new_jobs.set()
+
+# ===============================
+# Consultas
+# ===============================
+def get_job(job_id: int):
+    with _lock:
+        row = _get_conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(status: str = None, limit: int = 50) -> list[dict]:
+    with _lock:
+        conn = _get_conn()
+        if status:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [_row_to_job(r) for r in rows]
+
+
+def failed_etags(blob_names) -> dict:
+    """{blob_name: etag} de los blobs cuyo último trabajo terminó fallido (agotó sus intentos)."""
+    names = list(blob_names)
+    failed = {}
+    with _lock:
+        conn = _get_conn()
+        # SQLite limita la cantidad de parámetros por consulta
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            rows = conn.execute(
+                "SELECT blob_name, etag, status FROM jobs WHERE id IN "
+                f"(SELECT MAX(id) FROM jobs WHERE blob_name IN ({','.join('?' * len(batch))}) GROUP BY blob_name)",
+                batch
+            ).fetchall()
+            failed.update({r["blob_name"]: r["etag"] for r in rows if r["status"] == FAILED})
+    return failed
+
+
+def queue_stats() -> dict:
+    """Cantidad de trabajos por estado."""
+    with _lock:
+        rows = _get_conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    counts.update({r["status"]: r["n"] for r in rows})
+    return counts
@@ -0,0 +1,85 @@
+# Worker de ingesta en segundo plano: consume la cola persistente,
+# descarga, parsea e indexa PDFs sin bloquear las consultas
+
+import os
+import threading
+import ingestion_queue
+from pdf_pipeline import ingest_blobs
+from blob_sync import mark_indexed
+
+# ===============================
+# Configuración
+# ===============================
+NUM_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+POLL_INTERVAL = float(os.getenv("INGESTION_POLL_INTERVAL", "5"))
+# Trabajos que se toman de la cola y pasan juntos por la tubería
+BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", "64"))
+
+_stop_event = threading.Event()
+_threads = []
+
+# ===============================
+# Procesamiento de trabajos
+# ===============================
+def process_jobs(jobs: list[dict]) -> dict:
+    """Pasa un lote de trabajos por la tubería de ingesta y registra el resultado de cada uno."""
+    jobs_by_blob = {job["blob_name"]: job for job in jobs}
+    for job in jobs:
+        ingestion_queue.update_stage(job["id"], "downloading")
+
+    def on_document(blob_name, stats, error):
+        job = jobs_by_blob[blob_name]
+        # error también cubre un lote que no quedó escrito en Qdrant (BulkWriteError):
+        # el trabajo vuelve a la cola y el etag no se marca como indexado
+        if error:
+            ingestion_queue.fail(job["id"], error, stats)
+            print(f"⚠️ Error en ingesta de {blob_name} (intento {job['attempts']}): {error}")
+            return
+        if not stats.get("pages"):
+            print(f"ℹ️ PDF sin texto extraíble: {blob_name}")
+        ingestion_queue.complete(job["id"], stats)
+        mark_indexed(blob_name, job["etag"])
+
+    return ingest_blobs(list(jobs_by_blob), on_document=on_document)
+
+
+def _worker_loop():
+    while not _stop_event.is_set():
+        jobs = ingestion_queue.claim_batch(BATCH_SIZE)
+        if not jobs:
+            ingestion_queue.wait_for_jobs(POLL_INTERVAL)
+            continue
+
+        try:
+            process_jobs(jobs)
+        except Exception as e:
+            for job in jobs:
+                if ingestion_queue.get_job(job["id"])["status"] == ingestion_queue.RUNNING:
+                    ingestion_queue.fail(job["id"], str(e))
+            print(f"⚠️ Error en lote de ingesta: {e}")
+
+# ===============================
+# Ciclo de vida
+# ===============================
+def start_ingestion_worker():
+    """Lanza INGESTION_WORKERS hilos de ingesta en segundo plano."""
+    if any(t.is_alive() for t in _threads):
+        return
+    _stop_event.clear()
+    _threads.clear()
+    for i in range(max(1, NUM_WORKERS)):
+        t = threading.Thread(target=_worker_loop, name=f"ingestion-worker-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+    print(f"⚙️ Worker de ingesta iniciado ({len(_threads)} hilos)")
+
+
+def stop_ingestion_worker():
+    _stop_event.set()
+
+
+def get_worker_status() -> dict:
+    return {
+        "workers": sum(t.is_alive() for t in _threads),
+        "queue": ingestion_queue.queue_stats(),
+    }
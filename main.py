@@ -1,77 +1,362 @@
-
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
-from pathlib import Path
-from memory_keeper import MemoryKeeper
-from retriever import load_pdfs_azure
-from synthesizer import synthesize_answer
-from web_searcher import get_web_papers_selenium
-from vectorizacion import (
-    index_web_papers,
-    ensure_collection
-)
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-memory_keeper = MemoryKeeper()
-
-@app.on_event("startup")
-async def startup_event():
-    ensure_collection()  
-
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    html_path = Path(__file__).parent / "static" / "index.html"
-    with open(html_path, "r", encoding="utf-8") as f:
-        return f.read()
-
-@app.post("/ask")
-async def ask(request: Request):
-    try:
-        data = await request.json()
-        question = data.get("question", "").strip()
-    except Exception:
-        return JSONResponse(
-            content={"answer": "Error leyendo el request, envía un JSON válido."},
-            status_code=400
-        )
-
-    if not question:
-        return JSONResponse(
-            content={"answer": "Por favor ingresa una consulta válida."},
-            status_code=400
-        )
-
-    try:
-        # Recuperar PDFs (solo descarga e indexa nuevos)
-        pdf_texts_by_pages, pdf_metadata = load_pdfs_azure()
-
-        # Buscar papers web
-        web_papers = get_web_papers_selenium(question)
-
-        # Indexar web papers (los PDFs ya se indexaron dentro de load_pdfs_azure)
-        index_web_papers(web_papers)
-
-        # Recuperar memoria contextual
-        memory = memory_keeper.get_context()
-
-        # Generar respuesta con Azure OpenAI
-        answer = synthesize_answer(question, pdf_texts_by_pages, pdf_metadata, memory, web_papers)
-
-        # Guardar en memoria
-        memory_keeper.remember(question, answer)
-
-        # Respuesta JSON serializable
-        return JSONResponse(content={"answer": answer})
-
-    except Exception as e:
-        return JSONResponse(content={"answer": f"Error procesando la consulta: {str(e)}"})
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from pathlib import Path
+import json
+import time
+import uuid
+import asyncio
+import logging
+from memory_keeper import MemoryKeeper, answer_text, MEMORY_PURGE_INTERVAL
+from blob_sync import sync_blobs, get_sync_status, start_sync_scheduler, stop_sync_scheduler
+from ingestion_queue import enqueue, get_job, list_jobs
+from ingestion_worker import start_ingestion_worker, stop_ingestion_worker, get_worker_status
+from pdf_pipeline import shutdown_parse_pool
+from retriever import BLOB_PREFIX
+from synthesizer import asynthesize_answer, astream_answer, is_cacheable_answer, RETRIEVAL_TOP_K
+from executors import run_io, run_cpu, shutdown_executors
+from web_searcher import browser_pool
+from cache import cache_stats, flush_caches
+from vectorizacion import (
+    index_web_papers,
+    ensure_collection,
+    rebuild_bm25_index
+)
+from bm25_index import bm25_index
+from embeddings import embedding_service
+from answer_cache import answer_cache, corpus_version, ANSWER_CACHE_ENABLED
+from query_planner import plan_query, execute_plan
+from metrics import render_prometheus, start_request_timings, span, REQUESTS, REQUEST_SECONDS
+from reranker import RERANK_ENABLED, warm_up as warm_up_reranker
+from clients import close_clients
+from warmup import WarmUp
+
+app = FastAPI()
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # En respuestas en streaming mide hasta que se envían las cabeceras
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUESTS.inc(endpoint=endpoint, status=status)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
+
+logger = logging.getLogger(__name__)
+
+memory_keeper = MemoryKeeper()
+# Referencias a tareas en segundo plano para que no las recolecte el GC
+background_tasks = set()
+warm_up = WarmUp()
+purge_task = None
+
+async def purge_memory_periodically():
+    # Con el backend SQLite las sesiones vencidas solo se borran aquí; la purga hace E/S, va al pool
+    while True:
+        try:
+            await run_io(memory_keeper.purge_expired)
+        except Exception:
+            logger.exception("⚠️ Error purgando sesiones vencidas")
+        await asyncio.sleep(MEMORY_PURGE_INTERVAL)
+
+@app.on_event("startup")
+async def startup_event():
+    global purge_task
+    # El arranque no espera a la red ni a los modelos: el calentamiento corre
+    # en segundo plano mientras Uvicorn abre el puerto y /readyz informa el estado
+    warm_up.add("qdrant", ensure_collection)
+    warm_up.add("embeddings", embedding_service.warm_up)
+    if RERANK_ENABLED:
+        warm_up.add("reranker", warm_up_reranker, required=False)
+    warm_up.add("browser_pool", browser_pool.warm_up, required=False)
+    if not len(bm25_index):
+        warm_up.add("bm25", rebuild_bm25_index, required=False, after="qdrant")
+    warm_up.start()
+
+    purge_task = asyncio.create_task(purge_memory_periodically())
+    start_ingestion_worker()
+    start_sync_scheduler()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    warm_up.stop()
+    if purge_task is not None:
+        purge_task.cancel()
+    stop_sync_scheduler()
+    stop_ingestion_worker()
+    shutdown_parse_pool()
+    browser_pool.close()
+    flush_caches()
+    bm25_index.flush()
+    shutdown_executors()
+    await close_clients()
+
+@app.get("/", response_class=HTMLResponse)
+async def root():
+    html_path = Path(__file__).parent / "static" / "index.html"
+    with open(html_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: el proceso y el event loop responden
+    return JSONResponse(content={"status": "ok", "uptime_s": warm_up.status()["uptime_s"]})
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: terminaron las tareas de calentamiento requeridas
+    status = warm_up.status()
+    return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
+
+@app.get("/sync")
+async def sync_status():
+    return JSONResponse(content=get_sync_status())
+
+@app.post("/sync")
+async def sync_now():
+    # Sincronización bajo demanda de Azure Blob -> Qdrant
+    try:
+        stats = await run_in_threadpool(sync_blobs)
+        return JSONResponse(content=stats)
+    except Exception as e:
+        return JSONResponse(content={"error": f"Error sincronizando blobs: {str(e)}"}, status_code=500)
+
+@app.get("/cache")
+async def caches():
+    return JSONResponse(content=cache_stats())
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/ingest")
+async def ingest(request: Request):
+    # Encola blobs concretos ({"blobs": [...]}) o, sin cuerpo, lanza una sincronización
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        return JSONResponse(content={"error": "El cuerpo debe ser un objeto JSON"}, status_code=400)
+    blob_names = data.get("blobs") or []
+    if not isinstance(blob_names, list) or not all(isinstance(name, str) for name in blob_names):
+        return JSONResponse(content={"error": "'blobs' debe ser una lista de nombres de blob"}, status_code=400)
+    invalid = [name for name in blob_names if not (name.startswith(BLOB_PREFIX) and name.endswith(".pdf"))]
+    if invalid:
+        return JSONResponse(
+            content={"error": f"Solo se aceptan PDFs bajo {BLOB_PREFIX}", "invalid": invalid},
+            status_code=400
+        )
+
+    if not blob_names:
+        stats = await run_in_threadpool(sync_blobs)
+        return JSONResponse(content={"sync": stats, **get_worker_status()})
+
+    job_ids = [enqueue(name) for name in blob_names]
+    return JSONResponse(content={"jobs": job_ids, **get_worker_status()}, status_code=202)
+
+@app.get("/ingest/jobs")
+async def ingest_jobs(status: str = None, limit: int = 50):
+    return JSONResponse(content={"jobs": list_jobs(status, limit), **get_worker_status()})
+
+@app.get("/ingest/jobs/{job_id}")
+async def ingest_job(job_id: int):
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Trabajo no encontrado"}, status_code=404)
+    return JSONResponse(content=job)
+
+def get_session_id(request: Request, data: dict) -> str:
+    # El cliente guarda su ID de sesión; si no lo envía se le asigna uno nuevo
+    session_id = str(data.get("session_id") or request.headers.get("X-Session-Id") or "")
+    return session_id.strip()[:64] or uuid.uuid4().hex
+
+def wants_timings(request: Request, data: dict) -> bool:
+    # Desglose de tiempos por etapa en la respuesta: {"timings": true} o ?timings=1
+    return bool(data.get("timings")) or request.query_params.get("timings") in ("1", "true")
+
+def index_in_background(web_papers):
+    # Indexar web papers en segundo plano (los PDFs los indexa la sincronización
+    # de blobs). También los que vienen de la caché de búsqueda: la caché
+    # sobrevive a reinicios y migraciones de la colección, y los IDs salen de
+    # la URL, así que los ya indexados solo cuestan la verificación de existencia
+    if web_papers:
+        task = asyncio.create_task(run_io(index_web_papers, web_papers))
+        background_tasks.add(task)
+        task.add_done_callback(finish_background_task)
+
+def finish_background_task(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("❌ Error indexando papers web", exc_info=task.exception())
+
+async def lookup_answer(question: str, memory: str, scope: str):
+    """
+    Busca una respuesta ya generada para una pregunta equivalente. Solo se
+    usa en preguntas sin historial: con memoria la respuesta depende de la
+    conversación. Retorna (respuesta o None, clave para guardar o None).
+    """
+    if not ANSWER_CACHE_ENABLED or memory:
+        return None, None
+    vector = await run_cpu(embedding_service.encode_query, question)
+    version = corpus_version()
+    return answer_cache.get(vector, version, scope), (vector, version, scope)
+
+def store_answer(cache_key, answer: str):
+    if cache_key is not None and is_cacheable_answer(answer):
+        vector, version, scope = cache_key
+        answer_cache.set(vector, answer, version, scope)
+
+@app.post("/ask")
+async def ask(request: Request):
+    try:
+        data = await request.json()
+        question = data.get("question", "").strip()
+        session_id = get_session_id(request, data)
+        plan = plan_query(data.get("source"))
+        include_timings = wants_timings(request, data)
+    except Exception:
+        return JSONResponse(
+            content={"answer": "Error leyendo el request, envía un JSON válido."},
+            status_code=400
+        )
+
+    if not question:
+        return JSONResponse(
+            content={"answer": "Por favor ingresa una consulta válida."},
+            status_code=400
+        )
+
+    timings = start_request_timings()
+    start = time.perf_counter()
+
+    def respond(content: dict, status_code: int = 200):
+        if include_timings:
+            content["timings_ms"] = {**timings, "total": round((time.perf_counter() - start) * 1000, 2)}
+        return JSONResponse(content=content, status_code=status_code)
+
+    try:
+        # Recuperar memoria contextual
+        memory = await run_io(memory_keeper.get_context, session_id)
+
+        # Pregunta equivalente ya respondida con el corpus actual
+        answer, cache_key = await lookup_answer(question, memory, plan.route)
+        if answer is not None:
+            await run_io(memory_keeper.remember, session_id, question, answer)
+            return respond({"answer": answer, "session_id": session_id, "cached": True})
+
+        # Recuperar de Qdrant y/o buscar papers web según la fuente pedida
+        with span("retrieval_stages"):
+            async for _ in execute_plan(question, plan, RETRIEVAL_TOP_K):
+                pass
+
+        index_in_background(plan.web_papers)
+
+        # Generar respuesta con Azure OpenAI
+        answer = await asynthesize_answer(question, memory, plan.web_papers, plan.retrieved)
+        store_answer(cache_key, answer)
+
+        # Guardar en memoria
+        await run_io(memory_keeper.remember, session_id, question, answer)
+
+        # Respuesta JSON serializable
+        return respond({
+            "answer": answer,
+            "session_id": session_id,
+            "cached": False,
+            "plan": plan.to_dict()
+        })
+
+    except Exception as e:
+        logger.exception(f"❌ Error procesando la consulta: {e}")
+        return respond({"answer": f"Error procesando la consulta: {str(e)}", "session_id": session_id}, 500)
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_stream(request: Request):
+    # Igual que /ask, pero emite Server-Sent Events: etapas del pipeline
+    # a medida que terminan y los tokens del LLM según llegan
+    try:
+        data = await request.json()
+        question = data.get("question", "").strip()
+        session_id = get_session_id(request, data)
+        plan = plan_query(data.get("source"))
+        include_timings = wants_timings(request, data)
+    except Exception:
+        return JSONResponse(
+            content={"answer": "Error leyendo el request, envía un JSON válido."},
+            status_code=400
+        )
+
+    if not question:
+        return JSONResponse(
+            content={"answer": "Por favor ingresa una consulta válida."},
+            status_code=400
+        )
+
+    async def events():
+        timings = start_request_timings()
+        start = time.perf_counter()
+
+        def done_event(content: dict) -> str:
+            if include_timings:
+                content["timings_ms"] = {**timings, "total": round((time.perf_counter() - start) * 1000, 2)}
+            return sse_event("done", content)
+
+        try:
+            yield sse_event("status", {"stage": "started", "session_id": session_id, "route": plan.route})
+
+            memory = await run_io(memory_keeper.get_context, session_id)
+            cached, cache_key = await lookup_answer(question, memory, plan.route)
+            if cached is not None:
+                answer = answer_text(cached)
+                await run_io(memory_keeper.remember, session_id, question, answer)
+                yield sse_event("status", {"stage": "cache_hit"})
+                yield sse_event("token", {"text": answer})
+                yield done_event({"answer": answer, "cached": True})
+                return
+
+            with span("retrieval_stages"):
+                async for stage, info in execute_plan(question, plan, RETRIEVAL_TOP_K):
+                    if stage == "web_results":
+                        index_in_background(plan.web_papers)
+                    yield sse_event("status", {"stage": stage, **info})
+
+            answer = []
+            async for token in astream_answer(question, memory, plan.web_papers, plan.retrieved):
+                answer.append(token)
+                yield sse_event("token", {"text": token})
+
+            answer = "".join(answer)
+            store_answer(cache_key, json.dumps([{"content": answer, "role": "assistant"}], ensure_ascii=False))
+            await run_io(memory_keeper.remember, session_id, question, answer)
+            yield done_event({"answer": answer, "cached": False, "plan": plan.to_dict()})
+
+        except Exception as e:
+            logger.exception(f"❌ Error procesando la consulta: {e}")
+            yield sse_event("error", {"message": f"Error procesando la consulta: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,11 +1,219 @@
-# Guarda el historial de preguntas y respuestas para mantener contexto en conversaciones y realizar seguimiento
-
-class MemoryKeeper:
-    def __init__(self):
-        self.history = []
-
-    def remember(self, user_input, response):
-        self.history.append((user_input, response))
-
-    def get_context(self):
-        return "\n".join([f"Q: {q}\nA: {a}" for q, a in self.history])
\ No newline at end of file
+# Guarda el historial de preguntas y respuestas por sesión para mantener contexto en conversaciones y realizar seguimiento
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from tokens import count_tokens, truncate_tokens
+
+# ===============================
+# Configuración
+# ===============================
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "6"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+MEMORY_SESSION_TTL = float(os.getenv("MEMORY_SESSION_TTL", "3600"))
+# Cada cuánto se purgan las sesiones vencidas (en proceso y en SQLite)
+MEMORY_PURGE_INTERVAL = float(os.getenv("MEMORY_PURGE_INTERVAL", "600"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+MEMORY_ANSWER_CHARS = int(os.getenv("MEMORY_ANSWER_CHARS", "600"))
+# Tokens del contexto que recibe el modelo: resumen (hasta la mitad) y los turnos más recientes
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "500"))
+# "memory" (solo en proceso) o "sqlite" (sobrevive reinicios)
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory").lower()
+MEMORY_DB_PATH = Path(os.getenv("MEMORY_DB_PATH", Path(__file__).parent / "memory.db"))
+
+
+def answer_text(response) -> str:
+    """El sintetizador responde un arreglo JSON de {content, role}; se guarda solo el texto."""
+    try:
+        items = json.loads(response)
+        if isinstance(items, list):
+            return "\n".join(item.get("content", "") for item in items if isinstance(item, dict))
+    except (TypeError, ValueError):
+        pass
+    return str(response)
+
+
+def _recent_lines(text: str, max_tokens: int) -> str:
+    """Las últimas líneas de `text` que caben en `max_tokens`."""
+    lines = text.split("\n")
+    while lines and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def summarize_turn(question: str, answer: str) -> str:
+    """Resumen extractivo de un turno: la pregunta y la primera oración de la respuesta."""
+    first = answer.strip().split("\n", 1)[0]
+    end = first.find(". ")
+    if end != -1:
+        first = first[:end + 1]
+    return f"- {question.strip()} -> {first[:200]}"
+
+
+class Session:
+    """Últimos turnos en un buffer circular y un resumen incremental de los que salieron."""
+
+    def __init__(self, turns=(), summary: str = ""):
+        self.turns = deque(turns, maxlen=MEMORY_MAX_TURNS)
+        self.summary = summary
+        self.last_access = time.monotonic()
+        self._context = None
+
+    def add(self, question: str, answer: str):
+        if len(self.turns) == self.turns.maxlen:
+            old_q, old_a = self.turns[0]
+            summary = f"{self.summary}\n{summarize_turn(old_q, old_a)}".strip()
+            # Se conserva lo más reciente del resumen dentro del presupuesto
+            lines = summary.split("\n")
+            while len(lines) > 1 and count_tokens(summary) > MEMORY_SUMMARY_TOKENS:
+                lines.pop(0)
+                summary = "\n".join(lines)
+            self.summary = summary
+        self.turns.append((question, answer[:MEMORY_ANSWER_CHARS]))
+        self._context = None
+
+    def context(self) -> str:
+        """
+        Contexto dentro de MEMORY_TOKEN_BUDGET: lo más reciente del resumen
+        (hasta la mitad del presupuesto) y luego los turnos completos más
+        recientes que quepan. Si ni el último turno cabe, va recortado.
+        """
+        if self._context is None:
+            summary = _recent_lines(self.summary, MEMORY_TOKEN_BUDGET // 2) if self.summary else ""
+            header = f"Resumen de la conversación:\n{summary}" if summary else ""
+            budget = MEMORY_TOKEN_BUDGET - count_tokens(header)
+            turns = []
+            for q, a in reversed(self.turns):
+                turn = f"Q: {q}\nA: {a}"
+                # +1 por el salto de línea que los une
+                cost = count_tokens(turn) + 1
+                if cost > budget:
+                    if not turns:
+                        turns.append(truncate_tokens(turn, budget - 1))
+                    break
+                turns.append(turn)
+                budget -= cost
+            self._context = "\n".join(([header] if header else []) + [t for t in reversed(turns) if t])
+        return self._context
+
+# ===============================
+# Backend persistente opcional
+# ===============================
+class SQLiteMemoryBackend:
+    def __init__(self, path: Path = MEMORY_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                turns TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def load(self, session_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, turns FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, time.time() - MEMORY_SESSION_TTL)
+            ).fetchone()
+        if row is None:
+            return None
+        return Session([tuple(t) for t in json.loads(row[1])], row[0])
+
+    def save(self, session_id: str, session: Session):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, summary, turns, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, session.summary, json.dumps(list(session.turns), ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def purge(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (time.time() - MEMORY_SESSION_TTL,))
+            self._conn.commit()
+
+
+def _default_backend():
+    if MEMORY_BACKEND == "sqlite":
+        return SQLiteMemoryBackend()
+    return None
+
+# ===============================
+# Memoria por sesión
+# ===============================
+class MemoryKeeper:
+    """
+    Sesiones indexadas por el ID que envía el cliente. En proceso se
+    mantienen como mucho MEMORY_MAX_SESSIONS (LRU) y las inactivas más de
+    MEMORY_SESSION_TTL segundos se descartan.
+    """
+
+    def __init__(self, backend=None, max_sessions: int = MEMORY_MAX_SESSIONS, ttl: float = MEMORY_SESSION_TTL):
+        self.backend = backend if backend is not None else _default_backend()
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str, create: bool):
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is not None and now - session.last_access > self.ttl:
+            del self._sessions[session_id]
+            session = None
+        if session is None and self.backend is not None:
+            session = self.backend.load(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = Session()
+        session.last_access = now
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def remember(self, session_id: str, user_input, response):
+        if not session_id:
+            return
+        with self._lock:
+            session = self._get(session_id, create=True)
+            session.add(user_input, answer_text(response))
+            if self.backend is not None:
+                self.backend.save(session_id, session)
+
+    def get_context(self, session_id: str) -> str:
+        if not session_id:
+            return ""
+        with self._lock:
+            session = self._get(session_id, create=False)
+            return session.context() if session is not None else ""
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def purge_expired(self):
+        with self._lock:
+            now = time.monotonic()
+            for session_id in [s for s, v in self._sessions.items() if now - v.last_access > self.ttl]:
+                del self._sessions[session_id]
+        if self.backend is not None:
+            self.backend.purge()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "backend": type(self.backend).__name__ if self.backend is not None else "memory",
+        }
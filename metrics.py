@@ -0,0 +1,152 @@
+# Métricas del proceso en formato de exposición de Prometheus (contadores e
+# histogramas con etiquetas) y desglose de tiempos por etapa de cada request
+
+import time
+import inspect
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# Límites superiores (segundos) de los buckets de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # etiquetas -> [conteos por bucket..., suma, total]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ===============================
+# Métricas del pipeline
+# ===============================
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duración de cada etapa del pipeline")
+REQUEST_SECONDS = Histogram("rag_request_seconds", "Duración de los requests HTTP por endpoint y estado")
+REQUESTS = Counter("rag_requests_total", "Requests HTTP por endpoint y estado")
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Etapas que terminaron con excepción")
+CACHE_REQUESTS = Counter("rag_cache_requests_total", "Consultas a cachés por resultado (hit/miss)")
+LLM_CALLS = Counter("rag_llm_calls_total", "Llamadas al modelo de chat por resultado")
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens enviados y generados por el modelo de chat")
+POINTS_UPSERTED = Counter("rag_points_upserted_total", "Puntos insertados en Qdrant por tipo")
+QDRANT_RETRIES = Counter("rag_qdrant_retries_total", "Reintentos de llamadas a Qdrant por operación")
+PDFS_PARSED = Counter("rag_pdfs_parsed_total", "PDFs descargados y parseados por resultado")
+
+# ===============================
+# Desglose por request
+# ===============================
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> dict:
+    """Empieza a acumular los tiempos de las etapas del request actual."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage: str):
+    """Mide una etapa: histograma global y, si hay un request en curso, su desglose."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            # Etapas repetidas o concurrentes suman sus tiempos
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 2)
+
+
+def timed(stage: str):
+    """Decorador de span para funciones síncronas y asíncronas."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
@@ -0,0 +1,200 @@
+# Ingesta en tubería: descargas concurrentes a memoria, parseo en un pool de
+# procesos y embeddings por lotes a medida que llegan las páginas
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pdf_text import parse_pdf_bytes
+from retriever import download_pdf_bytes
+from vectorizacion import index_pdf_chunks
+from metrics import span, PDFS_PARSED
+
+# ===============================
+# Configuración
+# ===============================
+DOWNLOAD_WORKERS = int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", "8"))
+PARSE_WORKERS = int(os.getenv("PIPELINE_PARSE_WORKERS", str(os.cpu_count() or 2)))
+EMBED_BATCH_PAGES = int(os.getenv("PIPELINE_EMBED_BATCH_PAGES", "256"))
+# Documentos en vuelo (descargados, parseados o esperando embedding): acota la memoria
+MAX_IN_FLIGHT = int(os.getenv("PIPELINE_MAX_IN_FLIGHT", "16"))
+
+# ===============================
+# Pool de parseo compartido
+# ===============================
+# Arrancar procesos spawn cuesta el intérprete y la importación de PyPDF2 en
+# cada uno: el pool se crea una vez y lo reutilizan todas las ingestas
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max(1, PARSE_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def _discard_parse_pool(pool: ProcessPoolExecutor):
+    """Descarta un pool roto (murió un proceso hijo); el próximo uso crea otro."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def ingest_blobs(blob_names: list[str], on_document=None) -> dict:
+    """
+    Descarga, parsea e indexa una lista de blobs en tubería.
+
+    on_document(blob_name, stats, error) se invoca por documento cuando
+    termina (indexado, sin texto o con error). Retorna estadísticas globales.
+    """
+    blob_names = list(blob_names)
+    totals = {"documents": len(blob_names), "indexed": 0, "failed": 0, "empty": 0,
+              "pages": 0, "points": 0, "bytes": 0, "seconds": 0.0}
+    if not blob_names:
+        return totals
+
+    t_start = time.perf_counter()
+    slots = threading.BoundedSemaphore(max(1, MAX_IN_FLIGHT))
+    results = queue.Queue()
+
+    def notify(blob_name, stats, error):
+        if on_document:
+            try:
+                on_document(blob_name, stats, error)
+            except Exception as e:
+                print(f"⚠️ Error en callback de ingesta: {e}")
+
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(DOWNLOAD_WORKERS, thread_name_prefix="pdf-download") as download_pool:
+
+        def parse(blob_name, data, stats):
+            filename = os.path.basename(blob_name)
+            t0 = time.perf_counter()
+            parse_pool = None
+            try:
+                parse_pool = _get_parse_pool()
+                future = parse_pool.submit(parse_pdf_bytes, filename, data)
+            except (BrokenProcessPool, RuntimeError):
+                # Sin pool de procesos disponible se parsea en el propio hilo
+                if parse_pool is not None:
+                    _discard_parse_pool(parse_pool)
+                future = None
+            try:
+                with span("pdf_parse"):
+                    try:
+                        pdf_data, _ = future.result() if future else parse_pdf_bytes(filename, data)
+                    except BrokenProcessPool:
+                        # El documento falla (puede ser el que tumbó al hijo) y se reintenta con otro pool
+                        _discard_parse_pool(parse_pool)
+                        raise
+                stats["parse_s"] = round(time.perf_counter() - t0, 3)
+                if pdf_data:
+                    pdf_data["blob"] = blob_name
+                results.put((blob_name, pdf_data, stats, None))
+            except Exception as e:
+                results.put((blob_name, None, stats, f"Error procesando PDF {filename}: {e}"))
+
+        def download(blob_name):
+            stats = {"bytes": 0, "pages": 0}
+            t0 = time.perf_counter()
+            try:
+                data = download_pdf_bytes(blob_name)
+            except Exception as e:
+                results.put((blob_name, None, stats, f"Error al descargar {blob_name}: {e}"))
+                return
+            stats["bytes"] = len(data)
+            stats["download_s"] = round(time.perf_counter() - t0, 3)
+            parse(blob_name, data, stats)
+
+        def feeder():
+            for blob_name in blob_names:
+                # Si el ciclo principal se corta, los cupos no se liberan: se deja de esperar
+                while not slots.acquire(timeout=0.5):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                download_pool.submit(download, blob_name)
+
+        threading.Thread(target=feeder, name="pdf-feeder", daemon=True).start()
+
+        batch = []
+        batch_pages = 0
+
+        def flush():
+            nonlocal batch, batch_pages
+            if not batch:
+                return
+            t0 = time.perf_counter()
+            error = None
+            points = 0
+            try:
+                with span("index_batch"):
+                    points = index_pdf_chunks([pdf_data for _, pdf_data, _ in batch])
+            except Exception as e:
+                error = f"Error indexando lote: {e}"
+            index_s = round(time.perf_counter() - t0, 3)
+
+            for blob_name, pdf_data, stats in batch:
+                stats["index_s"] = index_s
+                stats["batch_points"] = points
+                if error:
+                    totals["failed"] += 1
+                else:
+                    totals["indexed"] += 1
+                    totals["pages"] += stats["pages"]
+                notify(blob_name, stats, error)
+                slots.release()
+            totals["points"] += points
+            batch = []
+            batch_pages = 0
+
+        try:
+            for _ in range(len(blob_names)):
+                blob_name, pdf_data, stats, error = results.get()
+                totals["bytes"] += stats.get("bytes", 0)
+
+                if error or not pdf_data:
+                    if error:
+                        totals["failed"] += 1
+                    else:
+                        totals["empty"] += 1
+                    PDFS_PARSED.inc(result="error" if error else "empty")
+                    notify(blob_name, stats, error)
+                    slots.release()
+                    continue
+
+                PDFS_PARSED.inc(result="ok")
+                stats["pages"] = len(pdf_data["pages_texts"])
+                batch.append((blob_name, pdf_data, stats))
+                batch_pages += stats["pages"]
+                # Con todos los cupos ocupados por el lote hay que vaciarlo para no bloquear
+                if batch_pages >= EMBED_BATCH_PAGES or len(batch) >= MAX_IN_FLIGHT:
+                    flush()
+
+            flush()
+        finally:
+            stop.set()
+
+    totals["seconds"] = round(time.perf_counter() - t_start, 3)
+    if totals["seconds"]:
+        totals["pages_per_s"] = round(totals["pages"] / totals["seconds"], 2)
+    print(f"📌 Ingesta en tubería completada: {totals}")
+    return totals
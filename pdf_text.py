@@ -0,0 +1,54 @@
+# Extracción de texto de PDFs en memoria. Sin clientes ni variables de entorno
+# para que pueda ejecutarse en procesos hijos del pool de parseo
+
+from io import BytesIO
+from PyPDF2 import PdfReader
+
+
+def compress_page_ranges(pages):
+    """Convierte lista de páginas en rango comprimido tipo '1-3,5,7-9'."""
+    if not pages:
+        return ""
+    pages = sorted(set(pages))
+    ranges = []
+    start = prev = pages[0]
+    for p in pages[1:]:
+        if p == prev + 1:
+            prev = p
+        else:
+            ranges.append(f"{start}-{prev}" if start != prev else str(start))
+            start = prev = p
+    ranges.append(f"{start}-{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def parse_pdf_bytes(filename: str, data: bytes):
+    """
+    Extrae el texto de las páginas de un PDF recibido como bytes.
+    Retorna (pdf_data, metadata) o (None, None) si no hay texto utilizable.
+    """
+    reader = PdfReader(BytesIO(data))
+    pages_texts = []
+    pages_numbers = []
+
+    for i, page in enumerate(reader.pages):
+        text = page.extract_text()
+        if text and text.strip():
+            pages_texts.append({"page": i + 1, "text": text.strip()})
+            pages_numbers.append(i + 1)
+
+    if not pages_texts:
+        return None, None
+
+    title = pages_texts[0]["text"].split("\n")[0].strip()
+    pdf_data = {
+        "filename": filename,
+        "title": title,
+        "pages_texts": pages_texts
+    }
+    metadata = {
+        "filename": filename,
+        "title": title,
+        "pages": compress_page_ranges(pages_numbers)
+    }
+    return pdf_data, metadata
@@ -0,0 +1,395 @@
+# Esquema de la colección de Qdrant: se verifica (y migra) una sola vez por
+# proceso, se recuerda el estado verificado y solo se vuelve a comprobar
+# tras un error. La versión aplicada, el modelo de embeddings y el modo de
+# almacenamiento se guardan en los metadatos de la colección
+
+import os
+import time
+import logging
+import argparse
+import threading
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PayloadSchemaType,
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig, Disabled, VectorParamsDiff,
+    SearchParams, QuantizationSearchParams
+)
+from embeddings import embedding_service
+from chunk_store import get_chunk_store
+from bulk_writer import BulkWriter, BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# ===============================
+# Configuración
+# ===============================
+SCHEMA_VERSION = 3
+PAYLOAD_INDEXES = ["filename", "blob", "url", "type", "title"]
+# Re-embeber la colección automáticamente si cambia el modelo o la dimensión
+QDRANT_AUTO_MIGRATE = os.getenv("QDRANT_AUTO_MIGRATE", "false").lower() == "true"
+MIGRATION_BATCH_SIZE = int(os.getenv("QDRANT_MIGRATION_BATCH_SIZE", "256"))
+
+# "full": el texto de cada fragmento va en el payload; "compact": el texto va
+# al almacén local de fragmentos (chunk_store) y el payload solo lleva metadatos.
+# En modo compacto el corpus queda atado al disco de esta instancia: la
+# colección sola no basta para servir resultados desde otra réplica o servidor
+STORAGE_MODE = os.getenv("QDRANT_STORAGE_MODE", "full").lower()
+COMPACT = STORAGE_MODE == "compact"
+# "none", "scalar" (int8, ~4x menos memoria) o "binary" (~32x, para modelos de
+# muchas dimensiones). Los vectores originales quedan en disco para re-puntuar
+QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "scalar" if COMPACT else "none").lower()
+QUANTIZATION_RESCORE = os.getenv("QDRANT_QUANTIZATION_RESCORE", "true").lower() == "true"
+QUANTIZATION_OVERSAMPLING = float(os.getenv(
+    "QDRANT_QUANTIZATION_OVERSAMPLING", "3.0" if QUANTIZATION == "binary" else "2.0"
+))
+# Campos que no se guardan en el payload (el score se calcula en cada búsqueda)
+DROPPED_PAYLOAD_FIELDS = ["score"]
+
+
+class SchemaMismatchError(RuntimeError):
+    pass
+
+
+def quantization_config():
+    if QUANTIZATION == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    if QUANTIZATION == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def search_params():
+    """Parámetros de búsqueda: con cuantización se buscan más candidatos y se re-puntúan con los originales."""
+    if QUANTIZATION not in ("scalar", "binary"):
+        return None
+    return SearchParams(quantization=QuantizationSearchParams(
+        rescore=QUANTIZATION_RESCORE,
+        oversampling=QUANTIZATION_OVERSAMPLING
+    ))
+
+
+def slim_payload(payload: dict) -> dict:
+    """Payload a guardar: sin campos nulos ni descartados y, en modo compacto, sin el texto."""
+    return {
+        key: value for key, value in payload.items()
+        if value is not None and key not in DROPPED_PAYLOAD_FIELDS and not (COMPACT and key == "content")
+    }
+
+
+class SchemaManager:
+    """
+    Migraciones versionadas, aplicadas en orden a partir de la versión
+    guardada en los metadatos:
+    1. índices keyword del payload que falten
+    2. el modelo y la dimensión de los vectores quedan registrados; si la
+       colección fue creada con otro modelo se re-embebe en una nueva y el
+       nombre pasa a ser un alias de esta
+    3. índice del nombre completo del blob (los PDFs se borran por blob, no por filename)
+    """
+
+    def __init__(self, get_client, collection_name: str, auto_migrate: bool = QDRANT_AUTO_MIGRATE):
+        # El cliente se pide al usarlo: crear el gestor no conecta con Qdrant
+        self._get_client = get_client
+        self.collection_name = collection_name
+        self.auto_migrate = auto_migrate
+        self.verified = False
+        self._lock = threading.Lock()
+        self._migrations = [
+            (1, "payload_indexes", self._migrate_payload_indexes),
+            (2, "embedding_model", self._migrate_embedding_model),
+            (3, "blob_index", self._migrate_payload_indexes),
+        ]
+
+    @property
+    def client(self):
+        return self._get_client()
+
+    def ensure(self):
+        """Verifica el esquema si aún no se hizo en este proceso."""
+        if self.verified:
+            return
+        with self._lock:
+            if self.verified:
+                return
+            self._verify()
+            self.verified = True
+
+    def invalidate(self):
+        """Tras un error de Qdrant, la próxima operación vuelve a verificar el esquema."""
+        self.verified = False
+
+    # ===============================
+    # Verificación
+    # ===============================
+    def _target_metadata(self) -> dict:
+        return {
+            "schema_version": SCHEMA_VERSION,
+            "embedding_model": embedding_service.model_id,
+            "vector_size": embedding_service.dimension(),
+            "quantization": QUANTIZATION,
+        }
+
+    def _create(self, name: str):
+        quantization = quantization_config()
+        self.client.create_collection(
+            collection_name=name,
+            vectors_config=VectorParams(
+                size=embedding_service.dimension(),
+                distance=Distance.COSINE,
+                # Cuantizados en RAM, originales en disco para el re-scoring
+                on_disk=quantization is not None
+            ),
+            quantization_config=quantization,
+            metadata={**self._target_metadata(), "payload_mode": STORAGE_MODE}
+        )
+        self._wait_until_ready(name)
+        self._create_payload_indexes(name, existing=set())
+
+    def _aliases(self) -> dict:
+        return {a.alias_name: a.collection_name for a in self.client.get_aliases().aliases}
+
+    def _exists(self) -> bool:
+        # Tras un re-embedding el nombre es un alias; no se depende de que collection_exists lo resuelva
+        return (self.client.collection_exists(collection_name=self.collection_name)
+                or self.collection_name in self._aliases())
+
+    def _verify(self):
+        if not self._exists():
+            logger.info(f"📁 Colección '{self.collection_name}' no existe. Creando...")
+            self._create(self.collection_name)
+            logger.info(f"✅ Colección '{self.collection_name}' creada y lista")
+            return
+
+        info = self.client.get_collection(collection_name=self.collection_name)
+        metadata = info.config.metadata or {}
+        version = int(metadata.get("schema_version", 0))
+        for target, name, migrate in self._migrations:
+            if target <= version:
+                continue
+            logger.info(f"🔧 Migración de esquema {target} ({name}) en '{self.collection_name}'")
+            migrate(info)
+            info = self.client.get_collection(collection_name=self.collection_name)
+
+        # El modelo puede cambiar aunque el esquema ya esté al día
+        if version >= 2:
+            self._migrate_embedding_model(info)
+        self._sync_storage_mode(info)
+        info = self.client.get_collection(collection_name=self.collection_name)
+        metadata = info.config.metadata or {}
+        if metadata != {**metadata, **self._target_metadata()}:
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                metadata={**metadata, **self._target_metadata()}
+            )
+        logger.info(f"✅ Esquema de '{self.collection_name}' verificado (versión {SCHEMA_VERSION})")
+
+    def _wait_until_ready(self, name: str, max_retries=10, delay=2):
+        for _ in range(max_retries):
+            try:
+                if self.client.get_collection(collection_name=name).status == "green":
+                    return
+            except Exception:
+                pass
+            time.sleep(delay)
+        raise TimeoutError(f"❌ Colección '{name}' no lista después de {max_retries*delay}s")
+
+    # ===============================
+    # Migraciones
+    # ===============================
+    def _create_payload_indexes(self, name: str, existing: set):
+        for field in PAYLOAD_INDEXES:
+            if field in existing:
+                continue
+            self.client.create_payload_index(
+                collection_name=name,
+                field_name=field,
+                field_schema=PayloadSchemaType.KEYWORD
+            )
+            logger.info(f"✅ Índice creado para '{field}'")
+
+    def _migrate_payload_indexes(self, info):
+        self._create_payload_indexes(self.collection_name, set(info.payload_schema or {}))
+
+    def _migrate_embedding_model(self, info):
+        metadata = info.config.metadata or {}
+        size = info.config.params.vectors.size
+        model = metadata.get("embedding_model")
+        if size == embedding_service.dimension() and model in (None, embedding_service.model_id):
+            return
+        if not self.auto_migrate:
+            raise SchemaMismatchError(
+                f"❌ La colección '{self.collection_name}' usa {model or 'otro modelo'} ({size} dims) y el modelo "
+                f"actual es {embedding_service.model_id} ({embedding_service.dimension()} dims). "
+                "Ejecuta `python qdrant_schema.py` o define QDRANT_AUTO_MIGRATE=true"
+            )
+        self.reembed()
+
+    def _sync_storage_mode(self, info):
+        """Aplica la cuantización configurada y comprueba el modo del payload."""
+        metadata = info.config.metadata or {}
+        current = metadata.get("quantization", "none")
+        if current != QUANTIZATION:
+            logger.info(f"🔧 Cuantización de '{self.collection_name}': {current} -> {QUANTIZATION}")
+            quantization = quantization_config()
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                vectors_config={"": VectorParamsDiff(on_disk=quantization is not None)},
+                quantization_config=quantization or Disabled.DISABLED
+            )
+
+        payload_mode = metadata.get("payload_mode", "full")
+        if payload_mode == STORAGE_MODE:
+            return
+        # Mientras tanto las búsquedas leen el texto del payload o, si no está, del almacén local
+        if not COMPACT:
+            logger.warning(
+                f"⚠️ '{self.collection_name}' está compactada: los puntos existentes se leen del "
+                f"almacén local ({get_chunk_store().directory}), que debe conservarse"
+            )
+        elif self.auto_migrate:
+            self.compact_payloads()
+        else:
+            logger.warning(
+                f"⚠️ '{self.collection_name}' guarda el texto en el payload y QDRANT_STORAGE_MODE=compact. "
+                f"Ejecuta `python qdrant_schema.py --compact`"
+            )
+
+    def compact_payloads(self) -> int:
+        """
+        Mueve el texto de los puntos al almacén local de fragmentos y borra de
+        Qdrant el texto, los campos nulos y los descartados. El texto se
+        guarda antes de borrarlo, así que se puede interrumpir y repetir.
+        Retorna la cantidad de puntos compactados.
+        """
+        store = get_chunk_store()
+        compacted = 0
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=MIGRATION_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            store.put_many((p.id, p.payload["content"]) for p in points if "content" in (p.payload or {}))
+
+            # Una llamada por combinación de claves a borrar, no una por punto
+            groups = {}
+            for point in points:
+                payload = point.payload or {}
+                keys = tuple(sorted(
+                    key for key, value in payload.items()
+                    if value is None or key == "content" or key in DROPPED_PAYLOAD_FIELDS
+                ))
+                if keys:
+                    groups.setdefault(keys, []).append(point.id)
+            for keys, ids in groups.items():
+                self.client.delete_payload(collection_name=self.collection_name, keys=list(keys), points=ids)
+                compacted += len(ids)
+            if points:
+                logger.info(f"🗜️ Compactados {compacted} puntos de '{self.collection_name}'")
+            if offset is None:
+                break
+
+        metadata = self.client.get_collection(collection_name=self.collection_name).config.metadata or {}
+        self.client.update_collection(
+            collection_name=self.collection_name,
+            metadata={**metadata, "payload_mode": "compact"}
+        )
+        logger.info(f"✅ '{self.collection_name}' en modo compacto ({len(store)} fragmentos en el almacén local)")
+        return compacted
+
+    def reembed(self):
+        """
+        Copia la colección a una nueva con el modelo actual (el contenido se
+        vuelve a embeber por lotes) y apunta el nombre de la colección, como
+        alias, a la nueva. La colección anterior solo se elimina cuando la
+        nueva tiene todos los puntos; si algo falla después, los datos
+        siguen en la nueva colección.
+        """
+        aliases = self._aliases()
+        source = aliases.get(self.collection_name, self.collection_name)
+        target = f"{self.collection_name}_{int(time.time())}"
+        self._create(target)
+        writer = BulkWriter(lambda: self.client, target)
+
+        copied = 0
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=source,
+                limit=MIGRATION_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            if points:
+                store = get_chunk_store()
+                stored = store.get_many([p.id for p in points if "content" not in (p.payload or {})])
+                texts = [(p.payload or {}).get("content", stored.get(p.id, "")) for p in points]
+                if COMPACT:
+                    store.put_many(zip([p.id for p in points], texts))
+                vectors = embedding_service.encode_documents(texts).tolist()
+                try:
+                    writer.write([
+                        PointStruct(id=p.id, vector=v, payload=slim_payload(p.payload or {}))
+                        for p, v in zip(points, vectors)
+                    ])
+                except BulkWriteError as e:
+                    # La colección anterior sigue siendo la activa: se puede reintentar la migración
+                    self.client.delete_collection(collection_name=target)
+                    raise RuntimeError(f"❌ Re-embedding interrumpido en '{target}': {e}")
+                copied += len(points)
+                logger.info(f"🔁 Re-embebidos {copied} puntos en '{target}'")
+            if offset is None:
+                break
+
+        # Antes de tocar la colección activa se comprueba que la nueva tenga todos los puntos
+        expected = self.client.count(collection_name=source, exact=True).count
+        written = self.client.count(collection_name=target, exact=True).count
+        if written != expected:
+            self.client.delete_collection(collection_name=target)
+            raise RuntimeError(f"❌ Re-embedding incompleto: '{target}' tiene {written} de {expected} puntos")
+
+        create = CreateAliasOperation(
+            create_alias=CreateAlias(collection_name=target, alias_name=self.collection_name)
+        )
+        if self.collection_name in aliases:
+            # Cambio atómico del alias; la colección anterior se elimina después
+            self.client.update_collection_aliases(change_aliases_operations=[
+                DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.collection_name)),
+                create
+            ])
+            self.client.delete_collection(collection_name=source)
+        else:
+            # Un alias no puede coexistir con una colección del mismo nombre: hay que
+            # eliminarla primero. La nueva ya está verificada, así que no se pierde nada
+            self.client.delete_collection(collection_name=source)
+            try:
+                self.client.update_collection_aliases(change_aliases_operations=[create])
+            except Exception as e:
+                raise RuntimeError(
+                    f"❌ No se pudo crear el alias '{self.collection_name}' -> '{target}': {e}. "
+                    f"Los datos están en '{target}'; crea el alias a mano o reintenta"
+                )
+        logger.info(f"✅ '{self.collection_name}' apunta a '{target}' ({copied} puntos)")
+
+
+if __name__ == "__main__":
+    # Migración manual:
+    #   python qdrant_schema.py             aplica migraciones y re-embebe si cambió el modelo
+    #   python qdrant_schema.py --compact   además mueve el texto al almacén local de fragmentos
+    parser = argparse.ArgumentParser(description="Migra la colección de Qdrant al esquema actual")
+    parser.add_argument("--compact", action="store_true",
+                        help="mueve el texto de los puntos al almacén local y reduce el payload")
+    args = parser.parse_args()
+
+    from vectorizacion import schema
+    schema.auto_migrate = True
+    schema.ensure()
+    if args.compact:
+        if not COMPACT:
+            logger.warning("⚠️ Define QDRANT_STORAGE_MODE=compact en la app para que no vuelva a guardar el texto en Qdrant")
+        schema.compact_payloads()
@@ -0,0 +1,145 @@
+# Planificador de consultas: decide qué etapas del pipeline se ejecutan según
+# la fuente que pide el cliente y señales baratas (confianza de la
+# recuperación local), y acota cada etapa con su propio timeout
+
+import os
+import asyncio
+import threading
+from executors import run_io
+from reranker import aretrieve_and_rerank
+from web_searcher import search_web_papers
+
+# ===============================
+# Configuración
+# ===============================
+LOCAL = "local"
+WEB = "web"
+BOTH = "both"
+
+# Botones de la interfaz: Azure -> PDFs en Azure Blob, Google -> Scholar, AWS -> ambos
+SOURCE_ROUTES = {
+    "pdf": LOCAL, "local": LOCAL, "azure": LOCAL,
+    "web": WEB, "scholar": WEB, "google": WEB,
+    "both": BOTH, "aws": BOTH,
+}
+
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "3"))
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "10"))
+# Omitir la búsqueda web si la recuperación local ya es confiable
+PLANNER_SKIP_WEB = os.getenv("PLANNER_SKIP_WEB", "true").lower() == "true"
+# Ventaja que se le da a la recuperación local antes de lanzar la búsqueda web
+PLANNER_LOCAL_FIRST_WAIT = float(os.getenv("PLANNER_LOCAL_FIRST_WAIT", "0.5"))
+CONFIDENT_DENSE_SCORE = float(os.getenv("PLANNER_CONFIDENT_DENSE_SCORE", "0.75"))
+CONFIDENT_RERANK_SCORE = float(os.getenv("PLANNER_CONFIDENT_RERANK_SCORE", "5.0"))
+MIN_CONFIDENT_RESULTS = int(os.getenv("PLANNER_MIN_CONFIDENT_RESULTS", "2"))
+
+
+class QueryPlan:
+    """Etapas a ejecutar para una consulta y lo que cada una produjo."""
+
+    def __init__(self, source, route: str):
+        self.source = source
+        self.route = route
+        self.use_local = route in (LOCAL, BOTH)
+        self.use_web = route in (WEB, BOTH)
+        # Los papers web indexados comparten colección con los PDFs: la ruta local solo busca PDFs
+        self.doc_type = "pdf" if route == LOCAL else None
+        self.retrieved = []
+        self.web_papers = []
+        self.web_from_cache = False
+        self.stages = {}
+
+    def to_dict(self) -> dict:
+        return {"source": self.source, "route": self.route, "stages": self.stages}
+
+
+def plan_query(source) -> QueryPlan:
+    """Ruta según `source`; valores desconocidos o ausentes consultan ambas fuentes."""
+    route = SOURCE_ROUTES.get(str(source or "").strip().lower(), BOTH)
+    return QueryPlan(source, route)
+
+
+def is_confident(results: list[dict]) -> bool:
+    """
+    La recuperación local basta si al menos MIN_CONFIDENT_RESULTS pasajes
+    superan el umbral: score del cross-encoder si hubo reranking y, si no,
+    similitud coseno de la búsqueda densa.
+    """
+    confident = 0
+    for result in results:
+        if result.get("rerank_score") is not None:
+            confident += result["rerank_score"] >= CONFIDENT_RERANK_SCORE
+        else:
+            score = result.get("dense_score", result.get("score"))
+            confident += score is not None and score >= CONFIDENT_DENSE_SCORE
+    return confident >= MIN_CONFIDENT_RESULTS
+
+# ===============================
+# Ejecución
+# ===============================
+def _stage_error(task) -> str:
+    """None si la etapa terminó bien; si no, 'timeout', 'error' o 'cancelled'."""
+    if task.cancelled():
+        return "cancelled"
+    error = task.exception()
+    if error is None:
+        return None
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    print(f"⚠️ Etapa descartada por error: {error!r}")
+    return "error"
+
+
+async def execute_plan(question: str, plan: QueryPlan, top_k: int):
+    """
+    Ejecuta las etapas de recuperación del plan y emite (etapa, datos) a
+    medida que terminan. Una etapa que falla o agota su timeout se descarta
+    y la respuesta sigue con lo que haya.
+    """
+    local_task = web_task = None
+    # El hilo de Selenium no se cancela con la tarea: este evento le indica que libere los drivers
+    web_cancelled = threading.Event()
+    if plan.use_local:
+        local_task = asyncio.create_task(
+            asyncio.wait_for(aretrieve_and_rerank(question, top_k, plan.doc_type), RETRIEVAL_TIMEOUT)
+        )
+    try:
+        run_web = plan.use_web
+        if run_web and local_task is not None and PLANNER_SKIP_WEB:
+            done, _ = await asyncio.wait({local_task}, timeout=PLANNER_LOCAL_FIRST_WAIT)
+            if done and local_task.exception() is None and is_confident(local_task.result()):
+                run_web = False
+                plan.stages["web"] = "skipped"
+                yield "web_skipped", {"reason": "local_confident"}
+
+        if run_web:
+            web_task = asyncio.create_task(
+                asyncio.wait_for(run_io(search_web_papers, question, cancelled=web_cancelled), WEB_SEARCH_TIMEOUT)
+            )
+
+        pending = {task for task in (local_task, web_task) if task is not None}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if local_task in done:
+                error = _stage_error(local_task)
+                plan.stages["retrieval"] = error or "done"
+                if error:
+                    yield "retrieval_" + error, {}
+                else:
+                    plan.retrieved = local_task.result()
+                    yield "retrieval_done", {"count": len(plan.retrieved)}
+            if web_task in done:
+                error = _stage_error(web_task)
+                plan.stages["web"] = error or "done"
+                if error:
+                    web_cancelled.set()
+                    yield "web_" + error, {}
+                else:
+                    plan.web_papers, plan.web_from_cache = web_task.result()
+                    yield "web_results", {"count": len(plan.web_papers)}
+    finally:
+        # Si el cliente se desconecta no seguimos esperando etapas
+        web_cancelled.set()
+        for task in (local_task, web_task):
+            if task is not None:
+                task.cancel()
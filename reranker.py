@@ -0,0 +1,117 @@
+# Etapa de reranking con cross-encoder en CPU entre la recuperación y la
+# síntesis, con presupuesto de latencia por etapa y caché de scores
+
+import os
+import time
+import hashlib
+import threading
+from cache import TTLCache, normalize_text
+from vectorizacion import ahybrid_search
+from executors import run_cpu
+from metrics import timed
+
+# ===============================
+# Configuración
+# ===============================
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RETRIEVAL_BUDGET_MS = float(os.getenv("RETRIEVAL_BUDGET_MS", "1500"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "800"))
+
+score_cache = TTLCache(
+    "rerank_scores",
+    max_size=int(os.getenv("RERANK_CACHE_SIZE", "20000")),
+    ttl=float(os.getenv("RERANK_CACHE_TTL", "86400"))
+)
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import CrossEncoder
+                _model = CrossEncoder(RERANK_MODEL, device="cpu")
+                print(f"✅ Cross-encoder cargado: {RERANK_MODEL}")
+    return _model
+
+
+def warm_up():
+    """Carga el cross-encoder antes de la primera consulta (tarea de calentamiento)."""
+    _get_model().predict([("warm up", "warm up")], show_progress_bar=False)
+
+
+def _cache_key(query: str, candidate: dict) -> str:
+    content_hash = hashlib.sha1(candidate.get("content", "").encode("utf-8")).hexdigest()
+    return f"{normalize_text(query)}|{candidate.get('id')}|{content_hash}"
+
+# ===============================
+# Reranking
+# ===============================
+@timed("rerank")
+def rerank(query: str, candidates: list[dict], top_n: int, budget_ms: float = RERANK_BUDGET_MS) -> list[dict]:
+    """
+    Ordena los candidatos por score del cross-encoder, puntuando por lotes
+    en el orden de recuperación. Si se agota el presupuesto, los que no se
+    alcanzaron a puntuar quedan detrás en su orden original.
+    """
+    if not candidates:
+        return []
+    deadline = time.perf_counter() + budget_ms / 1000
+
+    scores = {}
+    pending = []
+    for i, candidate in enumerate(candidates):
+        cached = score_cache.get(_cache_key(query, candidate))
+        if cached is None:
+            pending.append(i)
+        else:
+            scores[i] = cached
+
+    for start in range(0, len(pending), RERANK_BATCH_SIZE):
+        if time.perf_counter() >= deadline:
+            print(f"⏱️ Presupuesto de reranking agotado ({len(scores)}/{len(candidates)} puntuados)")
+            break
+        batch = pending[start:start + RERANK_BATCH_SIZE]
+        pairs = [(query, candidates[i].get("content", "")) for i in batch]
+        try:
+            batch_scores = _get_model().predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+        except Exception as e:
+            print(f"⚠️ Error en reranking, se mantiene el orden de recuperación: {e}")
+            break
+        for i, score in zip(batch, batch_scores):
+            scores[i] = float(score)
+            score_cache.set(_cache_key(query, candidates[i]), float(score))
+
+    scored = sorted(scores, key=scores.get, reverse=True)
+    unscored = [i for i in range(len(candidates)) if i not in scores]
+    ranked = []
+    for i in scored + unscored:
+        result = dict(candidates[i])
+        result["rerank_score"] = scores.get(i)
+        ranked.append(result)
+    return ranked[:top_n]
+
+
+async def aretrieve_and_rerank(query: str, top_n: int = 5, doc_type: str = None) -> list[dict]:
+    """
+    Recupera RERANK_CANDIDATES candidatos (híbrido, sin bloquear el loop) y
+    deja pasar los top_n mejores según el cross-encoder, puntuados en el
+    pool de CPU. Si la recuperación ya consumió su presupuesto, se omite el
+    reranking. `doc_type` ("pdf" o "web") restringe los candidatos.
+    """
+    if not RERANK_ENABLED:
+        return await ahybrid_search(query, top_n, doc_type)
+
+    t0 = time.perf_counter()
+    candidates = await ahybrid_search(query, max(top_n, RERANK_CANDIDATES), doc_type)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if elapsed_ms > RETRIEVAL_BUDGET_MS:
+        print(f"⏱️ Recuperación tardó {elapsed_ms:.0f}ms, se omite el reranking")
+        return candidates[:top_n]
+    return await run_cpu(rerank, query, candidates, top_n)
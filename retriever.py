@@ -1,170 +1,142 @@
-import os
-import tempfile
-from azure.storage.blob import ContainerClient
-from PyPDF2 import PdfReader
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
-from vectorizacion import index_pdf_chunks
-
-# ===============================
-# Variables de entorno
-# ===============================
-QDRANT_API_KEY = os.getenv("QDRANT_API_KEY1", "").strip().strip('"')
-QDRANT_URL = os.getenv("QDRANT_URL", "").strip().strip('"')
-QDRANT_COLLECTION = "vector_bd"
-
-container_url = os.getenv("AZURE_STORAGE_SAS_TOKEN")
-if not container_url:
-    raise ValueError("❌ Falta AZURE_STORAGE_SAS_TOKEN")
-
-# ===============================
-# Inicialización de clientes
-# ===============================
-container_client = ContainerClient.from_container_url(f"{container_url}")
-qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-
-# ===============================
-# Setup de índices en Qdrant
-# ===============================
-def ensure_indexes():
-    """
-    Garantiza que 'filename' tenga índice de tipo keyword en Qdrant.
-    """
-    try:
-        collection_info = qdrant_client.get_collection(QDRANT_COLLECTION)
-        payload_schema = getattr(collection_info, "payload_schema", {}) or {}
-
-        if "filename" not in payload_schema:
-            qdrant_client.create_payload_index(
-                collection_name=QDRANT_COLLECTION,
-                field_name="filename",
-                field_schema=models.PayloadSchemaType.KEYWORD
-            )
-            print("📌 Índice 'filename' creado en Qdrant.")
-        else:
-            print("✅ Índice 'filename' ya existe en Qdrant.")
-    except Exception as e:
-        print(f"⚠️ Error verificando/creando índice 'filename': {e}")
-
-# Crear índice al inicio
-ensure_indexes()
-
-# ===============================
-# Utilidades
-# ===============================
-def is_filename_indexed(filename: str) -> bool:
-    """
-    Verifica en Qdrant si un filename ya está indexado.
-    Retorna True si existe, False si no.
-    """
-    try:
-        result, _ = qdrant_client.scroll(
-            collection_name=QDRANT_COLLECTION,
-            scroll_filter=models.Filter(
-                must=[models.FieldCondition(
-                    key="filename",
-                    match=models.MatchValue(value=filename)
-                )]
-            ),
-            limit=1,
-            with_payload=False
-        )
-        return len(result) > 0
-    except Exception as e:
-        print(f"⚠️ Error verificando filename en Qdrant: {e}")
-        return False
-
-
-def compress_page_ranges(pages):
-    """Convierte lista de páginas en rango comprimido tipo '1-3,5,7-9'."""
-    if not pages:
-        return ""
-    pages = sorted(set(pages))
-    ranges = []
-    start = prev = pages[0]
-    for p in pages[1:]:
-        if p == prev + 1:
-            prev = p
-        else:
-            ranges.append(f"{start}-{prev}" if start != prev else str(start))
-            start = prev = p
-    ranges.append(f"{start}-{prev}" if start != prev else str(start))
-    return ",".join(ranges)
-
-# ===============================
-# Carga e indexación de PDFs
-# ===============================
-def load_pdfs_azure():
-    """
-    Descarga de Azure solo los PDFs que no están en Qdrant.
-    Indexa en Qdrant los nuevos PDFs encontrados.
-    """
-    pdfs = []
-    metadatas = []
-    new_pdfs_to_index = []
-
-    try:
-        blobs = list(container_client.list_blobs(name_starts_with="BD_Knowledge"))
-    except Exception as e:
-        raise RuntimeError(f"❌ Error al listar blobs en BD_Knowledge: {e}")
-
-    for blob in blobs:
-        if not blob.name.endswith(".pdf"):
-            continue
-
-        filename = os.path.basename(blob.name)
-
-        # ⚡ Consulta puntual a Qdrant
-        if is_filename_indexed(filename):
-            print(f"✅ Ya existe en Qdrant, omitiendo descarga: {filename}")
-            continue
-
-        print(f"📥 Descargando nuevo PDF: {filename}")
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-                downloader = container_client.download_blob(blob.name)
-                downloader.download_to_stream(temp_pdf)
-                temp_pdf_path = temp_pdf.name
-        except Exception as e:
-            print(f"⚠️ Error al descargar {filename}: {e}")
-            continue
-
-        try:
-            reader = PdfReader(temp_pdf_path)
-            pages_texts = []
-            pages_numbers = []
-
-            for i, page in enumerate(reader.pages):
-                text = page.extract_text()
-                if text and text.strip():
-                    pages_texts.append({"page": i + 1, "text": text.strip()})
-                    pages_numbers.append(i + 1)
-
-            if pages_texts:
-                title = pages_texts[0]["text"].split("\n")[0].strip()
-                pdf_data = {
-                    "filename": filename,
-                    "title": title,
-                    "pages_texts": pages_texts
-                }
-                metadata = {
-                    "filename": filename,
-                    "title": title,
-                    "pages": compress_page_ranges(pages_numbers)
-                }
-                pdfs.append(pdf_data)
-                metadatas.append(metadata)
-                new_pdfs_to_index.append(pdf_data)
-
-        except Exception as e:
-            print(f"⚠️ Error procesando PDF {filename}: {e}")
-        finally:
-            if os.path.exists(temp_pdf_path):
-                os.remove(temp_pdf_path)
-
-    # Indexar en Qdrant solo los nuevos
-    if new_pdfs_to_index:
-        index_pdf_chunks(new_pdfs_to_index)
-        print(f"📌 Indexados {len(new_pdfs_to_index)} nuevos PDFs en Qdrant")
-
-    return pdfs, metadatas
+import os
+from qdrant_client.http import models
+from vectorizacion import COLLECTION_NAME
+from answer_cache import bump_corpus_version
+from bm25_index import bm25_index
+from chunk_store import get_chunk_store
+from qdrant_schema import COMPACT
+from clients import get_qdrant_client, get_container_client
+from metrics import timed
+
+# El contenedor de Azure y Qdrant se conectan en el primer uso (ver clients.py)
+
+# Carpeta del contenedor con los PDFs de la base de conocimiento
+BLOB_PREFIX = "BD_Knowledge/"
+
+# ===============================
+# Utilidades
+# ===============================
+def _facet_values(key: str, values: list, extra=None) -> set:
+    """
+    Valores de `key` presentes en Qdrant entre `values`, en una sola consulta.
+    Usa facet sobre el índice; si no está disponible, recorre con scroll
+    trayendo solo ese campo del payload.
+    """
+    facet_filter = models.Filter(
+        must=[models.FieldCondition(key=key, match=models.MatchAny(any=values))] + (extra or [])
+    )
+
+    try:
+        resp = get_qdrant_client().facet(
+            collection_name=COLLECTION_NAME,
+            key=key,
+            facet_filter=facet_filter,
+            limit=len(values),
+            exact=True
+        )
+        return {hit.value for hit in resp.hits}
+    except Exception as e:
+        print(f"⚠️ Facet no disponible, usando scroll: {e}")
+
+    found = set()
+    offset = None
+    try:
+        while True:
+            points, offset = get_qdrant_client().scroll(
+                collection_name=COLLECTION_NAME,
+                scroll_filter=facet_filter,
+                limit=1000,
+                offset=offset,
+                with_payload=[key],
+                with_vectors=False
+            )
+            found.update(p.payload.get(key) for p in points if p.payload)
+            if offset is None:
+                break
+    except Exception as e:
+        print(f"⚠️ Error verificando {key} en Qdrant: {e}")
+    return found
+
+
+def _without_blob():
+    # Puntos indexados antes de guardar el nombre completo del blob
+    return models.IsEmptyCondition(is_empty=models.PayloadField(key="blob"))
+
+
+def fetch_indexed_blobs(blob_names) -> set:
+    """
+    Verifica en bloque qué blobs ya están indexados en Qdrant. Los puntos
+    anteriores al campo 'blob' solo tienen el filename y se reconocen por él.
+    """
+    names = sorted(set(blob_names))
+    if not names:
+        return set()
+    indexed = _facet_values("blob", names)
+    pending = [n for n in names if n not in indexed]
+    if pending:
+        legacy = _facet_values("filename", sorted({os.path.basename(n) for n in pending}), [_without_blob()])
+        indexed.update(n for n in pending if os.path.basename(n) in legacy)
+    return indexed
+
+
+def _blob_filter(blob_name: str):
+    return models.Filter(should=[
+        models.FieldCondition(key="blob", match=models.MatchValue(value=blob_name)),
+        models.Filter(must=[
+            models.FieldCondition(key="filename", match=models.MatchValue(value=os.path.basename(blob_name))),
+            _without_blob()
+        ])
+    ])
+
+
+def delete_blob_points(blob_name: str):
+    """
+    Elimina todos los puntos de un blob (por nombre completo, no por
+    filename). Primero se listan sus IDs para quitarlos también del índice BM25
+    y del almacén local de fragmentos.
+    """
+    client = get_qdrant_client()
+    point_ids = []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=_blob_filter(blob_name),
+            limit=1000,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False
+        )
+        point_ids.extend(p.id for p in points)
+        if offset is None:
+            break
+    if not point_ids:
+        return
+
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.PointIdsList(points=point_ids)
+    )
+    bm25_index.remove_many(point_ids)
+    if COMPACT:
+        get_chunk_store().delete_many(point_ids)
+    bump_corpus_version()
+
+
+@timed("blob_list")
+def list_pdf_blobs():
+    """Lista los blobs PDF bajo el prefijo BD_Knowledge."""
+    try:
+        blobs = get_container_client().list_blobs(name_starts_with=BLOB_PREFIX)
+        return [blob for blob in blobs if blob.name.endswith(".pdf")]
+    except Exception as e:
+        raise RuntimeError(f"❌ Error al listar blobs en BD_Knowledge: {e}")
+
+
+# ===============================
+# Descarga de PDFs
+# ===============================
+@timed("blob_download")
+def download_pdf_bytes(blob_name: str) -> bytes:
+    """Descarga un blob completo a memoria."""
+    return get_container_client().download_blob(blob_name, max_concurrency=2).readall()
@@ -1,157 +1,451 @@
-import os
-import json
-from openai import AzureOpenAI
-from sentence_transformers import SentenceTransformer
-from vectorizacion import client, COLLECTION_NAME
-
-# ===============================
-# Configuración desde variables de entorno
-# ===============================
-api_key = os.getenv("OPEN_AI_API_KEY_1")
-endpoint = os.getenv("OPEN_AI_ENDPOINT")
-deployment = os.getenv("OPEN_AI_DEPLOYMENT") 
-
-if not api_key or not endpoint or not deployment:
-    raise ValueError("Faltan variables de entorno OPEN_AI_API_KEY_1, OPEN_AI_ENDPOINT o OPEN_AI_DEPLOYMENT")
-
-client_aoai = AzureOpenAI(
-    api_key=api_key,
-    api_version="2024-12-01-preview",
-    azure_endpoint=endpoint
-)
-
-encoder = SentenceTransformer("all-MiniLM-L6-v2")
-
-# ===============================
-# Función: buscar en Qdrant
-# ===============================
-def search_qdrant(query, top_k=5):
-    query_vector = encoder.encode(query).tolist()
-    try:
-        hits = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_vector,
-            limit=top_k
-        )
-    except Exception as e:
-        return [{"type": "error", "content": f"Error en búsqueda Qdrant: {str(e)}"}]
-
-    results = []
-    for hit in hits:
-        payload = hit.payload
-        source_field = None
-        if payload.get("type") == "pdf":
-            source_field = payload.get("filename", "")
-        else:
-            source_field = payload.get("url", "")
-
-        results.append({
-            "type": payload.get("type", "unknown"),
-            "source": source_field,
-            "title": payload.get("title", ""),
-            "page": payload.get("page", 1),
-            "score": hit.score,
-            "content": payload.get("content", "")
-        })
-    return results
-
-# ===============================
-# Helper: dividir textos en chunks
-# ===============================
-def chunk_text(items, max_chars=2000):
-    chunks = []
-    current_chunk = ""
-    for item in items:
-        if 'pages_texts' in item:
-            for page in item['pages_texts']:
-                text = f"[{item['filename']} - Página {page['page']}]\n{page['text']}\n\n"
-                if len(current_chunk) + len(text) > max_chars:
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = text
-                else:
-                    current_chunk += text
-        else:
-            snippet = item.get("content", "")
-            if not snippet:
-                continue
-            page_num = item.get("page", 1)
-            source = item.get("source", "")
-            title = item.get("title", "")
-            text = f"[{source} - Página {page_num}] {title}\n{snippet}\n\n"
-            if len(current_chunk) + len(text) > max_chars:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = text
-            else:
-                current_chunk += text
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
-
-# ===============================
-# Función: síntesis de respuesta segura
-# ===============================
-def synthesize_answer(query, pdfs, pdf_metadata, memory, web_papers):
-    try:
-        qdrant_results = search_qdrant(query, top_k=5)
-
-        content_items = []
-        if pdfs:
-            content_items.extend(pdfs)
-        if web_papers:
-            content_items.extend(web_papers)
-        if qdrant_results:
-            content_items.extend(qdrant_results)
-
-        text_chunks = chunk_text(content_items, max_chars=2000)
-
-        memory_safe = memory[-2000:] if memory else ""
-
-        summaries = []
-        for chunk in text_chunks:
-            prompt = f"""
-Contexto previo:
-{memory_safe}
-
-Consulta:
-{query}
-
-Información relevante:
-{chunk}
-
-Responde en máximo 4 párrafos. Cita fuentes y páginas donde corresponda.
-"""
-            if len(prompt) > 6000:
-                prompt = prompt[:6000]
-
-            if not prompt.strip():
-                continue
-
-            response = client_aoai.chat.completions.create(
-                model=deployment,
-                messages=[
-                    {"role": "system", "content": "Eres un asistente que resume PDFs y artículos académicos."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=400,
-                top_p=1.0
-            )
-
-            try:
-                msg = response.choices[0].message if response and response.choices else None
-                raw_summary = {
-                    "content": msg.content if msg else "No se recibió respuesta.",
-                    "role": msg.role if msg else "assistant"
-                }
-                raw_summary = json.dumps(raw_summary, ensure_ascii=False).replace("\x00", "").strip()
-            except Exception:
-                raw_summary = '{"content":"No se recibió respuesta.","role":"assistant"}'
-
-            summaries.append(raw_summary)
-
-        return "[" + ",".join(summaries) + "]"
-
-    except Exception as e:
-        return json.dumps({"content": f"Error al generar respuesta: {str(e)}", "role": "assistant"})
+import os
+import json
+import time
+import random
+import asyncio
+from openai import RateLimitError
+from reranker import aretrieve_and_rerank
+from tokens import count_tokens, truncate_tokens
+from memory_keeper import MEMORY_TOKEN_BUDGET
+from metrics import span, LLM_CALLS, LLM_TOKENS
+from clients import get_async_openai_client, openai_deployment
+
+# ===============================
+# Configuración desde variables de entorno
+# ===============================
+# El cliente de Azure OpenAI se crea en la primera llamada (ver clients.py)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+SYNTHESIS_DEADLINE = float(os.getenv("SYNTHESIS_DEADLINE", "90"))
+
+# Modo de síntesis: "pack" (una llamada con el contexto empaquetado por presupuesto
+# de tokens), "map_reduce" (pocas llamadas map + una reduce) o "chunks" (una por fragmento)
+SYNTHESIS_MODE = os.getenv("SYNTHESIS_MODE", "pack")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+MAP_TOKEN_BUDGET = int(os.getenv("MAP_TOKEN_BUDGET", "3000"))
+MAX_MAP_CALLS = int(os.getenv("MAX_MAP_CALLS", "4"))
+ANSWER_MAX_TOKENS = int(os.getenv("ANSWER_MAX_TOKENS", "800"))
+# Topes duros del contexto: pasajes recuperados y llamadas al modelo por pregunta
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+MAX_CONTEXT_PASSAGES = int(os.getenv("MAX_CONTEXT_PASSAGES", "8"))
+MAX_LLM_CALLS = int(os.getenv("MAX_LLM_CALLS", "5"))
+
+SYSTEM_PROMPT = "Eres un asistente que resume PDFs y artículos académicos."
+NO_RESPONSE = '{"content":"No se recibió respuesta.","role":"assistant"}'
+TIMEOUT_RESPONSE = json.dumps(
+    {"content": "Tiempo de espera agotado para este fragmento.", "role": "assistant"},
+    ensure_ascii=False
+)
+# Textos de respuestas degradadas, que no deben reutilizarse
+DEGRADED_MARKERS = ("Tiempo de espera agotado", "Error al generar respuesta", "No se recibió respuesta")
+
+# ===============================
+# Helper: dividir pasajes en chunks
+# ===============================
+def chunk_text(passages, max_chars=2000):
+    chunks = []
+    current_chunk = ""
+    for passage in passages:
+        text = f"{passage['label']}\n{passage['text']}\n\n"
+        if len(current_chunk) + len(text) > max_chars:
+            if current_chunk:
+                chunks.append(current_chunk)
+            current_chunk = text
+        else:
+            current_chunk += text
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+# ===============================
+# Llamadas concurrentes al modelo
+# ===============================
+def _build_prompt(query, memory_safe, chunk):
+    prompt = f"""
+Contexto previo:
+{memory_safe}
+
+Consulta:
+{query}
+
+Información relevante:
+{chunk}
+
+Responde en máximo 4 párrafos. Cita fuentes y páginas donde corresponda.
+"""
+    if len(prompt) > 6000:
+        prompt = prompt[:6000]
+    return prompt
+
+
+def _format_summary(response) -> str:
+    try:
+        msg = response.choices[0].message if response and response.choices else None
+        raw_summary = {
+            "content": msg.content if msg else "No se recibió respuesta.",
+            "role": msg.role if msg else "assistant"
+        }
+        return json.dumps(raw_summary, ensure_ascii=False).replace("\x00", "").strip()
+    except Exception:
+        return NO_RESPONSE
+
+
+def _retry_delay(error: RateLimitError, attempt: int) -> float:
+    """Respeta Retry-After si viene en la respuesta; si no, backoff exponencial con jitter."""
+    try:
+        retry_after = float(error.response.headers.get("retry-after"))
+        if retry_after > 0:
+            return retry_after
+    except Exception:
+        pass
+    return LLM_BACKOFF_BASE * (2 ** attempt) + random.uniform(0, LLM_BACKOFF_BASE)
+
+
+def _record_usage(response, prompt: str, system: str):
+    """Tokens de la llamada según `usage` de la respuesta; si no viene, se estiman."""
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens or 0, kind="completion")
+        return
+    LLM_TOKENS.inc(count_tokens(system) + count_tokens(prompt), kind="prompt")
+    try:
+        LLM_TOKENS.inc(count_tokens(response.choices[0].message.content or ""), kind="completion")
+    except Exception:
+        pass
+
+
+async def _complete_chunk(prompt: str, semaphore: asyncio.Semaphore, deadline: float,
+                          max_tokens: int = 400, system: str = SYSTEM_PROMPT) -> str:
+    """Una llamada al modelo bajo el límite de concurrencia, con reintentos ante 429."""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        async with semaphore:
+            try:
+                with span("llm_call"):
+                    response = await get_async_openai_client().chat.completions.create(
+                        model=openai_deployment(),
+                        messages=[
+                            {"role": "system", "content": system},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.7,
+                        max_tokens=max_tokens,
+                        top_p=1.0
+                    )
+                LLM_CALLS.inc(result="ok")
+                _record_usage(response, prompt, system)
+                return _format_summary(response)
+            except RateLimitError as e:
+                LLM_CALLS.inc(result="rate_limited")
+                delay = _retry_delay(e, attempt)
+                if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    raise
+            except Exception:
+                LLM_CALLS.inc(result="error")
+                raise
+        # La espera ocurre fuera del semáforo para no bloquear otros fragmentos
+        await asyncio.sleep(delay)
+
+
+async def _complete_all(prompts: list[str], deadline_s: float = SYNTHESIS_DEADLINE,
+                        max_tokens: int = 400, system: str = SYSTEM_PROMPT) -> list[str]:
+    """
+    Lanza todas las llamadas en paralelo (máximo LLM_CONCURRENCY simultáneas)
+    y devuelve las respuestas en el orden de los fragmentos. Lo que no termine
+    antes del plazo total se cancela y se marca como agotado.
+    """
+    if not prompts:
+        return []
+    semaphore = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+    deadline = time.monotonic() + deadline_s
+    tasks = [
+        asyncio.create_task(_complete_chunk(p, semaphore, deadline, max_tokens, system))
+        for p in prompts
+    ]
+
+    done, pending = await asyncio.wait(tasks, timeout=deadline_s)
+    for task in pending:
+        task.cancel()
+    if pending:
+        LLM_CALLS.inc(len(pending), result="timeout")
+
+    summaries = []
+    for task in tasks:
+        if task in pending:
+            summaries.append(TIMEOUT_RESPONSE)
+        elif task.exception() is not None:
+            summaries.append(json.dumps(
+                {"content": f"Error al generar respuesta: {str(task.exception())}", "role": "assistant"},
+                ensure_ascii=False
+            ))
+        else:
+            summaries.append(task.result())
+    return summaries
+
+# ===============================
+# Empaquetado por presupuesto de tokens
+# ===============================
+def rank_passages(web_papers, qdrant_results) -> list[dict]:
+    """
+    Pasajes de contexto, solo a partir de resultados de recuperación ordenados:
+    primero los recuperados (ya ordenados por el reranker) y luego los papers
+    web en el orden de Scholar. Se limita a MAX_CONTEXT_PASSAGES.
+    """
+    passages = []
+    for hit in qdrant_results or []:
+        if not hit.get("content"):
+            continue
+        passages.append({
+            "label": f"[{hit.get('source', '')} - Página {hit.get('page', 1)}] {hit.get('title', '')}",
+            "text": hit["content"],
+        })
+    for paper in web_papers or []:
+        text = paper.get("snippet") or paper.get("content", "")
+        if text:
+            passages.append({"label": f"[{paper.get('url', '')}] {paper.get('title', '')}", "text": text})
+
+    seen = set()
+    unique = []
+    for passage in passages:
+        if passage["text"] in seen:
+            continue
+        seen.add(passage["text"])
+        unique.append(passage)
+    return unique[:MAX_CONTEXT_PASSAGES]
+
+
+def pack_passages(passages: list[dict], budget: int) -> tuple[str, list[dict]]:
+    """
+    Mete en orden de relevancia los pasajes que caben en `budget` tokens.
+    Retorna (contexto, pasajes_restantes). Si el primero no cabe, se recorta.
+    """
+    parts = []
+    used = 0
+    for i, passage in enumerate(passages):
+        block = f"{passage['label']}\n{passage['text']}\n\n"
+        tokens = count_tokens(block)
+        if used + tokens > budget:
+            if not parts:
+                parts.append(truncate_tokens(block, budget))
+                return "".join(parts), passages[i + 1:]
+            return "".join(parts), passages[i:]
+        parts.append(block)
+        used += tokens
+    return "".join(parts), []
+
+
+def _answer_prompt(query, memory_safe, context):
+    return f"""
+Contexto previo:
+{memory_safe}
+
+Consulta:
+{query}
+
+Información relevante:
+{context}
+
+Responde en máximo 4 párrafos con una única respuesta coherente. Cita fuentes y páginas donde corresponda.
+"""
+
+
+def _map_prompt(query, context):
+    return f"""
+Consulta:
+{query}
+
+Fragmentos:
+{context}
+
+Extrae en viñetas solo los hechos relevantes para la consulta, conservando la cita (fuente y página) de cada uno.
+Si nada es relevante, responde "Sin información relevante".
+"""
+
+
+def _reduce_prompt(query, memory_safe, notes):
+    return f"""
+Contexto previo:
+{memory_safe}
+
+Consulta:
+{query}
+
+Notas extraídas de las fuentes:
+{notes}
+
+Con estas notas, responde en máximo 4 párrafos con una única respuesta coherente. Conserva las citas de fuentes y páginas.
+"""
+
+
+def _packed_prompt(query, memory_safe, passages) -> str:
+    overhead = count_tokens(_answer_prompt(query, memory_safe, ""))
+    context, _ = pack_passages(passages, CONTEXT_TOKEN_BUDGET - overhead)
+    return _answer_prompt(query, memory_safe, context)
+
+
+async def _map_reduce_prompt(query, memory_safe, passages, deadline_s: float = SYNTHESIS_DEADLINE) -> str:
+    """
+    Ejecuta hasta MAX_MAP_CALLS llamadas map en paralelo y arma el prompt de
+    la reduce. Si todo cabe en un solo grupo, retorna el prompt empaquetado.
+    """
+    overhead = count_tokens(_map_prompt(query, ""))
+    groups = []
+    remaining = passages
+    while remaining and len(groups) < min(MAX_MAP_CALLS, MAX_LLM_CALLS - 1):
+        context, remaining = pack_passages(remaining, MAP_TOKEN_BUDGET - overhead)
+        groups.append(context)
+
+    if len(groups) <= 1:
+        return _packed_prompt(query, memory_safe, passages)
+
+    map_outputs = await _complete_all([_map_prompt(query, g) for g in groups], deadline_s=deadline_s, max_tokens=400)
+    notes = []
+    for raw in map_outputs:
+        try:
+            content = json.loads(raw).get("content", "")
+        except Exception:
+            content = ""
+        if content and "Sin información relevante" not in content:
+            notes.append(content)
+
+    return _reduce_prompt(query, memory_safe, "\n\n".join(notes) or "Sin información relevante")
+
+
+async def _synthesize_packed(query, memory_safe, passages) -> list[str]:
+    """Una sola llamada con los pasajes más relevantes que caben en el presupuesto."""
+    return await _complete_all([_packed_prompt(query, memory_safe, passages)], max_tokens=ANSWER_MAX_TOKENS)
+
+
+async def _synthesize_map_reduce(query, memory_safe, passages) -> list[str]:
+    """Hasta MAX_MAP_CALLS llamadas map en paralelo y una reduce que unifica la respuesta."""
+    deadline = time.monotonic() + SYNTHESIS_DEADLINE
+    reduce_prompt = await _map_reduce_prompt(query, memory_safe, passages)
+    return await _complete_all(
+        [reduce_prompt],
+        deadline_s=max(1.0, deadline - time.monotonic()),
+        max_tokens=ANSWER_MAX_TOKENS
+    )
+
+# ===============================
+# Respuesta en streaming
+# ===============================
+async def _stream_completion(prompt: str, max_tokens: int, deadline: float):
+    """Emite los tokens de una completion en streaming; reintenta 429 antes del primer token."""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            # Hasta que el modelo empieza a responder (cabeceras del stream)
+            with span("llm_call"):
+                stream = await get_async_openai_client().chat.completions.create(
+                    model=openai_deployment(),
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.7,
+                    max_tokens=max_tokens,
+                    top_p=1.0,
+                    stream=True
+                )
+            LLM_CALLS.inc(result="ok")
+            break
+        except RateLimitError as e:
+            LLM_CALLS.inc(result="rate_limited")
+            delay = _retry_delay(e, attempt)
+            if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise
+            await asyncio.sleep(delay)
+        except Exception:
+            LLM_CALLS.inc(result="error")
+            raise
+
+    LLM_TOKENS.inc(count_tokens(SYSTEM_PROMPT) + count_tokens(prompt), kind="prompt")
+    generated = []
+    chunks = stream.__aiter__()
+    try:
+        while True:
+            # Cada fragmento espera como máximo lo que queda del plazo, así un stream detenido no lo supera
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                LLM_CALLS.inc(result="timeout")
+                yield "\n[Tiempo de espera agotado]"
+                break
+            # Azure envía fragmentos sin choices (filtros de contenido)
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                token = chunk.choices[0].delta.content.replace("\x00", "")
+                generated.append(token)
+                yield token
+    finally:
+        LLM_TOKENS.inc(count_tokens("".join(generated)), kind="completion")
+        # Cierra la conexión HTTP si el stream se abandonó antes de terminar
+        await stream.close()
+
+
+async def astream_answer(query, memory, web_papers, qdrant_results):
+    """
+    Igual que asynthesize_answer pero emite el texto de la respuesta a
+    medida que llegan los tokens del modelo.
+    """
+    deadline = time.monotonic() + SYNTHESIS_DEADLINE
+    # La memoria ya llega dentro del presupuesto (MemoryKeeper); el recorte es solo un tope
+    memory_safe = truncate_tokens(memory, MEMORY_TOKEN_BUDGET, keep="tail") if memory else ""
+    passages = rank_passages(web_papers, qdrant_results)
+
+    if SYNTHESIS_MODE == "chunks":
+        text_chunks = chunk_text(passages, max_chars=2000)[:MAX_LLM_CALLS]
+        prompts = [_build_prompt(query, memory_safe, chunk) for chunk in text_chunks]
+        max_tokens = 400
+    elif SYNTHESIS_MODE == "map_reduce":
+        prompts = [await _map_reduce_prompt(query, memory_safe, passages, deadline - time.monotonic())]
+        max_tokens = ANSWER_MAX_TOKENS
+    else:
+        prompts = [_packed_prompt(query, memory_safe, passages)]
+        max_tokens = ANSWER_MAX_TOKENS
+
+    for i, prompt in enumerate(prompts):
+        if i:
+            yield "\n\n"
+        async for token in _stream_completion(prompt, max_tokens, deadline):
+            yield token
+
+# ===============================
+# Función: síntesis de respuesta segura
+# ===============================
+async def asynthesize_answer(query, memory, web_papers, qdrant_results=None):
+    """
+    Genera la respuesta a partir de los pasajes recuperados (Qdrant + Scholar).
+    El texto completo de PDFs recién ingeridos no entra aquí: llega solo a
+    través de la búsqueda, con topes de pasajes, tokens y llamadas.
+    Si el llamador ya recuperó los pasajes, se reciben en qdrant_results.
+    """
+    try:
+        if qdrant_results is None:
+            qdrant_results = await aretrieve_and_rerank(query, RETRIEVAL_TOP_K)
+
+        memory_safe = truncate_tokens(memory, MEMORY_TOKEN_BUDGET, keep="tail") if memory else ""
+        passages = rank_passages(web_papers, qdrant_results)
+
+        with span("synthesis"):
+            if SYNTHESIS_MODE == "map_reduce":
+                summaries = await _synthesize_map_reduce(query, memory_safe, passages)
+            elif SYNTHESIS_MODE == "chunks":
+                text_chunks = chunk_text(passages, max_chars=2000)[:MAX_LLM_CALLS]
+                prompts = [_build_prompt(query, memory_safe, chunk) for chunk in text_chunks]
+                summaries = await _complete_all([p for p in prompts if p.strip()])
+            else:
+                summaries = await _synthesize_packed(query, memory_safe, passages)
+        return "[" + ",".join(summaries) + "]"
+
+    except Exception as e:
+        return json.dumps({"content": f"Error al generar respuesta: {str(e)}", "role": "assistant"})
+
+
+def is_cacheable_answer(answer: str) -> bool:
+    """Las respuestas con timeouts o errores no se guardan en la caché de respuestas."""
+    return bool(answer) and not any(marker in answer for marker in DEGRADED_MARKERS)
@@ -0,0 +1,50 @@
+# Conteo y recorte de tokens con el tokenizador del modelo de chat (tiktoken)
+
+import os
+import threading
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+_encoding = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Carga el tokenizador en el primer uso; sin tiktoken se aproxima con ~4 caracteres por token."""
+    global _encoding, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    print(f"⚠️ tiktoken no disponible, se estiman tokens por caracteres: {e}")
+                _loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """
+    Recorta el texto a `max_tokens` tokens como máximo. keep="head" conserva
+    el principio y keep="tail" el final (p. ej. los turnos más recientes).
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[-max_tokens * 4:] if keep == "tail" else text[:max_tokens * 4]
+    ids = encoding.encode(text, disallowed_special=())
+    if len(ids) <= max_tokens:
+        return text
+    return encoding.decode(ids[-max_tokens:] if keep == "tail" else ids[:max_tokens])
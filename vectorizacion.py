@@ -1,227 +1,508 @@
-import os
-import time
-import hashlib
-import logging
-import urllib.parse
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, PayloadSchemaType
-from sentence_transformers import SentenceTransformer
-
-# ===============================
-# Configuración logging
-# ===============================
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# ===============================
-# Variables de entorno
-# ===============================
-QDRANT_API_KEY = os.getenv("QDRANT_API_KEY1", "").strip().strip('"')
-QDRANT_URL = os.getenv("QDRANT_URL", "").strip().strip('"')
-
-if not QDRANT_API_KEY or not QDRANT_URL:
-    raise ValueError("❌ Faltan variables de entorno QDRANT_API_KEY1 o QDRANT_URL")
-
-try:
-    QDRANT_URL = urllib.parse.unquote(QDRANT_URL).replace('"', '').strip()
-    parsed_url = urllib.parse.urlparse(QDRANT_URL)
-    if not parsed_url.scheme or not parsed_url.netloc:
-        raise ValueError("❌ QDRANT_URL no tiene estructura válida")
-    logger.info(f"✅ URL validada correctamente: {QDRANT_URL}")
-except Exception as e:
-    logger.error(f"❌ Error al validar QDRANT_URL: {e}")
-    raise
-
-# ===============================
-# Configuración Qdrant y Encoder
-# ===============================
-COLLECTION_NAME = "vector_bd"
-encoder = SentenceTransformer("all-MiniLM-L6-v2")
-client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-
-# Validación inicial
-try:
-    client.get_collections()
-    logger.info("✅ Cliente Qdrant inicializado correctamente")
-except Exception as e:
-    logger.error(f"❌ Error inicializando cliente Qdrant: {e}")
-    raise
-
-# ===============================
-# Funciones de soporte
-# ===============================
-def ensure_collection():
-    """Crea la colección si no existe y añade índices necesarios"""
-    if not client.collection_exists(collection_name=COLLECTION_NAME):
-        logger.info(f"📁 Colección '{COLLECTION_NAME}' no existe. Creando...")
-        client.recreate_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(
-                size=encoder.get_sentence_embedding_dimension(),
-                distance=Distance.COSINE
-            )
-        )
-        wait_until_collection_ready()
-        logger.info(f"✅ Colección '{COLLECTION_NAME}' creada y lista")
-
-    # Crear índices consistentes
-    for field in ["filename", "url", "type", "title"]:
-        try:
-            client.create_payload_index(
-                collection_name=COLLECTION_NAME,
-                field_name=field,
-                field_schema=PayloadSchemaType.KEYWORD
-            )
-            logger.info(f"✅ Índice creado para '{field}'")
-        except Exception as e:
-            logger.warning(f"⚠️ Índice '{field}' ya existe o no pudo crearse: {e}")
-
-def wait_until_collection_ready(max_retries=10, delay=2):
-    """Espera hasta que la colección esté lista"""
-    for _ in range(max_retries):
-        try:
-            info = client.get_collection(collection_name=COLLECTION_NAME)
-            if info.status == "green":
-                return
-        except Exception:
-            pass
-        time.sleep(delay)
-    raise TimeoutError(f"❌ Colección '{COLLECTION_NAME}' no lista después de {max_retries*delay}s")
-
-def get_id(text: str) -> int:
-    """Genera un ID único a partir del contenido (PDF page text o URL)"""
-    return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % (10**16)
-
-def _upsert_points(points: list[PointStruct], batch_size=50):
-    """Inserta los puntos en batches"""
-    if not points:
-        logger.info("ℹ️ No hay puntos nuevos para insertar")
-        return
-    try:
-        for i in range(0, len(points), batch_size):
-            client.upsert(collection_name=COLLECTION_NAME, points=points[i:i+batch_size])
-        logger.info(f"✅ Se insertaron {len(points)} puntos en Qdrant")
-    except Exception as e:
-        logger.error(f"❌ Error al insertar puntos: {e}")
-
-def _filter_existing_ids(ids: list[int]) -> set[int]:
-    """Devuelve los IDs que ya existen en la colección"""
-    existing_ids = set()
-    try:
-        for i in range(0, len(ids), 100):
-            batch_ids = ids[i:i+100]
-            resp = client.retrieve(collection_name=COLLECTION_NAME, ids=batch_ids)
-            existing_ids.update(p.id for p in resp)
-    except Exception as e:
-        logger.warning(f"⚠️ No se pudo filtrar IDs existentes: {e}")
-    return existing_ids
-
-# ===============================
-# Funciones principales
-# ===============================
-def index_pdf_chunks(pdf_data: list[dict]):
-    """Indexa el contenido de PDFs en Qdrant"""
-    ensure_collection()
-
-    id_to_content = {}
-    for doc in pdf_data:
-        for page in doc["pages_texts"]:
-            content = page["text"].strip()
-            if not content:
-                continue
-            uid = get_id(f"{doc['filename']}-{page['page']}-{content}")
-            id_to_content[uid] = {
-                "type": "pdf",
-                "filename": doc["filename"],
-                "url": None,
-                "title": doc.get("title", ""),
-                "page": page["page"],
-                "score": None,
-                "content": content,
-            }
-
-    existing_ids = _filter_existing_ids(list(id_to_content.keys()))
-    new_ids = list(set(id_to_content.keys()) - existing_ids)
-
-    # Batch encoding
-    texts = [id_to_content[uid]["content"] for uid in new_ids]
-    if texts:
-        vectors = encoder.encode(texts, batch_size=32, show_progress_bar=True).tolist()
-        new_points = [
-            PointStruct(
-                id=uid,
-                vector=vec,
-                payload=id_to_content[uid]
-            )
-            for uid, vec in zip(new_ids, vectors)
-        ]
-        _upsert_points(new_points)
-
-def index_web_papers(web_papers: list[dict]):
-    """Indexa papers web en Qdrant"""
-    ensure_collection()
-
-    id_to_paper = {}
-    for paper in web_papers:
-        snippet = paper["snippet"].strip()
-        if not snippet:
-            continue
-        uid = get_id(paper["url"])
-        id_to_paper[uid] = {
-            "type": "web",
-            "filename": None,
-            "url": paper["url"],
-            "title": paper.get("title", ""),
-            "page": 1,
-            "score": paper.get("score", 0),
-            "content": snippet,
-        }
-
-    existing_ids = _filter_existing_ids(list(id_to_paper.keys()))
-    new_ids = list(set(id_to_paper.keys()) - existing_ids)
-
-    # Batch encoding
-    texts = [id_to_paper[uid]["content"] for uid in new_ids]
-    if texts:
-        vectors = encoder.encode(texts, batch_size=32, show_progress_bar=True).tolist()
-        new_points = [
-            PointStruct(
-                id=uid,
-                vector=vec,
-                payload=id_to_paper[uid]
-            )
-            for uid, vec in zip(new_ids, vectors)
-        ]
-        _upsert_points(new_points)
-
-def search_qdrant(query: str, top_k: int = 5) -> list[dict]:
-    """Busca en Qdrant y devuelve resultados"""
-    ensure_collection()
-    query_vector = encoder.encode(query).tolist()
-    hits = client.search(collection_name=COLLECTION_NAME, query_vector=query_vector, limit=top_k)
-
-    results = []
-    for hit in hits:
-        payload = hit.payload
-        results.append({
-            "type": payload.get("type"),
-            "filename": payload.get("filename"),
-            "url": payload.get("url"),
-            "title": payload.get("title"),
-            "page": payload.get("page"),
-            "score": hit.score,
-            "content": payload.get("content", "")
-        })
-    return results
-
-# ===============================
-# Exports
-# ===============================
-__all__ = [
-    "client",
-    "COLLECTION_NAME",
-    "index_pdf_chunks",
-    "index_web_papers",
-    "ensure_collection",
-    "search_qdrant"
-]
+import os
+import hashlib
+import logging
+import asyncio
+from qdrant_client.models import PointStruct, Filter, FieldCondition, MatchValue
+from itertools import islice
+from embeddings import embedding_service
+from chunking import iter_pdf_chunks
+from bm25_index import bm25_index
+from executors import run_io, run_cpu
+from answer_cache import bump_corpus_version
+from qdrant_schema import SchemaManager, COMPACT, slim_payload, search_params
+from chunk_store import get_chunk_store
+from clients import get_qdrant_client, get_async_qdrant_client
+from bulk_writer import BulkWriter, BulkWriteError
+from metrics import span, timed
+
+# ===============================
+# Configuración logging
+# ===============================
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===============================
+# Configuración Qdrant
+# ===============================
+COLLECTION_NAME = "vector_bd"
+INDEX_BATCH_CHUNKS = int(os.getenv("INDEX_BATCH_CHUNKS", "256"))
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Candidatos por rama (densa y BM25) respecto a top_k antes de fusionar
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+# Campos del payload que se leen al buscar; en modo compacto el texto sale del almacén local
+RESULT_FIELDS = ["type", "filename", "url", "title", "page", "start", "end"] + ([] if COMPACT else ["content"])
+
+# Los clientes se crean en el primer uso; el esquema se verifica en el
+# calentamiento de la app o en la primera operación
+schema = SchemaManager(get_qdrant_client, COLLECTION_NAME)
+writer = BulkWriter(get_qdrant_client, COLLECTION_NAME)
+
+# ===============================
+# Funciones de soporte
+# ===============================
+def ensure_collection():
+    """Verifica (y migra) el esquema de la colección una vez por proceso"""
+    schema.ensure()
+
+def get_id(text: str) -> int:
+    """Genera un ID único a partir del contenido (PDF page text o URL)"""
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % (10**16)
+
+def _upsert_points(points: list[PointStruct]) -> int:
+    """
+    Inserta los puntos con el escritor masivo (lotes en paralelo); en modo
+    compacto el texto va antes al almacén local. Retorna cuántos se
+    insertaron; si alguno no quedó escrito lanza BulkWriteError.
+    """
+    if not points:
+        logger.info("ℹ️ No hay puntos nuevos para insertar")
+        return 0
+    if COMPACT:
+        get_chunk_store().put_many((p.id, p.payload["content"]) for p in points)
+    for point in points:
+        point.payload = slim_payload(point.payload)
+    try:
+        stats = writer.write(points)
+    except BulkWriteError as e:
+        logger.error(f"❌ Error al insertar puntos: {e}")
+        schema.invalidate()
+        raise
+    logger.info(
+        f"✅ Se insertaron {stats['written']} puntos en Qdrant ({stats['points_per_s']} puntos/s, "
+        f"{stats['workers']} hilos, lote {stats['batch_size']})"
+    )
+    return stats["written"]
+
+def _filter_existing_ids(ids: list[int]) -> set[int]:
+    """Devuelve los IDs que ya existen en la colección"""
+    try:
+        return writer.existing_ids(ids)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo filtrar IDs existentes: {e}")
+        schema.invalidate()
+        return set()
+
+# ===============================
+# Funciones principales
+# ===============================
+def index_pdf_chunks(pdf_data: list[dict]) -> int:
+    """
+    Indexa el contenido de PDFs en Qdrant, un punto por fragmento de página
+    (ventana de tokens con solapamiento). Los fragmentos se generan y se
+    procesan por lotes. Retorna la cantidad de puntos nuevos.
+    """
+    ensure_collection()
+
+    inserted = 0
+    chunks = iter_pdf_chunks(pdf_data, embedding_service.token_lengths)
+    while True:
+        batch = list(islice(chunks, INDEX_BATCH_CHUNKS))
+        if not batch:
+            break
+
+        id_to_content = {}
+        for chunk in batch:
+            # Con el nombre completo del blob, PDFs homónimos en carpetas distintas no colisionan
+            uid = get_id(f"{chunk['blob'] or chunk['filename']}-{chunk['page']}-{chunk['start']}-{chunk['content']}")
+            id_to_content[uid] = {
+                "type": "pdf",
+                "filename": chunk["filename"],
+                "blob": chunk["blob"],
+                "url": None,
+                "title": chunk["title"],
+                "page": chunk["page"],
+                "chunk": chunk["chunk"],
+                "start": chunk["start"],
+                "end": chunk["end"],
+                "score": None,
+                "content": chunk["content"],
+            }
+
+        existing_ids = _filter_existing_ids(list(id_to_content.keys()))
+        new_ids = list(set(id_to_content.keys()) - existing_ids)
+
+        # Batch encoding
+        texts = [id_to_content[uid]["content"] for uid in new_ids]
+        if texts:
+            with span("embed_documents"):
+                vectors = embedding_service.encode_documents(texts).tolist()
+            new_points = [
+                PointStruct(
+                    id=uid,
+                    vector=vec,
+                    payload=id_to_content[uid]
+                )
+                for uid, vec in zip(new_ids, vectors)
+            ]
+            inserted += _upsert_points(new_points)
+
+        # El índice léxico cubre los puntos que ya existían y los recién escritos; si
+        # la escritura falla, _upsert_points lanza y el lote no entra a BM25
+        bm25_index.add_many((uid, p["content"]) for uid, p in id_to_content.items())
+
+    # Cambió el corpus: las respuestas cacheadas pueden quedar desactualizadas
+    if inserted:
+        bump_corpus_version()
+    return inserted
+
+def index_web_papers(web_papers: list[dict]) -> int:
+    """Indexa papers web en Qdrant. Retorna la cantidad de puntos nuevos"""
+    ensure_collection()
+
+    id_to_paper = {}
+    for paper in web_papers:
+        snippet = paper["snippet"].strip()
+        if not snippet:
+            continue
+        uid = get_id(paper["url"])
+        id_to_paper[uid] = {
+            "type": "web",
+            "filename": None,
+            "url": paper["url"],
+            "title": paper.get("title", ""),
+            "page": 1,
+            "score": paper.get("score", 0),
+            "content": snippet,
+        }
+
+    existing_ids = _filter_existing_ids(list(id_to_paper.keys()))
+    new_ids = list(set(id_to_paper.keys()) - existing_ids)
+
+    # Batch encoding
+    inserted = 0
+    texts = [id_to_paper[uid]["content"] for uid in new_ids]
+    if texts:
+        with span("embed_documents"):
+            vectors = embedding_service.encode_documents(texts).tolist()
+        new_points = [
+            PointStruct(
+                id=uid,
+                vector=vec,
+                payload=id_to_paper[uid]
+            )
+            for uid, vec in zip(new_ids, vectors)
+        ]
+        inserted = _upsert_points(new_points)
+
+    # El índice léxico, solo después de escribir en Qdrant (igual que en index_pdf_chunks)
+    bm25_index.add_many((uid, p["content"]) for uid, p in id_to_paper.items())
+    if inserted:
+        # Los papers nuevos ya son recuperables: las respuestas cacheadas quedan obsoletas
+        bump_corpus_version()
+    return inserted
+
+def _to_result(point_id, payload: dict, score: float) -> dict:
+    payload = payload or {}
+    return {
+        "id": point_id,
+        "type": payload.get("type"),
+        "filename": payload.get("filename"),
+        "url": payload.get("url"),
+        "source": payload.get("filename") if payload.get("type") == "pdf" else payload.get("url"),
+        "title": payload.get("title"),
+        "page": payload.get("page"),
+        "start": payload.get("start"),
+        "end": payload.get("end"),
+        "score": score,
+        "content": payload.get("content")
+    }
+
+
+def _content_from_store(results: list[dict]) -> list:
+    """Completa desde el almacén local el texto que el payload no trae; retorna los IDs que siguen sin texto"""
+    missing = [r["id"] for r in results if r["content"] is None]
+    stored = get_chunk_store().get_many(missing) if missing else {}
+    for result in results:
+        if result["content"] is None and result["id"] in stored:
+            result["content"] = stored[result["id"]]
+    return [pid for pid in missing if pid not in stored]
+
+
+def _drop_without_content(results: list[dict], points) -> list[dict]:
+    """Completa con el texto recuperado de Qdrant y descarta los resultados que siguen sin él"""
+    fetched = {p.id: (p.payload or {}).get("content") for p in points}
+    kept = []
+    for result in results:
+        if result["content"] is None:
+            result["content"] = fetched.get(result["id"])
+        if result["content"] is None:
+            # Almacén local de otra instancia o borrado: mejor sin el pasaje que con uno vacío
+            logger.warning(f"⚠️ Fragmento {result['id']} sin texto en Qdrant ni en el almacén local; se descarta")
+            continue
+        kept.append(result)
+    return kept
+
+
+def _attach_content(results: list[dict]) -> list[dict]:
+    """Completa el texto de los resultados cuyo payload no lo trae: almacén local y, si falta, Qdrant"""
+    missing = _content_from_store(results)
+    points = []
+    if missing:
+        try:
+            with span("qdrant_retrieve"):
+                points = get_qdrant_client().retrieve(collection_name=COLLECTION_NAME, ids=missing, with_payload=["content"])
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo recuperar el texto de {len(missing)} fragmentos: {e}")
+    return _drop_without_content(results, points)
+
+
+async def _aattach_content(results: list[dict]) -> list[dict]:
+    """Igual que _attach_content, con Qdrant asíncrono"""
+    missing = _content_from_store(results)
+    points = []
+    if missing:
+        try:
+            with span("qdrant_retrieve"):
+                points = await get_async_qdrant_client().retrieve(
+                    collection_name=COLLECTION_NAME, ids=missing, with_payload=["content"]
+                )
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo recuperar el texto de {len(missing)} fragmentos: {e}")
+    return _drop_without_content(results, points)
+
+
+@timed("embed_query")
+def _embed_query(query: str):
+    return embedding_service.encode_query(query)
+
+
+@timed("bm25_search")
+def _bm25_search(query: str, top_k: int):
+    return bm25_index.search(query, top_k)
+
+
+def _type_filter(doc_type: str = None):
+    # PDFs y papers web comparten colección: sin filtro se busca en ambos
+    if not doc_type:
+        return None
+    return Filter(must=[FieldCondition(key="type", match=MatchValue(value=doc_type))])
+
+
+def _dense_search(query: str, top_k: int, doc_type: str = None) -> list:
+    query_vector = _embed_query(query).tolist()
+    with span("qdrant_search"):
+        return get_qdrant_client().query_points(
+            collection_name=COLLECTION_NAME,
+            query=query_vector,
+            query_filter=_type_filter(doc_type),
+            limit=top_k,
+            with_payload=RESULT_FIELDS,
+            search_params=search_params()
+        ).points
+
+
+def search_qdrant(query: str, top_k: int = 5, doc_type: str = None) -> list[dict]:
+    """Busca en Qdrant y devuelve resultados (lista vacía si la búsqueda falla). `doc_type` restringe a "pdf" o "web"."""
+    ensure_collection()
+    try:
+        hits = _dense_search(query, top_k, doc_type)
+    except Exception as e:
+        logger.error(f"❌ Error en búsqueda Qdrant: {e}")
+        schema.invalidate()
+        return []
+    return _attach_content([_to_result(hit.id, hit.payload, hit.score) for hit in hits])
+
+
+def _fuse(dense_hits, lexical_hits, top_k: int):
+    """Reciprocal Rank Fusion de ambas listas. Retorna (ids, scores_rrf, payloads, scores_densos)."""
+    fused = {}
+    payloads = {}
+    dense_scores = {}
+    for rank, hit in enumerate(dense_hits):
+        fused[hit.id] = fused.get(hit.id, 0.0) + 1 / (RRF_K + rank + 1)
+        payloads[hit.id] = hit.payload
+        dense_scores[hit.id] = hit.score
+    for rank, (point_id, _) in enumerate(lexical_hits):
+        fused[point_id] = fused.get(point_id, 0.0) + 1 / (RRF_K + rank + 1)
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return best, fused, payloads, dense_scores
+
+
+def _retrieve_payloads(point_ids: list) -> dict:
+    """{id: payload} de los puntos pedidos; vacío si no hay IDs o Qdrant falla"""
+    if not point_ids:
+        return {}
+    try:
+        with span("qdrant_retrieve"):
+            points = get_qdrant_client().retrieve(collection_name=COLLECTION_NAME, ids=point_ids, with_payload=RESULT_FIELDS)
+        return {point.id: point.payload for point in points}
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron recuperar payloads de BM25: {e}")
+        schema.invalidate()
+        return {}
+
+
+async def _aretrieve_payloads(point_ids: list) -> dict:
+    """Igual que _retrieve_payloads, con Qdrant asíncrono"""
+    if not point_ids:
+        return {}
+    try:
+        with span("qdrant_retrieve"):
+            points = await get_async_qdrant_client().retrieve(collection_name=COLLECTION_NAME, ids=point_ids, with_payload=RESULT_FIELDS)
+        return {point.id: point.payload for point in points}
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron recuperar payloads de BM25: {e}")
+        schema.invalidate()
+        return {}
+
+
+def _lexical_of_type(lexical_hits, dense_hits, payloads: dict, doc_type: str):
+    """
+    El índice BM25 no distingue PDFs de papers web: se descartan los
+    aciertos léxicos de otro tipo antes de fusionar. Los que también
+    salieron en la búsqueda densa ya pasaron el filtro de Qdrant.
+    """
+    dense_ids = {hit.id for hit in dense_hits}
+    return [
+        (pid, score) for pid, score in lexical_hits
+        if pid in dense_ids or (payloads.get(pid) or {}).get("type") == doc_type
+    ]
+
+
+def _hybrid_results(best, fused, payloads, dense_scores) -> list[dict]:
+    results = []
+    for pid in best:
+        if pid not in payloads:
+            continue
+        result = _to_result(pid, payloads[pid], fused[pid])
+        result["dense_score"] = dense_scores.get(pid)
+        results.append(result)
+    return results
+
+
+def hybrid_search(query: str, top_k: int = 5, doc_type: str = None) -> list[dict]:
+    """
+    Fusiona la búsqueda densa de Qdrant con BM25 mediante Reciprocal Rank
+    Fusion. El score devuelto es el de RRF; el coseno queda en 'dense_score'.
+    Con `doc_type` ambas ramas se restringen a ese tipo de fragmento.
+    """
+    if not HYBRID_SEARCH or not len(bm25_index):
+        return search_qdrant(query, top_k, doc_type)
+
+    ensure_collection()
+    n_candidates = top_k * HYBRID_CANDIDATES
+    try:
+        dense_hits = _dense_search(query, n_candidates, doc_type)
+    except Exception as e:
+        logger.error(f"❌ Error en búsqueda Qdrant: {e}")
+        schema.invalidate()
+        dense_hits = []
+    lexical_hits = _bm25_search(query, n_candidates)
+    lexical_payloads = {}
+    if doc_type:
+        dense_ids = {hit.id for hit in dense_hits}
+        lexical_payloads = _retrieve_payloads([pid for pid, _ in lexical_hits if pid not in dense_ids])
+        lexical_hits = _lexical_of_type(lexical_hits, dense_hits, lexical_payloads, doc_type)
+    best, fused, payloads, dense_scores = _fuse(dense_hits, lexical_hits, top_k)
+    payloads.update(lexical_payloads)
+
+    # Los aciertos solo léxicos se completan con su payload desde Qdrant
+    payloads.update(_retrieve_payloads([pid for pid in best if pid not in payloads]))
+
+    return _attach_content(_hybrid_results(best, fused, payloads, dense_scores))
+
+# ===============================
+# Búsqueda sin bloquear el event loop
+# ===============================
+async def asearch_qdrant(query: str, top_k: int = 5, doc_type: str = None) -> list[dict]:
+    """Igual que search_qdrant, con el embedding en el pool de CPU y Qdrant asíncrono"""
+    if not schema.verified:
+        await run_io(schema.ensure)
+    query_vector = await run_cpu(_embed_query, query)
+    try:
+        with span("qdrant_search"):
+            response = await get_async_qdrant_client().query_points(
+                collection_name=COLLECTION_NAME,
+                query=query_vector.tolist(),
+                query_filter=_type_filter(doc_type),
+                limit=top_k,
+                with_payload=RESULT_FIELDS,
+                search_params=search_params()
+            )
+    except Exception as e:
+        logger.error(f"❌ Error en búsqueda Qdrant: {e}")
+        schema.invalidate()
+        return []
+    return await _aattach_content([_to_result(hit.id, hit.payload, hit.score) for hit in response.points])
+
+
+async def ahybrid_search(query: str, top_k: int = 5, doc_type: str = None) -> list[dict]:
+    """Igual que hybrid_search: embedding y BM25 en paralelo en el pool de CPU, Qdrant asíncrono"""
+    if not HYBRID_SEARCH or not len(bm25_index):
+        return await asearch_qdrant(query, top_k, doc_type)
+
+    if not schema.verified:
+        await run_io(schema.ensure)
+    n_candidates = top_k * HYBRID_CANDIDATES
+    query_vector, lexical_hits = await asyncio.gather(
+        run_cpu(_embed_query, query),
+        run_cpu(_bm25_search, query, n_candidates)
+    )
+    try:
+        with span("qdrant_search"):
+            dense_hits = (await get_async_qdrant_client().query_points(
+                collection_name=COLLECTION_NAME,
+                query=query_vector.tolist(),
+                query_filter=_type_filter(doc_type),
+                limit=n_candidates,
+                with_payload=RESULT_FIELDS,
+                search_params=search_params()
+            )).points
+    except Exception as e:
+        logger.error(f"❌ Error en búsqueda Qdrant: {e}")
+        schema.invalidate()
+        dense_hits = []
+    lexical_payloads = {}
+    if doc_type:
+        dense_ids = {hit.id for hit in dense_hits}
+        lexical_payloads = await _aretrieve_payloads([pid for pid, _ in lexical_hits if pid not in dense_ids])
+        lexical_hits = _lexical_of_type(lexical_hits, dense_hits, lexical_payloads, doc_type)
+    best, fused, payloads, dense_scores = _fuse(dense_hits, lexical_hits, top_k)
+    payloads.update(lexical_payloads)
+
+    payloads.update(await _aretrieve_payloads([pid for pid in best if pid not in payloads]))
+
+    return await _aattach_content(_hybrid_results(best, fused, payloads, dense_scores))
+
+
+def rebuild_bm25_index(batch_size: int = 1000) -> int:
+    """Reconstruye el índice BM25 recorriendo la colección (si está vacío o se perdió)."""
+    ensure_collection()
+    offset = None
+    added = 0
+    while True:
+        points, offset = get_qdrant_client().scroll(
+            collection_name=COLLECTION_NAME,
+            limit=batch_size,
+            offset=offset,
+            with_payload=["content"],
+            with_vectors=False
+        )
+        # Los puntos compactados no traen el texto: se lee del almacén local
+        stored = get_chunk_store().get_many([p.id for p in points if "content" not in (p.payload or {})])
+        added += bm25_index.add_many(
+            (p.id, (p.payload or {}).get("content", stored.get(p.id, ""))) for p in points
+        )
+        if offset is None:
+            break
+    bm25_index.flush()
+    logger.info(f"✅ Índice BM25 reconstruido con {added} fragmentos")
+    return added
+
+# ===============================
+# Exports
+# ===============================
+__all__ = [
+    "COLLECTION_NAME",
+    "index_pdf_chunks",
+    "index_web_papers",
+    "ensure_collection",
+    "schema",
+    "writer",
+    "search_qdrant",
+    "hybrid_search",
+    "asearch_qdrant",
+    "ahybrid_search",
+    "rebuild_bm25_index"
+]
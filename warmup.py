@@ -0,0 +1,92 @@
+# Calentamiento en segundo plano (modelos, verificación de Qdrant, pool de
+# navegadores) después de que la app empieza a escuchar, y su estado para
+# las sondas de liveness y readiness
+
+import os
+import time
+import threading
+
+# ===============================
+# Configuración
+# ===============================
+# Espera entre reintentos de una tarea requerida que falló (p. ej. Qdrant caído)
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "10"))
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class WarmUp:
+    """
+    Tareas con nombre que corren cada una en su hilo. La app está lista
+    cuando terminaron todas las requeridas; una requerida que falla se
+    reintenta cada WARMUP_RETRY_INTERVAL segundos y una opcional no. `after`
+    hace que una tarea espere a otra (y se omita si esa falla).
+    """
+
+    def __init__(self, retry_interval: float = WARMUP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self.started_at = time.monotonic()
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def add(self, name: str, fn, required: bool = True, after: str = None):
+        self._tasks[name] = {
+            "fn": fn,
+            "required": required,
+            "after": after,
+            "done": threading.Event(),
+            "state": {"status": PENDING, "required": required, "attempts": 0},
+        }
+
+    def start(self):
+        self._stop_event.clear()
+        for name in self._tasks:
+            threading.Thread(target=self._run, args=(name,), name=f"warm-up-{name}", daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _set(self, name: str, **fields):
+        with self._lock:
+            self._tasks[name]["state"].update(fields)
+
+    def _run(self, name: str):
+        task = self._tasks[name]
+        after = self._tasks.get(task["after"])
+        if after is not None:
+            after["done"].wait()
+            if after["state"]["status"] != READY:
+                self._set(name, status=SKIPPED, error=f"{task['after']} no está listo")
+                task["done"].set()
+                return
+
+        while not self._stop_event.is_set():
+            t0 = time.perf_counter()
+            self._set(name, status=RUNNING, attempts=task["state"]["attempts"] + 1)
+            try:
+                task["fn"]()
+            except Exception as e:
+                self._set(name, status=FAILED, error=str(e), seconds=round(time.perf_counter() - t0, 3))
+                print(f"⚠️ Calentamiento de {name} falló: {e}")
+                if not task["required"]:
+                    break
+                self._stop_event.wait(self.retry_interval)
+                continue
+            self._set(name, status=READY, error=None, seconds=round(time.perf_counter() - t0, 3))
+            print(f"🔥 {name} listo en {task['state']['seconds']}s")
+            break
+        task["done"].set()
+
+    def status(self) -> dict:
+        with self._lock:
+            tasks = {name: dict(t["state"]) for name, t in self._tasks.items()}
+        return {
+            "ready": all(t["status"] == READY for t in tasks.values() if t["required"]),
+            "uptime_s": round(time.monotonic() - self.started_at, 1),
+            "tasks": tasks,
+        }
@@ -1,140 +1,332 @@
-from openai import AzureOpenAI
-from typing import List, Dict
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-import time
-import os
-import json
-
-# ---------------------------
-# Configuración desde variables de entorno
-# ---------------------------
-api_key = os.getenv("OPEN_AI_API_KEY_1")
-endpoint = os.getenv("OPEN_AI_ENDPOINT")
-deployment = os.getenv("OPEN_AI_DEPLOYMENT")
-
-if not api_key or not endpoint or not deployment:
-    raise ValueError("Faltan OPEN_AI_API_KEY_1, OPEN_AI_ENDPOINT o OPEN_AI_DEPLOYMENT")
-
-# Cliente Azure OpenAI
-client = AzureOpenAI(
-    api_key=api_key,
-    api_version="2024-12-01-preview",
-    azure_endpoint=endpoint
-)
-
-# ---------------------------
-# Funciones de búsqueda web con Selenium
-# ---------------------------
-def get_web_papers_selenium(query: str, max_pages: int = 2) -> List[Dict]:
-    base_url = "https://scholar.google.com/scholar"
-    options = Options()
-    options.add_argument("--headless=new")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-extensions")
-    driver = webdriver.Chrome(options=options)
-
-    results = []
-    for page in range(max_pages):
-        start = page * 10
-        search_url = f"{base_url}?q={query.replace(' ', '+')}&start={start}"
-        driver.get(search_url)
-        time.sleep(3)
-
-        articles = driver.find_elements(By.CSS_SELECTOR, "div.gs_ri")
-        for art in articles:
-            try:
-                title_elem = art.find_element(By.CSS_SELECTOR, "h3 a")
-                title = title_elem.text.strip()
-                url = title_elem.get_attribute("href")
-                snippet_elem = art.find_elements(By.CLASS_NAME, "gs_rs")
-                snippet = snippet_elem[0].text.strip() if snippet_elem else "No hay resumen disponible."
-                results.append({
-                    "title": title,
-                    "url": url,
-                    "snippet": snippet,
-                    "page": page + 1
-                })
-            except Exception:
-                continue
-    driver.quit()
-    return results
-
-# ---------------------------
-# División segura de texto
-# ---------------------------
-def chunk_text_for_tokens(items: List[Dict], max_chars: int = 2000) -> List[str]:
-    """
-    Divide los resultados en bloques pequeños (máx 2000 caracteres).
-    """
-    chunks = []
-    current_chunk = ""
-    for item in items:
-        snippet_text = f"Título: {item['title']}\nResumen: {item.get('snippet', item.get('content',''))}\nURL: {item['url']}\n\n"
-        if len(current_chunk) + len(snippet_text) > max_chars:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = snippet_text
-        else:
-            current_chunk += snippet_text
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
-
-# ---------------------------
-# Resumen seguro
-# ---------------------------
-def get_annotated_summary(query: str) -> str:
-    """
-    Devuelve SIEMPRE un string JSON con la forma:
-    {"content": "<texto>", "role": "assistant"}
-    """
-    try:
-        papers = get_web_papers_selenium(query)
-        if not papers:
-            return json.dumps(
-                {"content": "No se encontraron artículos.", "role": "assistant"},
-                ensure_ascii=False
-            )
-
-        text_chunks = chunk_text_for_tokens(papers, max_chars=2000)
-
-        # Tomamos solo el primer chunk para evitar sobrepasar contexto
-        full_prompt = f"""
-Analiza los siguientes artículos de Google Scholar y resume en máximo 3 párrafos:
-
-{text_chunks[0]}
-""".strip()
-
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=[
-                {"role": "system", "content": "Eres un asistente que resume papers académicos."},
-                {"role": "user", "content": full_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=300,  
-            top_p=1.0
-        )
-
-        # Ajuste seguro para extraer el mensaje
-        choice = response.choices[0]
-        msg = getattr(choice, "message", None)
-
-        if msg and isinstance(msg, dict):
-            content = msg.get("content", "No se recibió respuesta.").replace("\x00", "").strip()
-            role = msg.get("role", "assistant")
-        else:
-            content = "No se recibió respuesta."
-            role = "assistant"
-
-        return json.dumps({"content": content, "role": role}, ensure_ascii=False)
-
-    except Exception as e:
-        return json.dumps(
-            {"content": f"Error procesando la búsqueda: {str(e)}", "role": "assistant"},
-            ensure_ascii=False
-        )
+from typing import List, Dict
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from cache import TTLCache, normalize_text
+from metrics import span, timed
+from clients import get_openai_client, openai_deployment
+import urllib.parse
+import contextvars
+import threading
+import queue
+import time
+import os
+import json
+
+# ---------------------------
+# Pool de navegadores para Google Scholar
+# ---------------------------
+POOL_SIZE = int(os.getenv("SCHOLAR_POOL_SIZE", "2"))
+DRIVER_MAX_USES = int(os.getenv("SCHOLAR_DRIVER_MAX_USES", "50"))
+PAGE_TIMEOUT = float(os.getenv("SCHOLAR_PAGE_TIMEOUT", "10"))
+ACQUIRE_TIMEOUT = float(os.getenv("SCHOLAR_ACQUIRE_TIMEOUT", "30"))
+
+# La página está lista cuando aparecen resultados, el contenedor vacío o un captcha
+RESULTS_READY = EC.any_of(
+    EC.presence_of_element_located((By.CSS_SELECTOR, "div.gs_ri")),
+    EC.presence_of_element_located((By.ID, "gs_res_ccl_mid")),
+    EC.presence_of_element_located((By.ID, "gs_captcha_ccl")),
+)
+
+
+class SearchCancelled(Exception):
+    """La búsqueda se abandonó (p. ej. agotó su timeout en el planificador)."""
+
+
+def _new_driver():
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.page_load_strategy = "eager"
+    return webdriver.Chrome(options=options)
+
+
+class BrowserPool:
+    """
+    Pool de Chrome headless reutilizables. Cada driver se verifica antes de
+    entregarse y se recicla tras `max_uses` usos o si deja de responder.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_uses: int = DRIVER_MAX_USES, factory=_new_driver):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.factory = factory
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._uses = {}
+        self._closed = False
+
+    def warm_up(self):
+        """Arranca los drivers por adelantado para que la primera consulta no pague el inicio."""
+        started = []
+        for _ in range(self.size):
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                started.append(self._checkout())
+            except Exception as e:
+                self._slots.release()
+                print(f"⚠️ No se pudo iniciar Chrome: {e}")
+                break
+        for driver in started:
+            self._checkin(driver, used=False)
+        print(f"🌐 Pool de navegadores listo ({len(started)}/{self.size})")
+
+    def _healthy(self, driver) -> bool:
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self.factory()
+                with self._lock:
+                    self._uses[id(driver)] = 0
+                return driver
+            if self._healthy(driver):
+                return driver
+            print("♻️ Driver sin respuesta, se reemplaza")
+            self._discard(driver)
+
+    def _checkin(self, driver, broken: bool = False, used: bool = True):
+        with self._lock:
+            uses = self._uses.get(id(driver), 0) + int(used)
+            self._uses[id(driver)] = uses
+        if broken or self._closed or uses >= self.max_uses:
+            self._discard(driver)
+        else:
+            self._idle.put(driver)
+        self._slots.release()
+
+    def _acquire(self, timeout: float, cancelled: threading.Event = None) -> bool:
+        # Se espera en tramos cortos para dejar de esperar si la búsqueda se canceló
+        deadline = time.monotonic() + timeout
+        while not (cancelled and cancelled.is_set()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._slots.acquire(timeout=min(remaining, 0.25)):
+                return True
+        raise SearchCancelled()
+
+    @contextmanager
+    def driver(self, timeout: float = ACQUIRE_TIMEOUT, cancelled: threading.Event = None):
+        """Presta un driver del pool; se devuelve (o recicla) al salir."""
+        with span("browser_acquire"):
+            if not self._acquire(timeout, cancelled):
+                raise TimeoutError("❌ No hay navegadores disponibles en el pool")
+            try:
+                driver = self._checkout()
+            except Exception:
+                self._slots.release()
+                raise
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self._checkin(driver, broken=broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+browser_pool = BrowserPool()
+
+# ---------------------------
+# Funciones de búsqueda web con Selenium
+# ---------------------------
+def _fetch_scholar_page(query: str, page: int, cancelled: threading.Event = None) -> List[Dict]:
+    base_url = "https://scholar.google.com/scholar"
+    search_url = f"{base_url}?q={urllib.parse.quote_plus(query)}&start={page * 10}"
+
+    results = []
+    with browser_pool.driver(cancelled=cancelled) as driver, span("scholar_page"):
+        if cancelled and cancelled.is_set():
+            raise SearchCancelled()
+        driver.get(search_url)
+        try:
+            # La espera también termina si se cancela la búsqueda, para liberar el driver
+            WebDriverWait(driver, PAGE_TIMEOUT).until(
+                lambda d: (cancelled is not None and cancelled.is_set()) or RESULTS_READY(d)
+            )
+        except TimeoutException:
+            print(f"⚠️ Scholar no respondió en {PAGE_TIMEOUT}s (página {page + 1})")
+        if cancelled and cancelled.is_set():
+            raise SearchCancelled()
+
+        articles = driver.find_elements(By.CSS_SELECTOR, "div.gs_ri")
+        for art in articles:
+            try:
+                title_elem = art.find_element(By.CSS_SELECTOR, "h3 a")
+                title = title_elem.text.strip()
+                url = title_elem.get_attribute("href")
+                snippet_elem = art.find_elements(By.CLASS_NAME, "gs_rs")
+                snippet = snippet_elem[0].text.strip() if snippet_elem else "No hay resumen disponible."
+                results.append({
+                    "title": title,
+                    "url": url,
+                    "snippet": snippet,
+                    "page": page + 1
+                })
+            except Exception:
+                continue
+    return results
+
+
+def get_web_papers_selenium(query: str, max_pages: int = 2, cancelled: threading.Event = None) -> List[Dict]:
+    """
+    Consulta las páginas de resultados en paralelo usando drivers del pool.
+    Si `cancelled` se activa, las páginas pendientes se abandonan y liberan su driver.
+    """
+    if max_pages <= 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max_pages) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _fetch_scholar_page, query, page, cancelled)
+            for page in range(max_pages)
+        ]
+
+    results = []
+    for future in futures:
+        try:
+            results.extend(future.result())
+        except SearchCancelled:
+            continue
+        except Exception as e:
+            print(f"⚠️ Error consultando Scholar: {e}")
+    return results
+
+# ---------------------------
+# Caché de resultados de búsqueda
+# ---------------------------
+search_cache = TTLCache(
+    "web_search",
+    max_size=int(os.getenv("SEARCH_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "86400")),
+    persist_path=os.getenv("SEARCH_CACHE_PATH") or None
+)
+
+
+@timed("web_search")
+def search_web_papers(query: str, max_pages: int = 2, cancelled: threading.Event = None) -> tuple[List[Dict], bool]:
+    """
+    Resultados de Scholar con caché por consulta normalizada.
+    Retorna (papers, desde_cache); en un acierto no se abre el navegador.
+    Una búsqueda cancelada no se guarda en caché (puede estar incompleta).
+    """
+    key = f"{max_pages}:{normalize_text(query)}"
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    papers = get_web_papers_selenium(query, max_pages=max_pages, cancelled=cancelled)
+    # Sin resultados suele ser captcha o fallo transitorio: no se guarda
+    if papers and not (cancelled and cancelled.is_set()):
+        search_cache.set(key, papers)
+    return papers, False
+
+# ---------------------------
+# División segura de texto
+# ---------------------------
+def chunk_text_for_tokens(items: List[Dict], max_chars: int = 2000) -> List[str]:
+    """
+    Divide los resultados en bloques pequeños (máx 2000 caracteres).
+    """
+    chunks = []
+    current_chunk = ""
+    for item in items:
+        snippet_text = f"Título: {item['title']}\nResumen: {item.get('snippet', item.get('content',''))}\nURL: {item['url']}\n\n"
+        if len(current_chunk) + len(snippet_text) > max_chars:
+            if current_chunk:
+                chunks.append(current_chunk)
+            current_chunk = snippet_text
+        else:
+            current_chunk += snippet_text
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+# ---------------------------
+# Resumen seguro
+# ---------------------------
+def get_annotated_summary(query: str) -> str:
+    """
+    Devuelve SIEMPRE un string JSON con la forma:
+    {"content": "<texto>", "role": "assistant"}
+    """
+    try:
+        papers = get_web_papers_selenium(query)
+        if not papers:
+            return json.dumps(
+                {"content": "No se encontraron artículos.", "role": "assistant"},
+                ensure_ascii=False
+            )
+
+        text_chunks = chunk_text_for_tokens(papers, max_chars=2000)
+
+        # Tomamos solo el primer chunk para evitar sobrepasar contexto
+        full_prompt = f"""
+Analiza los siguientes artículos de Google Scholar y resume en máximo 3 párrafos:
+
+{text_chunks[0]}
+""".strip()
+
+        response = get_openai_client().chat.completions.create(
+            model=openai_deployment(),
+            messages=[
+                {"role": "system", "content": "Eres un asistente que resume papers académicos."},
+                {"role": "user", "content": full_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=300,  
+            top_p=1.0
+        )
+
+        # Ajuste seguro para extraer el mensaje
+        choice = response.choices[0]
+        msg = getattr(choice, "message", None)
+
+        if msg and isinstance(msg, dict):
+            content = msg.get("content", "No se recibió respuesta.").replace("\x00", "").strip()
+            role = msg.get("role", "assistant")
+        else:
+            content = "No se recibió respuesta."
+            role = "assistant"
+
+        return json.dumps({"content": content, "role": role}, ensure_ascii=False)
+
+    except Exception as e:
+        return json.dumps(
+            {"content": f"Error procesando la búsqueda: {str(e)}", "role": "assistant"},
+            ensure_ascii=False
+        )